@@ -0,0 +1,232 @@
+"""Cache de vídeos processados endereçado por conteúdo.
+
+Chave = sha256 da fonte + hash do perfil de encode efetivo (altura alvo,
+bitrates, limites de duração, preset/CRF...). Reenvios e retentativas do
+mesmo vídeo com o mesmo perfil reaproveitam o resultado em vez de
+recodificar.
+
+Layout em ``PROCESSED_DIR/store``::
+
+    ab/abcdef..._<perfil>.mp4    # hardlink (ou cópia) do final
+    ab/abcdef..._<perfil>.json   # relatório do ensure_shopee_ready
+    ab/abcdef..._<perfil>.jpg    # miniatura (quando gerada)
+    ab/abcdef..._<perfil>.r-<nome>.mp4  # renditions extras (RENDITIONS)
+
+As entradas são hardlinks dos finais em ``PROCESSED_DIR``: remover uma entrada
+do store não apaga o arquivo de um registro e vice-versa. O acesso atualiza o
+mtime da entrada (LRU); ``evict`` remove as menos usadas até caber em
+``ARTIFACT_STORE_MAX_GB``.
+
+Só entram no store finais que passaram na validação do ``ensure_shopee_ready``;
+ao reaproveitar, ``lookup`` confere o tamanho gravado e verifica o arquivo de
+novo (``verify`` do chamador), apagando a entrada truncada/corrompida.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from . import metrics
+from .config import settings
+from .fileutils import link_or_copy, rendition_path, thumbnail_path
+from .logs import get_logger
+
+log = get_logger(__name__, stage="store")
+
+# Incrementar quando a lógica do pipeline mudar a saída para o mesmo perfil
+PIPELINE_VERSION = 1
+
+_PROFILE_FIELDS = (
+    "VIDEO_TARGET_MIN_HEIGHT",
+    "VIDEO_MIN_BITRATE_KBPS",
+    "VIDEO_TARGET_BITRATE_KBPS",
+    "VIDEO_MIN_DURATION_SECONDS",
+    "VIDEO_MAX_DURATION_SECONDS",
+    "ENCODER_PRESET",
+    "ENCODER_CRF",
+    "ENCODER_AUTOTUNE",
+    "ENCODER_AUTOTUNE_SSIM_FLOOR",
+    "ENCODER_AUTOTUNE_PSNR_FLOOR",
+    "ENCODER_AUTOTUNE_CANDIDATES",
+    "ENCODER_AUTOTUNE_SAMPLE_SECONDS",
+    "UPSCALE_VIDEO2X_MIN_RATIO",
+    "PREFER_VIDEO2X_FIRST",
+    "VIDEO2X_DIR",
+    "RENDITIONS",
+    "SEND_THUMBNAIL",
+)
+
+_lock = threading.Lock()
+
+
+def store_dir() -> str:
+    return os.path.join(settings.PROCESSED_DIR, "store")
+
+
+def profile_key() -> str:
+    """Hash curto das configurações que afetam o arquivo final."""
+    profile = {name: getattr(settings, name, None) for name in _PROFILE_FIELDS}
+    profile["_version"] = PIPELINE_VERSION
+    raw = json.dumps(profile, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def _entry_paths(source_sha: str, profile: str) -> Tuple[str, str]:
+    base = os.path.join(store_dir(), source_sha[:2], f"{source_sha}_{profile}")
+    return base + ".mp4", base + ".json"
+
+
+def _rendition_entry(entry_path: str, name: str) -> str:
+    return os.path.splitext(entry_path)[0] + f".r-{name}.mp4"
+
+
+def lookup(source_sha: str, output_path: str, profile: Optional[str] = None,
+           verify: Optional[Callable[[str], bool]] = None) -> Optional[Dict[str, Any]]:
+    """Publica a entrada em cache em ``output_path`` e retorna o relatório salvo.
+
+    Retorna None quando não há entrada para a fonte/perfil ou quando a entrada
+    mudou de tamanho desde o ``put`` ou não passa em ``verify`` (nesses casos
+    ela é apagada do store).
+    """
+    if not settings.ARTIFACT_STORE_ENABLED:
+        return None
+    path, sidecar = _entry_paths(source_sha, profile or profile_key())
+    with _lock:
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            metrics.inc("shopee_artifact_store_total", labels={"result": "miss"})
+            return None
+        try:
+            with open(sidecar, "r", encoding="utf-8") as f:
+                rep = json.load(f)
+        except Exception:
+            rep = {}
+        # Tamanho gravado no put pega truncamento que o probe não vê (moov no início)
+        size_ok = rep.get("size_bytes") in (None, os.path.getsize(path))
+        if not size_ok or (verify is not None and not verify(path)):
+            log.warning("Entrada do cache de processados inválida, removendo: %s", os.path.basename(path))
+            extra = [_rendition_entry(path, name) for name in rep.get("renditions") or []]
+            for target in [path, sidecar, thumbnail_path(path)] + extra:
+                _remove_quiet(target)
+            metrics.inc("shopee_artifact_store_total", labels={"result": "invalid"})
+            return None
+        try:
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            if os.path.abspath(output_path) != os.path.abspath(path):
+                link_or_copy(path, output_path)
+                if os.path.exists(thumbnail_path(path)):
+                    link_or_copy(thumbnail_path(path), thumbnail_path(output_path))
+                    rep["thumbnail"] = thumbnail_path(output_path)
+                published = {}
+                for name in rep.get("renditions") or []:
+                    src = _rendition_entry(path, name)
+                    if os.path.exists(src):
+                        link_or_copy(src, rendition_path(output_path, name))
+                        published[name] = rendition_path(output_path, name)
+                rep["renditions"] = published
+            # Marca uso recente para o LRU
+            os.utime(path, None)
+        except OSError as e:
+            log.warning("Falha ao publicar entrada do cache: %s", e)
+            return None
+    metrics.inc("shopee_artifact_store_total", labels={"result": "hit"})
+    log.info("Cache de processados: %s", os.path.basename(path))
+    return rep
+
+
+def put(source_sha: str, final_path: str, rep: Dict[str, Any], profile: Optional[str] = None):
+    """Registra ``final_path`` no store (hardlink) e aplica a evicção."""
+    if not settings.ARTIFACT_STORE_ENABLED or not os.path.exists(final_path):
+        return
+    path, sidecar = _entry_paths(source_sha, profile or profile_key())
+    with _lock:
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            link_or_copy(final_path, path)
+            if rep.get("thumbnail") and os.path.exists(rep["thumbnail"]):
+                link_or_copy(rep["thumbnail"], thumbnail_path(path))
+            renditions = []
+            for name, rpath in (rep.get("renditions") or {}).items():
+                if os.path.exists(rpath):
+                    link_or_copy(rpath, _rendition_entry(path, name))
+                    renditions.append(name)
+            with open(sidecar + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({
+                    "stored_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "source_sha256": source_sha,
+                    "final": os.path.basename(final_path),
+                    "size_bytes": os.path.getsize(final_path),
+                    "steps": rep.get("steps"),
+                    "probe_after": rep.get("probe_after"),
+                    "renditions": renditions,
+                }, f, ensure_ascii=False, default=str)
+            os.replace(sidecar + ".tmp", sidecar)
+        except OSError as e:
+            log.warning("Falha ao gravar no cache de processados: %s", e)
+            return
+    evict(keep=path)
+
+
+def _remove_quiet(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def evict(max_bytes: Optional[int] = None, keep: Optional[str] = None) -> int:
+    """Remove as entradas menos usadas até o store caber em ``max_bytes``.
+
+    Retorna quantos bytes foram liberados.
+    """
+    if max_bytes is None:
+        max_bytes = int(settings.ARTIFACT_STORE_MAX_GB * 1024 ** 3)
+    root = store_dir()
+    if max_bytes <= 0 or not os.path.isdir(root):
+        return 0
+    with _lock:
+        entries = []
+        # Renditions (``.r-<nome>.mp4``) saem junto com a entrada principal
+        renditions: Dict[str, list] = {}
+        total = 0
+        for dirpath, _, files in os.walk(root):
+            for name in files:
+                if not name.endswith(".mp4"):
+                    continue
+                p = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    continue
+                total += st.st_size
+                if ".r-" in name:
+                    main = os.path.join(dirpath, name.split(".r-", 1)[0] + ".mp4")
+                    renditions.setdefault(main, []).append((st.st_size, p))
+                else:
+                    entries.append((st.st_mtime, st.st_size, p))
+        freed = 0
+        # Renditions órfãs (entrada principal já removida)
+        mains = {p for _, _, p in entries}
+        for main, items in renditions.items():
+            if main not in mains:
+                for size, p in items:
+                    _remove_quiet(p)
+                    total -= size
+                    freed += size
+        for _, size, p in sorted(entries):
+            if total <= max_bytes:
+                break
+            if keep and os.path.abspath(p) == os.path.abspath(keep):
+                continue
+            extra = renditions.get(p, [])
+            for target in [p, os.path.splitext(p)[0] + ".json", thumbnail_path(p)] + [rp for _, rp in extra]:
+                _remove_quiet(target)
+            size += sum(rs for rs, _ in extra)
+            total -= size
+            freed += size
+    if freed:
+        metrics.inc("shopee_artifact_store_evicted_bytes_total", freed)
+        log.info("Cache de processados: %.1f MB liberados", freed / (1024 * 1024))
+    metrics.set_gauge("shopee_artifact_store_bytes", total)
+    return freed
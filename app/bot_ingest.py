@@ -3,8 +3,12 @@ from typing import Optional
 from telegram import Update
 from telegram.ext import ApplicationBuilder, ContextTypes, MessageHandler, CommandHandler, filters
 
+from . import scheduling, telegram_api
 from .config import settings
 from .db import insert_original
+from .logs import get_logger
+
+log = get_logger(__name__, stage="bot")
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -34,13 +38,18 @@ async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     file_id = file.file_id
     rec_id = insert_original(source_type="telegram", source_url=None, telegram_file_id=file_id, original_path=None)
+    # Custo para a ordem da fila antes do download (documento não traz dimensões)
+    duration = getattr(file, "duration", None)
+    if hasattr(duration, "total_seconds"):
+        duration = duration.total_seconds()
+    scheduling.record_cost(rec_id, getattr(file, "width", None), getattr(file, "height", None), duration)
     await update.message.reply_text(f"[BOT] recebido id={rec_id}")
 
 
 def run_bot_asyncio():
     import asyncio
     if not settings.TELEGRAM_BOT_TOKEN:
-        print("[BOT] Token não configurado via env/app.config.")
+        log.error("Token não configurado via env/app.config.")
         return
     
     # Criar novo event loop para esta thread
@@ -49,15 +58,21 @@ def run_bot_asyncio():
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         
-        app = ApplicationBuilder().token(settings.TELEGRAM_BOT_TOKEN).build()
+        builder = ApplicationBuilder().token(settings.TELEGRAM_BOT_TOKEN)
+        if telegram_api.is_custom_server():
+            # Servidor Bot API próprio (sem limites de 20/50 MB da nuvem)
+            builder = builder.base_url(telegram_api.base_url() + "/bot").base_file_url(telegram_api.base_url() + "/file/bot")
+        if settings.TELEGRAM_LOCAL_MODE:
+            builder = builder.local_mode(True)
+        app = builder.build()
         app.add_handler(CommandHandler("start", start))
         app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
         app.add_handler(MessageHandler((filters.VIDEO | filters.Document.VIDEO), handle_video))
         
-        print("[BOT] Iniciando bot do Telegram...")
+        log.info("Iniciando bot do Telegram...")
         app.run_polling(close_loop=False)
     except Exception as e:
-        print(f"[BOT] erro ao iniciar: {e}")
+        log.exception("Erro ao iniciar: %s", e)
     finally:
         if loop:
             try:
@@ -0,0 +1,119 @@
+"""Checkpoints por etapa do pipeline: downloaded → probed → encoded → sent.
+
+Cada etapa concluída grava um checkpoint (tabela ``checkpoints``). Numa nova
+tentativa o pipeline retoma da primeira etapa incompleta: se só o envio
+falhou, o arquivo Shopee-ready já existente é reaproveitado e a tentativa
+custa uma chamada HTTP, não um novo encode.
+
+Os checkpoints são verificados antes de serem usados:
+
+- ``downloaded``: o original existe com o mesmo tamanho
+- ``probed``: há metadados (altura/duração) do original verificado
+- ``encoded``: o final existe, o sha256 confere e o perfil de encode
+  (``artifact_store.profile_key``) é o atual
+- ``sent``: terminal, não depende dos arquivos (a retenção pode tê-los apagado)
+
+Gravar uma etapa invalida as seguintes (ex.: novo download exige novo encode,
+novo encode exige novo envio).
+"""
+import json
+import os
+from typing import Any, Dict, Optional
+
+from . import artifact_store, metrics
+from .db import delete_checkpoints, select_checkpoints, upsert_checkpoint
+from .fileutils import file_sha256
+from .logs import get_logger
+
+log = get_logger(__name__, stage="checkpoint")
+
+STAGES = ("downloaded", "probed", "encoded", "sent")
+
+
+def _later(stage: str) -> tuple:
+    return STAGES[STAGES.index(stage) + 1:]
+
+
+def mark(record_id: int, stage: str, path: Optional[str] = None, meta: Optional[Dict[str, Any]] = None, sha256: Optional[str] = None):
+    """Registra a etapa como concluída e descarta os checkpoints seguintes."""
+    meta = dict(meta or {})
+    if path and os.path.exists(path):
+        meta.setdefault("size_bytes", os.path.getsize(path))
+    if stage == "encoded":
+        meta.setdefault("profile", artifact_store.profile_key())
+        if path and not sha256:
+            sha256 = file_sha256(path)
+    try:
+        upsert_checkpoint(record_id, stage, os.path.abspath(path) if path else None, sha256,
+                          json.dumps(meta, default=str), _later(stage))
+    except Exception as e:
+        # Checkpoint é otimização: falhar aqui não derruba o pipeline
+        log.warning("Falha ao gravar checkpoint %s: %s", stage, e, extra={"record_id": record_id})
+
+
+def _meta(row) -> Dict[str, Any]:
+    try:
+        return json.loads(row["meta"] or "{}")
+    except ValueError:
+        return {}
+
+
+def _valid(stage: str, row, meta: Dict[str, Any]) -> bool:
+    path = row["path"]
+    if stage == "sent":
+        return True
+    if stage == "probed":
+        return bool(meta.get("height")) and meta.get("duration") is not None
+    if not path or not os.path.exists(path):
+        return False
+    if meta.get("size_bytes") is not None and os.path.getsize(path) != meta["size_bytes"]:
+        return False
+    if stage == "encoded":
+        if meta.get("profile") != artifact_store.profile_key():
+            return False
+        return bool(row["sha256"]) and file_sha256(path) == row["sha256"]
+    return True
+
+
+def completed(record_id: int) -> Dict[str, Dict[str, Any]]:
+    """Etapas concluídas e ainda válidas.
+
+    Retorna ``{stage: {"path": ..., "sha256": ..., **meta}}``. Cada etapa é
+    verificada isoladamente (um ``encoded`` válido não depende do original
+    ainda existir); checkpoints que não passam na verificação são apagados.
+    """
+    try:
+        rows = {r["stage"]: r for r in select_checkpoints(record_id)}
+    except Exception as e:
+        log.warning("Falha ao ler checkpoints: %s", e, extra={"record_id": record_id})
+        return {}
+    if "sent" in rows:
+        row = rows["sent"]
+        return {"sent": dict(_meta(row), path=row["path"], sha256=row["sha256"])}
+    done: Dict[str, Dict[str, Any]] = {}
+    for stage in STAGES:
+        row = rows.get(stage)
+        if row is None:
+            continue
+        meta = _meta(row)
+        if not _valid(stage, row, meta):
+            log.info("Checkpoint %s inválido, etapa será refeita", stage, extra={"record_id": record_id})
+            metrics.inc("shopee_checkpoints_total", labels={"stage": stage, "result": "invalid"})
+            try:
+                delete_checkpoints(record_id, (stage,))
+            except Exception:
+                pass
+            continue
+        done[stage] = dict(meta, path=row["path"], sha256=row["sha256"])
+    return done
+
+
+def resume_stage(record_id: int) -> Optional[str]:
+    """Primeira etapa incompleta do registro (None se já foi enviado)."""
+    done = completed(record_id)
+    if "sent" in done:
+        return None
+    for stage in STAGES:
+        if stage not in done:
+            return stage
+    return None
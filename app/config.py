@@ -1,8 +1,13 @@
+import logging
 import os
 import sys
 from dataclasses import dataclass
 from pathlib import Path
 
+from .logs import get_logger, setup_logging
+
+log = get_logger(__name__, stage="config")
+
 # Detectar se está rodando como executável PyInstaller
 def _get_base_path():
     """Retorna o diretório base correto tanto para dev quanto para .exe"""
@@ -19,10 +24,9 @@ def _load_env_file():
     base_path = _get_base_path()
     env_path = base_path / ".env"
     
-    print(f"[CONFIG] Procurando .env em: {env_path}")
+    log.debug("Procurando .env em: %s", env_path)
     
     if env_path.exists():
-        print(f"[CONFIG] ✅ .env encontrado!")
         try:
             with open(env_path, 'r', encoding='utf-8') as f:
                 for line in f:
@@ -32,13 +36,12 @@ def _load_env_file():
                         os.environ[key.strip()] = value.strip()
                         # Debug (sem mostrar valores sensíveis)
                         if 'TOKEN' not in key and 'PASSWORD' not in key:
-                            print(f"[CONFIG] Carregado: {key.strip()}")
-            print(f"[CONFIG] ✅ Variáveis carregadas do .env")
+                            log.debug("Carregado: %s", key.strip())
+            log.info(".env carregado de: %s", env_path)
         except Exception as e:
-            print(f"[CONFIG] ❌ Erro ao ler .env: {e}")
+            log.error("Erro ao ler .env: %s", e)
     else:
-        print(f"[CONFIG] ⚠️ .env NÃO encontrado em: {env_path}")
-        print(f"[CONFIG] Usando variáveis de ambiente do sistema")
+        log.info(".env não encontrado em %s; usando variáveis de ambiente do sistema", env_path)
 
 try:
     from dotenv import load_dotenv
@@ -46,11 +49,14 @@ try:
     env_path = base_path / ".env"
     if env_path.exists():
         load_dotenv(env_path)
-        print(f"[CONFIG] ✅ .env carregado via dotenv de: {env_path}")
+        log.info(".env carregado via dotenv de: %s", env_path)
 except ImportError:
     # Se dotenv não estiver disponível, usar função manual
     _load_env_file()
 
+# Reaplica LOG_LEVEL/LOG_LEVELS/LOG_FORMAT caso tenham vindo do .env
+setup_logging(force=True)
+
 
 def _get_bool(name: str, default: bool = False) -> bool:
     v = os.environ.get(name)
@@ -66,6 +72,13 @@ def _get_int(name: str, default: int) -> int:
         return default
 
 
+def _get_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except Exception:
+        return default
+
+
 @dataclass
 class Settings:
     # ============================================
@@ -96,6 +109,27 @@ class Settings:
     TELEGRAM_CHAT_ID: str = TELEGRAM_CHAT_ID_MARLI or TELEGRAM_CHAT_ID_GABRIEL or os.environ.get("TELEGRAM_CHAT_ID", "")
     # Seletor de destino de envio (usado pela GUI). Pode ser 'Gabriel' ou 'Marli'.
     SELECTED_SEND_TARGET: str = os.environ.get("SELECTED_SEND_TARGET", "Gabriel")
+    # Bot API: nuvem (padrão) ou servidor próprio (telegram-bot-api). Com
+    # TELEGRAM_LOCAL_MODE o servidor roda com --local e os arquivos são lidos
+    # direto do disco; getFile fica em cache pelo TTL
+    TELEGRAM_API_BASE_URL: str = os.environ.get("TELEGRAM_API_BASE_URL", "https://api.telegram.org")
+    TELEGRAM_LOCAL_MODE: bool = _get_bool("TELEGRAM_LOCAL_MODE", False)
+    TELEGRAM_GETFILE_CACHE_TTL_SECONDS: int = _get_int("TELEGRAM_GETFILE_CACHE_TTL_SECONDS", 3600)
+    # Envio em lote (GUI, etapa 3): até N vídeos por sendMediaGroup (álbum);
+    # desligado = um sendVideo por vídeo
+    TELEGRAM_MEDIA_GROUP: bool = _get_bool("TELEGRAM_MEDIA_GROUP", False)
+    TELEGRAM_MEDIA_GROUP_SIZE: int = _get_int("TELEGRAM_MEDIA_GROUP_SIZE", 10)
+    # Renditions extras codificadas no mesmo processo do final, a partir do
+    # mesmo decode: "nome:altura" separados por vírgula (ex.: "preview:720")
+    RENDITIONS: str = os.environ.get("RENDITIONS", "")
+    # Probe de mídia: "auto" lê MP4/MOV comuns em processo (sem subprocesso)
+    # e usa o ffprobe para o resto; "ffprobe" sempre usa o ffprobe
+    PROBE_BACKEND: str = os.environ.get("PROBE_BACKEND", "auto")
+    # Miniatura JPEG gerada no encode final e enviada junto com largura/altura/
+    # duração (o Telegram não precisa reanalisar o vídeo)
+    SEND_THUMBNAIL: bool = _get_bool("SEND_THUMBNAIL", True)
+    # Intervalo mínimo entre envios para o mesmo destino (fan-out Gabriel/Marli)
+    TELEGRAM_SEND_MIN_INTERVAL_SECONDS: float = _get_float("TELEGRAM_SEND_MIN_INTERVAL_SECONDS", 1.0)
     TELEGRAM_CHANNEL_ID: str = os.environ.get("TELEGRAM_CHANNEL_ID", "")
     TELEGRAM_ADMIN_USER_ID: str = os.environ.get("TELEGRAM_ADMIN_USER_ID", "")
 
@@ -119,11 +153,94 @@ class Settings:
     VIDEO_TARGET_MIN_HEIGHT: int = 1080
     PREFER_VIDEO2X_FIRST: bool = False
     TIMEOUT_VIDEO2X_SECONDS: int = 900
+    # Planejador de upscale: a altura efetiva (após o crop 9:16) é comparada ao
+    # alvo. Lacunas menores que esta razão são resolvidas pelo scale do encode
+    # final; a rota Video2X (com PREFER_VIDEO2X_FIRST) só vale acima dela.
+    UPSCALE_VIDEO2X_MIN_RATIO: float = _get_float("UPSCALE_VIDEO2X_MIN_RATIO", 2.0)
+    # Supervisor do Video2X: máximo de jobs simultâneos (rodam na thread de quem
+    # chama; a mesma fonte é deduplicada), orçamento de CPU por job (segundos
+    # de CPU somando processos filhos; 0 = sem limite) e janela inicial após a
+    # qual o fps medido decide se o job cabe em TIMEOUT_VIDEO2X_SECONDS
+    VIDEO2X_WORKERS: int = _get_int("VIDEO2X_WORKERS", 1)
+    VIDEO2X_CPU_BUDGET_SECONDS: int = _get_int("VIDEO2X_CPU_BUDGET_SECONDS", 3600)
+    VIDEO2X_PROBE_SECONDS: int = _get_int("VIDEO2X_PROBE_SECONDS", 20)
+    # Validade das desistências (too_slow/cpu_budget) guardadas por fonte;
+    # 0 = não guardar (toda tentativa roda o Video2X de novo)
+    VIDEO2X_FAILURE_TTL_SECONDS: int = _get_int("VIDEO2X_FAILURE_TTL_SECONDS", 86400)
     # Qualidade/bitrates e duração
     VIDEO_MIN_BITRATE_KBPS: int = 2500
     VIDEO_TARGET_BITRATE_KBPS: int = 3500
     VIDEO_MIN_DURATION_SECONDS: int = 3
     VIDEO_MAX_DURATION_SECONDS: int = 60
+    # Supervisão do FFmpeg: timeout máximo, encode travado (sem frames novos) e
+    # tempo mínimo antes de confiar na ETA para abortar cedo
+    FFMPEG_TRANSCODE_TIMEOUT_SECONDS: int = _get_int("FFMPEG_TRANSCODE_TIMEOUT_SECONDS", 300)
+    FFMPEG_STALL_TIMEOUT_SECONDS: int = _get_int("FFMPEG_STALL_TIMEOUT_SECONDS", 30)
+    FFMPEG_PROGRESS_WARMUP_SECONDS: int = _get_int("FFMPEG_PROGRESS_WARMUP_SECONDS", 10)
+    # Encoder x264: preset/CRF padrão e auto-tune por classe de resolução.
+    # Com ENCODER_AUTOTUNE ligado, uma janela curta de cada entrada é codificada
+    # com os candidatos "preset:crf" e o mais rápido que atinge o piso de
+    # qualidade (SSIM e, opcionalmente, PSNR em dB) é usado e cacheado.
+    ENCODER_PRESET: str = os.environ.get("ENCODER_PRESET", "faster")
+    ENCODER_CRF: int = _get_int("ENCODER_CRF", 20)
+    ENCODER_AUTOTUNE: bool = _get_bool("ENCODER_AUTOTUNE", False)
+    ENCODER_AUTOTUNE_CANDIDATES: str = os.environ.get("ENCODER_AUTOTUNE_CANDIDATES", "ultrafast:23,superfast:22,veryfast:21,faster:20,medium:20")
+    ENCODER_AUTOTUNE_SSIM_FLOOR: float = _get_float("ENCODER_AUTOTUNE_SSIM_FLOOR", 0.97)
+    ENCODER_AUTOTUNE_PSNR_FLOOR: float = _get_float("ENCODER_AUTOTUNE_PSNR_FLOOR", 0.0)
+    ENCODER_AUTOTUNE_SAMPLE_SECONDS: int = _get_int("ENCODER_AUTOTUNE_SAMPLE_SECONDS", 4)
+    ENCODER_AUTOTUNE_CACHE_PATH: str = str(_base_path / "data" / "encoder_autotune.json")
+
+    # Cache de processados por hash da fonte + perfil de encode (PROCESSED_DIR/store),
+    # com evicção LRU acima do tamanho máximo
+    ARTIFACT_STORE_ENABLED: bool = _get_bool("ARTIFACT_STORE_ENABLED", True)
+    ARTIFACT_STORE_MAX_GB: float = _get_float("ARTIFACT_STORE_MAX_GB", 20.0)
+
+    # Retenção de arquivos: enviados são removidos após N dias (0 = nunca) ou
+    # quando o total rastreado passa da cota (0 = sem cota); downloads são
+    # recusados com espaço livre abaixo do mínimo (0 = sem verificação)
+    RETENTION_ENABLED: bool = _get_bool("RETENTION_ENABLED", True)
+    RETENTION_SENT_MAX_AGE_DAYS: float = _get_float("RETENTION_SENT_MAX_AGE_DAYS", 7.0)
+    RETENTION_DISK_QUOTA_GB: float = _get_float("RETENTION_DISK_QUOTA_GB", 50.0)
+    RETENTION_MIN_FREE_GB: float = _get_float("RETENTION_MIN_FREE_GB", 2.0)
+
+    # Rascunho em RAM (tmpfs) para intermediários; SCRATCH_DIR vazio = /dev/shm
+    # quando existir. Só usa se o arquivo couber no limite e a RAM disponível
+    # continuar acima do mínimo; senão grava no disco normalmente
+    SCRATCH_ENABLED: bool = _get_bool("SCRATCH_ENABLED", True)
+    SCRATCH_DIR: str = os.environ.get("SCRATCH_DIR", "")
+    SCRATCH_MAX_FILE_MB: int = _get_int("SCRATCH_MAX_FILE_MB", 512)
+    SCRATCH_MIN_FREE_RAM_MB: int = _get_int("SCRATCH_MIN_FREE_RAM_MB", 1024)
+
+    # Downloads: simultâneos no total e por host, quantos próximos da fila
+    # baixar à frente do transcode e o limite em disco desses antecipados
+    DOWNLOAD_MAX_IN_FLIGHT: int = _get_int("DOWNLOAD_MAX_IN_FLIGHT", 3)
+    DOWNLOAD_MAX_PER_HOST: int = _get_int("DOWNLOAD_MAX_PER_HOST", 2)
+    DOWNLOAD_PREFETCH: int = _get_int("DOWNLOAD_PREFETCH", 2)
+    DOWNLOAD_PREFETCH_BUDGET_MB: int = _get_int("DOWNLOAD_PREFETCH_BUDGET_MB", 500)
+    # Links de compartilhamento/encurtados: seguir redirecionamentos e extrair
+    # a URL do vídeo (og:video/.mp4); mapeamento em cache pelo TTL
+    URL_RESOLVE: bool = _get_bool("URL_RESOLVE", True)
+    URL_CACHE_TTL_SECONDS: int = _get_int("URL_CACHE_TTL_SECONDS", 6 * 3600)
+
+    # Ordem da fila: "cost" (menor custo estimado primeiro, com envelhecimento)
+    # ou "fifo". Custo = duração x pixels, multiplicado pelo fator quando o
+    # upscale vai pelo Video2X; o custo de quem espera é dividido por
+    # (1 + espera / SCHED_AGING_SECONDS), então vídeos grandes não ficam para trás
+    SCHEDULING: str = os.environ.get("SCHEDULING", "cost")
+    SCHED_VIDEO2X_COST_FACTOR: float = _get_float("SCHED_VIDEO2X_COST_FACTOR", 20.0)
+    SCHED_AGING_SECONDS: int = _get_int("SCHED_AGING_SECONDS", 1800)
+    # Registros de URL ainda sem custo são medidos antes da ordenação com
+    # ffprobe direto na URL (só o cabeçalho do vídeo); 0 desliga a medição e
+    # esses registros usam a mediana até serem baixados
+    SCHED_PROBE_TIMEOUT_SECONDS: int = _get_int("SCHED_PROBE_TIMEOUT_SECONDS", 15)
+
+    # Captura de saída de subprocessos: bytes retidos (apenas o final) por stream
+    SUBPROCESS_STDOUT_LIMIT_BYTES: int = _get_int("SUBPROCESS_STDOUT_LIMIT_BYTES", 4 * 1024 * 1024)
+    SUBPROCESS_STDERR_TAIL_BYTES: int = _get_int("SUBPROCESS_STDERR_TAIL_BYTES", 64 * 1024)
+
+    # Métricas (endpoint HTTP local /metrics e /metrics.json). Porta 0 = desabilitado
+    METRICS_HOST: str = os.environ.get("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT: int = _get_int("METRICS_PORT", 0)
 
     # Exec flags
     ONLY_DOWNLOAD: bool = False
@@ -135,17 +252,18 @@ class Settings:
 
 settings = Settings()
 
-# Debug: Mostrar configurações importantes
-print(f"[CONFIG] Base path: {settings._base_path}")
-print(f"[CONFIG] Download dir: {settings.DOWNLOAD_DIR}")
-print(f"[CONFIG] Processed dir: {settings.PROCESSED_DIR}")
-print(f"[CONFIG] DB Original: {settings.DB_ORIGINAIS_PATH}")
-print(f"[CONFIG] DB Processados: {settings.DB_PROCESSADOS_PATH}")
-print(f"[CONFIG] Telegram Bot token (ativo): {'✅ Configurado' if settings.TELEGRAM_BOT_TOKEN else '❌ VAZIO'}")
-print(f"[CONFIG] Telegram Send token Gabriel: {'✅' if settings.TELEGRAM_SEND_TOKEN_GABRIEL else '❌'} | Chat ID: {settings.TELEGRAM_CHAT_ID_GABRIEL}")
-print(f"[CONFIG] Telegram Send token Marli: {'✅' if settings.TELEGRAM_SEND_TOKEN_MARLI else '❌'} | Chat ID: {settings.TELEGRAM_CHAT_ID_MARLI}")
-print(f"[CONFIG] Telegram Chat ID (legacy): {'✅ Configurado' if settings.TELEGRAM_CHAT_ID else '❌ VAZIO'}")
-print(f"[CONFIG] Vídeo: alvo {settings.VIDEO_TARGET_MIN_HEIGHT}p, bitrate alvo {settings.VIDEO_TARGET_BITRATE_KBPS}k (mín {settings.VIDEO_MIN_BITRATE_KBPS}k), duração {settings.VIDEO_MIN_DURATION_SECONDS}-{settings.VIDEO_MAX_DURATION_SECONDS}s")
+# Debug: Mostrar configurações importantes (LOG_LEVELS=app.config=DEBUG)
+if log.isEnabledFor(logging.DEBUG):
+    log.debug("Base path: %s", settings._base_path)
+    log.debug("Download dir: %s | Processed dir: %s", settings.DOWNLOAD_DIR, settings.PROCESSED_DIR)
+    log.debug("DB Original: %s | DB Processados: %s", settings.DB_ORIGINAIS_PATH, settings.DB_PROCESSADOS_PATH)
+    log.debug("Telegram Bot token (ativo): %s", "configurado" if settings.TELEGRAM_BOT_TOKEN else "VAZIO")
+    log.debug("Telegram Send token Gabriel: %s | Chat ID: %s", "sim" if settings.TELEGRAM_SEND_TOKEN_GABRIEL else "não", settings.TELEGRAM_CHAT_ID_GABRIEL)
+    log.debug("Telegram Send token Marli: %s | Chat ID: %s", "sim" if settings.TELEGRAM_SEND_TOKEN_MARLI else "não", settings.TELEGRAM_CHAT_ID_MARLI)
+    log.debug("Telegram Chat ID (legacy): %s", "configurado" if settings.TELEGRAM_CHAT_ID else "VAZIO")
+    log.debug("Vídeo: alvo %sp, bitrate alvo %sk (mín %sk), duração %s-%ss",
+              settings.VIDEO_TARGET_MIN_HEIGHT, settings.VIDEO_TARGET_BITRATE_KBPS, settings.VIDEO_MIN_BITRATE_KBPS,
+              settings.VIDEO_MIN_DURATION_SECONDS, settings.VIDEO_MAX_DURATION_SECONDS)
 
 # Assegurar diretórios
 os.makedirs(settings.DOWNLOAD_DIR, exist_ok=True)
@@ -1,8 +1,10 @@
+import json
 import os
 import sqlite3
 from contextlib import contextmanager
-from typing import Optional, Tuple, Iterable, Any
+from typing import Optional, Tuple, Iterable, Any, Dict, List
 from .config import settings
+from . import metrics
 
 DB_SINGLE_SCHEMA = """
 CREATE TABLE IF NOT EXISTS videos (
@@ -62,6 +64,64 @@ CREATE TABLE IF NOT EXISTS videos_processados (
 );
 """
 
+# Arquivos gerados por registro (original, intermediários, final) para a
+# política de retenção. Fica no banco de processados (ou no banco único).
+ARTIFACTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  record_id INTEGER NOT NULL,
+  kind TEXT NOT NULL,
+  path TEXT NOT NULL UNIQUE,
+  size_bytes INTEGER,
+  created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+  deleted_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_artifacts_record ON artifacts(record_id);
+"""
+
+# Etapas concluídas por registro (downloaded/probed/encoded/sent), para que
+# uma nova tentativa retome da primeira etapa incompleta. Mesmo banco dos
+# artifacts.
+CHECKPOINTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+  record_id INTEGER NOT NULL,
+  stage TEXT NOT NULL,
+  path TEXT,
+  sha256 TEXT,
+  meta TEXT,
+  created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (record_id, stage)
+);
+"""
+
+# Entregas por destino (Gabriel/Marli...). file_id só vale para o mesmo bot,
+# por isso bot_id fica junto.
+DELIVERIES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS deliveries (
+  record_id INTEGER NOT NULL,
+  target TEXT NOT NULL,
+  chat_id TEXT,
+  bot_id TEXT,
+  status TEXT,
+  message_id INTEGER,
+  file_id TEXT,
+  error_message TEXT,
+  updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (record_id, target)
+);
+"""
+
+# Cache link de compartilhamento -> URL do vídeo na CDN (link_resolver).
+# expires_at em epoch (segundos).
+URL_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS url_cache (
+  url TEXT PRIMARY KEY,
+  media_url TEXT NOT NULL,
+  expires_at REAL NOT NULL,
+  created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
 
 def _ensure_column(con: sqlite3.Connection, table: str, column: str, coltype: str):
     cur = con.cursor()
@@ -81,17 +141,33 @@ def init_db():
             # Garante colunas opcionais existirem
             _ensure_column(con, "videos_original", "link_produto", "TEXT")
             _ensure_column(con, "videos_original", "descricao", "TEXT")
+            _ensure_column(con, "videos_original", "destinations", "TEXT")
+            # Custo estimado de processamento (scheduling); NULL = ainda não medido
+            _ensure_column(con, "videos_original", "priority", "REAL")
         with sqlite3.connect(settings.DB_PROCESSADOS_PATH) as con:
             con.executescript(DB_PROCESSADOS_SCHEMA)
+            con.executescript(ARTIFACTS_SCHEMA)
+            con.executescript(CHECKPOINTS_SCHEMA)
+            con.executescript(DELIVERIES_SCHEMA)
+            con.executescript(URL_CACHE_SCHEMA)
             # Garante colunas opcionais existirem
             _ensure_column(con, "videos_processados", "link_produto", "TEXT")
             _ensure_column(con, "videos_processados", "descricao", "TEXT")
+            # JSON {nome: caminho} das renditions extras (RENDITIONS)
+            _ensure_column(con, "videos_processados", "renditions", "TEXT")
     else:
         os.makedirs(os.path.dirname(settings.DB_SINGLE_PATH), exist_ok=True)
         with sqlite3.connect(settings.DB_SINGLE_PATH) as con:
             con.executescript(DB_SINGLE_SCHEMA)
+            con.executescript(ARTIFACTS_SCHEMA)
+            con.executescript(CHECKPOINTS_SCHEMA)
+            con.executescript(DELIVERIES_SCHEMA)
+            con.executescript(URL_CACHE_SCHEMA)
             _ensure_column(con, "videos", "link_produto", "TEXT")
             _ensure_column(con, "videos", "descricao", "TEXT")
+            _ensure_column(con, "videos", "destinations", "TEXT")
+            _ensure_column(con, "videos", "renditions", "TEXT")
+            _ensure_column(con, "videos", "priority", "REAL")
 
 
 @contextmanager
@@ -107,13 +183,14 @@ def get_conn(processed: bool = False):
         con.close()
 
 
-def insert_original(source_type: str, source_url: Optional[str], telegram_file_id: Optional[str], original_path: Optional[str], link_produto: Optional[str] = None, descricao: Optional[str] = None) -> int:
+@metrics.timed("shopee_db_seconds", op="insert_original")
+def insert_original(source_type: str, source_url: Optional[str], telegram_file_id: Optional[str], original_path: Optional[str], link_produto: Optional[str] = None, descricao: Optional[str] = None, destinations: Optional[str] = None) -> int:
     if settings.USE_DUAL_DATABASES:
         with get_conn(False) as con:
             cur = con.cursor()
             cur.execute(
-                "INSERT INTO videos_original (source_type, source_url, telegram_file_id, original_path, link_produto, descricao) VALUES (?,?,?,?,?,?)",
-                (source_type, source_url, telegram_file_id, original_path, link_produto, descricao),
+                "INSERT INTO videos_original (source_type, source_url, telegram_file_id, original_path, link_produto, descricao, destinations) VALUES (?,?,?,?,?,?,?)",
+                (source_type, source_url, telegram_file_id, original_path, link_produto, descricao, destinations),
             )
             con.commit()
             # lastrowid deve ser int
@@ -122,13 +199,14 @@ def insert_original(source_type: str, source_url: Optional[str], telegram_file_i
         with get_conn() as con:
             cur = con.cursor()
             cur.execute(
-                "INSERT INTO videos (source_type, source_url, telegram_file_id, original_path, status, link_produto, descricao) VALUES (?,?,?,?,?,?,?)",
-                (source_type, source_url, telegram_file_id, original_path, "pending", link_produto, descricao),
+                "INSERT INTO videos (source_type, source_url, telegram_file_id, original_path, status, link_produto, descricao, destinations) VALUES (?,?,?,?,?,?,?,?)",
+                (source_type, source_url, telegram_file_id, original_path, "pending", link_produto, descricao, destinations),
             )
             con.commit()
             return int(cur.lastrowid or 0)
 
 
+@metrics.timed("shopee_db_seconds", op="update_original_path")
 def update_original_path(record_id: int, original_path: str):
     if settings.USE_DUAL_DATABASES:
         with get_conn(False) as con:
@@ -140,6 +218,7 @@ def update_original_path(record_id: int, original_path: str):
             con.commit()
 
 
+@metrics.timed("shopee_db_seconds", op="insert_or_update_processed")
 def insert_or_update_processed(id_ref_original: int, processed_path: Optional[str], status: str, error_message: Optional[str], meta: Tuple[Optional[int], Optional[int], Optional[float], Optional[int]], link_produto: Optional[str] = None, descricao: Optional[str] = None):
     width, height, duration, size_bytes = meta
     if settings.USE_DUAL_DATABASES:
@@ -170,6 +249,31 @@ def insert_or_update_processed(id_ref_original: int, processed_path: Optional[st
             con.commit()
 
 
+@metrics.timed("shopee_db_seconds", op="update_renditions")
+def update_renditions(id_ref_original: int, renditions: Dict[str, str]):
+    """Grava as renditions extras do registro (JSON ``{nome: caminho}``)."""
+    value = json.dumps(renditions, ensure_ascii=False) if renditions else None
+    if settings.USE_DUAL_DATABASES:
+        with get_conn(True) as con:
+            con.execute("UPDATE videos_processados SET renditions=?, updated_at=CURRENT_TIMESTAMP WHERE id_ref_original=?",
+                        (value, id_ref_original))
+            con.commit()
+    else:
+        with get_conn() as con:
+            con.execute("UPDATE videos SET renditions=?, updated_at=CURRENT_TIMESTAMP WHERE id=?", (value, id_ref_original))
+            con.commit()
+
+
+@metrics.timed("shopee_db_seconds", op="update_priority")
+def update_priority(record_id: int, priority: Optional[float]):
+    """Grava o custo estimado do registro (menor = processado antes)."""
+    table = "videos_original" if settings.USE_DUAL_DATABASES else "videos"
+    with get_conn() as con:
+        con.execute(f"UPDATE {table} SET priority=? WHERE id=?", (priority, record_id))
+        con.commit()
+
+
+@metrics.timed("shopee_db_seconds", op="increment_retry")
 def increment_retry(id_ref_original: int):
     if settings.USE_DUAL_DATABASES:
         with get_conn(True) as con:
@@ -181,6 +285,7 @@ def increment_retry(id_ref_original: int):
             con.commit()
 
 
+@metrics.timed("shopee_db_seconds", op="select_pending_or_failed")
 def select_pending_or_failed(retry_only_failed: bool) -> Iterable[Tuple[Any, ...]]:
     if settings.USE_DUAL_DATABASES:
         # left join dos originais com processados
@@ -189,7 +294,7 @@ def select_pending_or_failed(retry_only_failed: bool) -> Iterable[Tuple[Any, ...
             cur = con.cursor()
             if retry_only_failed:
                 cur.execute("""
-                    SELECT vo.id AS id
+                    SELECT vo.id AS id, vo.priority AS priority, vo.created_at AS created_at
                     FROM videos_original vo
                     JOIN videos_processados vp ON vp.id_ref_original = vo.id
                     WHERE vp.status = 'failed' AND vp.retries < ?
@@ -197,23 +302,24 @@ def select_pending_or_failed(retry_only_failed: bool) -> Iterable[Tuple[Any, ...
             else:
                 # Todos os originais sem registro em processados OU com failed
                 cur.execute("""
-                    SELECT vo.id AS id
+                    SELECT vo.id AS id, vo.priority AS priority, vo.created_at AS created_at
                     FROM videos_original vo
                     LEFT JOIN videos_processados vp ON vp.id_ref_original = vo.id
                     WHERE vp.id IS NULL OR vp.status = 'failed'
                 """)
-            return [(r["id"],) for r in cur.fetchall()]
+            return [(r["id"], r["priority"], r["created_at"]) for r in cur.fetchall()]
     else:
         with get_conn() as con:
             con.row_factory = sqlite3.Row
             cur = con.cursor()
             if retry_only_failed:
-                cur.execute("SELECT id FROM videos WHERE status='failed' AND retries < ?", (settings.MAX_RETRIES,))
+                cur.execute("SELECT id, priority, created_at FROM videos WHERE status='failed' AND retries < ?", (settings.MAX_RETRIES,))
             else:
-                cur.execute("SELECT id FROM videos WHERE IFNULL(status,'pending') IN ('pending','failed')")
-            return [(r["id"],) for r in cur.fetchall()]
+                cur.execute("SELECT id, priority, created_at FROM videos WHERE IFNULL(status,'pending') IN ('pending','failed')")
+            return [(r["id"], r["priority"], r["created_at"]) for r in cur.fetchall()]
 
 
+@metrics.timed("shopee_db_seconds", op="get_original_record")
 def get_original_record(record_id: int) -> Optional[sqlite3.Row]:
     if settings.USE_DUAL_DATABASES:
         with get_conn(False) as con:
@@ -227,3 +333,158 @@ def get_original_record(record_id: int) -> Optional[sqlite3.Row]:
             cur = con.cursor()
             cur.execute("SELECT * FROM videos WHERE id=?", (record_id,))
             return cur.fetchone()
+
+
+@metrics.timed("shopee_db_seconds", op="record_artifact")
+def record_artifact(record_id: int, kind: str, path: str):
+    """Registra (ou reativa) um arquivo do registro: kind em original/intermediate/final."""
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        size = None
+    with get_conn(True) as con:
+        con.execute(
+            """INSERT INTO artifacts (record_id, kind, path, size_bytes) VALUES (?,?,?,?)
+               ON CONFLICT(path) DO UPDATE SET record_id=excluded.record_id, kind=excluded.kind,
+               size_bytes=excluded.size_bytes, created_at=CURRENT_TIMESTAMP, deleted_at=NULL""",
+            (record_id, kind, os.path.abspath(path), size),
+        )
+        con.commit()
+
+
+@metrics.timed("shopee_db_seconds", op="select_artifacts")
+def select_artifacts(record_id: int, kinds: Optional[Tuple[str, ...]] = None) -> List[sqlite3.Row]:
+    """Arquivos ainda existentes (não removidos) de um registro."""
+    sql = "SELECT * FROM artifacts WHERE record_id=? AND deleted_at IS NULL"
+    params: list = [record_id]
+    if kinds:
+        sql += f" AND kind IN ({','.join('?' * len(kinds))})"
+        params += list(kinds)
+    with get_conn(True) as con:
+        con.row_factory = sqlite3.Row
+        return con.execute(sql, params).fetchall()
+
+
+@metrics.timed("shopee_db_seconds", op="select_evictable_artifacts")
+def select_evictable_artifacts(older_than_days: Optional[float] = None) -> List[sqlite3.Row]:
+    """Originais/finais de registros já enviados, do mais antigo para o mais novo."""
+    if settings.USE_DUAL_DATABASES:
+        join = "JOIN videos_processados v ON v.id_ref_original = a.record_id"
+    else:
+        join = "JOIN videos v ON v.id = a.record_id"
+    sql = f"""
+        SELECT a.* FROM artifacts a {join}
+        WHERE a.deleted_at IS NULL AND a.kind IN ('original', 'final') AND v.status = 'processed'
+    """
+    params: list = []
+    if older_than_days is not None:
+        sql += " AND a.created_at <= datetime('now', ?)"
+        params.append(f"-{float(older_than_days)} days")
+    sql += " ORDER BY a.created_at, a.id"
+    with get_conn(True) as con:
+        con.row_factory = sqlite3.Row
+        return con.execute(sql, params).fetchall()
+
+
+@metrics.timed("shopee_db_seconds", op="mark_artifact_deleted")
+def mark_artifact_deleted(artifact_id: int):
+    with get_conn(True) as con:
+        con.execute("UPDATE artifacts SET deleted_at=CURRENT_TIMESTAMP WHERE id=?", (artifact_id,))
+        con.commit()
+
+
+@metrics.timed("shopee_db_seconds", op="artifacts_total_bytes")
+def artifacts_total_bytes() -> int:
+    """Soma dos tamanhos dos arquivos rastreados ainda presentes."""
+    with get_conn(True) as con:
+        row = con.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM artifacts WHERE deleted_at IS NULL").fetchone()
+        return int(row[0] or 0)
+
+
+@metrics.timed("shopee_db_seconds", op="upsert_checkpoint")
+def upsert_checkpoint(record_id: int, stage: str, path: Optional[str], sha256: Optional[str], meta: Optional[str], clear_stages: Tuple[str, ...] = ()):
+    """Grava o checkpoint da etapa e remove os de ``clear_stages`` (etapas seguintes)."""
+    with get_conn(True) as con:
+        con.execute(
+            """INSERT INTO checkpoints (record_id, stage, path, sha256, meta) VALUES (?,?,?,?,?)
+               ON CONFLICT(record_id, stage) DO UPDATE SET path=excluded.path, sha256=excluded.sha256,
+               meta=excluded.meta, created_at=CURRENT_TIMESTAMP""",
+            (record_id, stage, path, sha256, meta),
+        )
+        if clear_stages:
+            con.execute(
+                f"DELETE FROM checkpoints WHERE record_id=? AND stage IN ({','.join('?' * len(clear_stages))})",
+                [record_id] + list(clear_stages),
+            )
+        con.commit()
+
+
+@metrics.timed("shopee_db_seconds", op="select_checkpoints")
+def select_checkpoints(record_id: int) -> List[sqlite3.Row]:
+    with get_conn(True) as con:
+        con.row_factory = sqlite3.Row
+        return con.execute("SELECT * FROM checkpoints WHERE record_id=?", (record_id,)).fetchall()
+
+
+@metrics.timed("shopee_db_seconds", op="delete_checkpoints")
+def delete_checkpoints(record_id: int, stages: Tuple[str, ...]):
+    if not stages:
+        return
+    with get_conn(True) as con:
+        con.execute(
+            f"DELETE FROM checkpoints WHERE record_id=? AND stage IN ({','.join('?' * len(stages))})",
+            [record_id] + list(stages),
+        )
+        con.commit()
+
+
+@metrics.timed("shopee_db_seconds", op="upsert_delivery")
+def upsert_delivery(record_id: int, target: str, chat_id: Optional[str], bot_id: Optional[str], status: str,
+                    message_id: Optional[int] = None, file_id: Optional[str] = None, error_message: Optional[str] = None):
+    with get_conn(True) as con:
+        con.execute(
+            """INSERT INTO deliveries (record_id, target, chat_id, bot_id, status, message_id, file_id, error_message)
+               VALUES (?,?,?,?,?,?,?,?)
+               ON CONFLICT(record_id, target) DO UPDATE SET chat_id=excluded.chat_id, bot_id=excluded.bot_id,
+               status=excluded.status, message_id=excluded.message_id,
+               file_id=COALESCE(excluded.file_id, deliveries.file_id),
+               error_message=excluded.error_message, updated_at=CURRENT_TIMESTAMP""",
+            (record_id, target, chat_id, bot_id, status, message_id, file_id, error_message),
+        )
+        con.commit()
+
+
+@metrics.timed("shopee_db_seconds", op="select_deliveries")
+def select_deliveries(record_id: int) -> List[sqlite3.Row]:
+    with get_conn(True) as con:
+        con.row_factory = sqlite3.Row
+        return con.execute("SELECT * FROM deliveries WHERE record_id=?", (record_id,)).fetchall()
+
+
+@metrics.timed("shopee_db_seconds", op="get_url_cache")
+def get_url_cache(url: str, now: float) -> Optional[str]:
+    """URL de mídia em cache para ``url``, se ainda não expirou."""
+    with get_conn(True) as con:
+        row = con.execute("SELECT media_url FROM url_cache WHERE url=? AND expires_at>?", (url, now)).fetchone()
+        return row[0] if row else None
+
+
+@metrics.timed("shopee_db_seconds", op="put_url_cache")
+def put_url_cache(url: str, media_url: str, expires_at: float, now: float):
+    with get_conn(True) as con:
+        con.execute(
+            """INSERT INTO url_cache (url, media_url, expires_at) VALUES (?,?,?)
+               ON CONFLICT(url) DO UPDATE SET media_url=excluded.media_url, expires_at=excluded.expires_at,
+               created_at=CURRENT_TIMESTAMP""",
+            (url, media_url, expires_at),
+        )
+        # Limpeza oportunista das entradas vencidas
+        con.execute("DELETE FROM url_cache WHERE expires_at<=?", (now,))
+        con.commit()
+
+
+@metrics.timed("shopee_db_seconds", op="delete_url_cache")
+def delete_url_cache(url: str):
+    with get_conn(True) as con:
+        con.execute("DELETE FROM url_cache WHERE url=?", (url,))
+        con.commit()
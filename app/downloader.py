@@ -0,0 +1,151 @@
+"""Agendador de downloads com prefetch e limite de conexões por host.
+
+- Até ``DOWNLOAD_MAX_IN_FLIGHT`` downloads simultâneos (pool próprio)
+- No máximo ``DOWNLOAD_MAX_PER_HOST`` conexões por host (CDN da Shopee x
+  api.telegram.org), via ``host_slot``
+- Pools do ``HTTPAdapter`` dimensionados para esses limites
+  (``configure_session``)
+- Enquanto o transcoder trabalha num registro, os próximos
+  ``DOWNLOAD_PREFETCH`` da fila já são baixados, desde que os arquivos
+  baixados e ainda não consumidos não passem de ``DOWNLOAD_PREFETCH_BUDGET_MB``
+
+O agendador não sabe como baixar um registro: recebe ``download_fn(record_id)``
+que retorna o caminho local (ou None em caso de falha já registrada).
+"""
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, Optional
+from urllib.parse import urlparse
+
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+from .config import settings
+from .logs import get_logger
+
+log = get_logger(__name__, stage="download")
+
+_MB = 1024 * 1024
+
+_host_lock = threading.Lock()
+_host_slots: Dict[str, threading.BoundedSemaphore] = {}
+
+
+def configure_session(session):
+    """Dimensiona os pools de conexão da sessão para os limites configurados."""
+    per_host = max(1, settings.DOWNLOAD_MAX_PER_HOST)
+    adapter = HTTPAdapter(
+        # Um pool por host; hosts distintos esperados: CDN(s) + Telegram
+        pool_connections=max(4, settings.DOWNLOAD_MAX_IN_FLIGHT),
+        pool_maxsize=max(per_host, settings.DOWNLOAD_MAX_IN_FLIGHT),
+        pool_block=False,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+@contextmanager
+def host_slot(url: str) -> Iterator[None]:
+    """Reserva uma das conexões permitidas para o host de ``url``."""
+    host = (urlparse(url).hostname or "").lower()
+    with _host_lock:
+        sem = _host_slots.get(host)
+        if sem is None:
+            sem = threading.BoundedSemaphore(max(1, settings.DOWNLOAD_MAX_PER_HOST))
+            _host_slots[host] = sem
+    sem.acquire()
+    try:
+        yield
+    finally:
+        sem.release()
+
+
+class DownloadScheduler:
+    """Baixa registros em paralelo, à frente do processamento."""
+
+    def __init__(
+        self,
+        download_fn: Callable[[int], Optional[str]],
+        max_in_flight: Optional[int] = None,
+        prefetch: Optional[int] = None,
+        budget_bytes: Optional[int] = None,
+    ):
+        self.download_fn = download_fn
+        self.prefetch_count = settings.DOWNLOAD_PREFETCH if prefetch is None else prefetch
+        self.budget_bytes = int(settings.DOWNLOAD_PREFETCH_BUDGET_MB * _MB) if budget_bytes is None else budget_bytes
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, max_in_flight or settings.DOWNLOAD_MAX_IN_FLIGHT),
+            thread_name_prefix="download",
+        )
+        self._lock = threading.Lock()
+        self._futures: Dict[int, Future] = {}
+        # Bytes já baixados à frente e ainda não consumidos
+        self._ready: Dict[int, int] = {}
+
+    def _run(self, record_id: int) -> Optional[str]:
+        path = self.download_fn(record_id)
+        if path:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = 0
+            with self._lock:
+                self._ready[record_id] = size
+        return path
+
+    def _submit(self, record_id: int):
+        # chamado com self._lock
+        if record_id not in self._futures:
+            self._futures[record_id] = self._executor.submit(self._run, record_id)
+
+    def ready_bytes(self) -> int:
+        with self._lock:
+            return sum(self._ready.values())
+
+    def schedule(self, current: int, upcoming: Iterable[int] = ()):
+        """Garante o download de ``current`` e antecipa até K próximos."""
+        with self._lock:
+            self._submit(current)
+            started = 0
+            for rid in upcoming:
+                if started >= self.prefetch_count:
+                    break
+                if rid in self._futures:
+                    started += 1
+                    continue
+                if self.budget_bytes and sum(self._ready.values()) >= self.budget_bytes:
+                    log.debug("Orçamento de prefetch atingido, aguardando consumo")
+                    break
+                self._submit(rid)
+                started += 1
+            in_flight = sum(1 for f in self._futures.values() if not f.done())
+        metrics.set_gauge("shopee_downloads_in_flight", in_flight, help="Downloads em andamento ou na fila do agendador")
+
+    def schedule_all(self, record_ids: Iterable[int]):
+        """Enfileira todos (limitado apenas por ``max_in_flight``)."""
+        with self._lock:
+            for rid in record_ids:
+                self._submit(rid)
+
+    def result(self, record_id: int) -> Optional[str]:
+        """Aguarda o download do registro e o marca como consumido."""
+        with self._lock:
+            fut = self._futures.get(record_id)
+            if fut is None:
+                self._submit(record_id)
+                fut = self._futures[record_id]
+        try:
+            path = fut.result()
+        except Exception as e:
+            log.error("Erro no download agendado: %s", e, extra={"record_id": record_id})
+            path = None
+        with self._lock:
+            self._futures.pop(record_id, None)
+            self._ready.pop(record_id, None)
+        return path
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,198 @@
+"""Auto-tune de preset/CRF do x264 contra um piso de qualidade.
+
+Para cada classe de resolução da entrada (ex.: ``720p-landscape``) uma janela
+curta do vídeo é codificada com os candidatos de
+``ENCODER_AUTOTUNE_CANDIDATES``; a qualidade é medida com os filtros ``ssim`` e
+``psnr`` do próprio FFmpeg contra a mesma janela filtrada sem compressão. O
+candidato mais rápido que atinge o piso é escolhido e gravado em cache
+(``ENCODER_AUTOTUNE_CACHE_PATH``), então o custo da medição é pago uma vez por
+classe.
+"""
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import scratch
+from .config import settings
+from .logs import get_logger
+from .subproc import run as _run
+
+log = get_logger(__name__, stage="autotune")
+
+_SSIM_RE = re.compile(r"SSIM .*All:([\d.]+)")
+_PSNR_RE = re.compile(r"PSNR .*average:([\d.]+|inf)")
+
+_LOCK = threading.Lock()
+_cache: Optional[Dict[str, Dict[str, Any]]] = None
+
+
+def _parse_candidates(spec: str) -> List[Tuple[str, int]]:
+    candidates = []
+    for item in spec.split(","):
+        if ":" not in item:
+            continue
+        preset, crf = item.split(":", 1)
+        try:
+            candidates.append((preset.strip(), int(crf)))
+        except ValueError:
+            continue
+    return candidates
+
+
+def resolution_class(width: Optional[int], height: Optional[int]) -> str:
+    """Agrupa entradas por faixa de altura e orientação (ex.: ``1080p-portrait``)."""
+    w, h = width or 0, height or 0
+    if not w or not h:
+        return "unknown"
+    short = min(w, h)
+    bucket = next((b for b in (360, 480, 720, 1080, 1440) if short <= b), 2160)
+    if abs(w - h) <= 0.05 * max(w, h):
+        orient = "square"
+    else:
+        orient = "landscape" if w > h else "portrait"
+    return f"{bucket}p-{orient}"
+
+
+def _cache_key(res_class: str) -> str:
+    # O piso faz parte da chave: mudar a configuração invalida as escolhas antigas
+    return f"{res_class}|ssim>={settings.ENCODER_AUTOTUNE_SSIM_FLOOR}|psnr>={settings.ENCODER_AUTOTUNE_PSNR_FLOOR}"
+
+
+def _load_cache() -> Dict[str, Dict[str, Any]]:
+    global _cache
+    if _cache is None:
+        try:
+            with open(settings.ENCODER_AUTOTUNE_CACHE_PATH, "r", encoding="utf-8") as f:
+                _cache = json.load(f)
+        except Exception:
+            _cache = {}
+    return _cache
+
+
+def _save_cache():
+    try:
+        os.makedirs(os.path.dirname(settings.ENCODER_AUTOTUNE_CACHE_PATH), exist_ok=True)
+        tmp = settings.ENCODER_AUTOTUNE_CACHE_PATH + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(_cache or {}, f, indent=2)
+        os.replace(tmp, settings.ENCODER_AUTOTUNE_CACHE_PATH)
+    except Exception as e:
+        log.warning("Não foi possível gravar cache de auto-tune: %s", e)
+
+
+def _measure_candidate(
+    ffmpeg_exe: str, input_path: str, vf: str, start: float, length: float,
+    preset: str, crf: int, rate_args: List[str], workdir: str,
+) -> Optional[Dict[str, Any]]:
+    sample = os.path.join(workdir, f"sample_{preset}_{crf}.mp4")
+    enc = [
+        ffmpeg_exe, "-y", "-ss", f"{start:.3f}", "-t", f"{length:.3f}", "-i", input_path,
+        "-vf", vf, "-an", "-c:v", "libx264", "-pix_fmt", "yuv420p",
+        "-preset", preset, "-crf", str(crf),
+    ] + rate_args + [sample]
+    t0 = time.perf_counter()
+    code, _, err = _run(enc, timeout=120)
+    encode_s = time.perf_counter() - t0
+    if code != 0 or not os.path.exists(sample):
+        log.debug("Candidato %s:%s falhou: %s", preset, crf, err[-200:])
+        return None
+
+    # Referência = mesma janela com os mesmos filtros, sem compressão
+    graph = f"[1:v]{vf},split[r0][r1];[0:v][r0]ssim[m];[m][r1]psnr"
+    cmp_cmd = [
+        ffmpeg_exe, "-i", sample, "-ss", f"{start:.3f}", "-t", f"{length:.3f}", "-i", input_path,
+        "-lavfi", graph, "-f", "null", "-",
+    ]
+    code, _, err = _run(cmp_cmd, timeout=120)
+    ssim_m = _SSIM_RE.search(err or "")
+    psnr_m = _PSNR_RE.search(err or "")
+    if code != 0 or not ssim_m:
+        log.debug("Medição de qualidade falhou para %s:%s: %s", preset, crf, err[-200:])
+        return None
+    psnr = psnr_m.group(1) if psnr_m else None
+    return {
+        "preset": preset,
+        "crf": crf,
+        "encode_s": round(encode_s, 3),
+        "ssim": float(ssim_m.group(1)),
+        "psnr": (float("inf") if psnr == "inf" else float(psnr)) if psnr else None,
+        "bytes": os.path.getsize(sample),
+    }
+
+
+def _meets_floor(r: Dict[str, Any]) -> bool:
+    if r["ssim"] < settings.ENCODER_AUTOTUNE_SSIM_FLOOR:
+        return False
+    floor = settings.ENCODER_AUTOTUNE_PSNR_FLOOR
+    return not floor or (r["psnr"] is not None and r["psnr"] >= floor)
+
+
+def choose_encoder_params(
+    ffmpeg_exe: str,
+    input_path: str,
+    vf: str,
+    duration: Optional[float],
+    width: Optional[int],
+    height: Optional[int],
+    rate_args: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """Retorna ``{"preset", "crf", "source"}`` para o encode final.
+
+    ``source`` é ``default`` (auto-tune desligado ou sem resultado),
+    ``cache`` ou ``autotune``.
+    """
+    default = {"preset": settings.ENCODER_PRESET, "crf": settings.ENCODER_CRF, "source": "default"}
+    if not settings.ENCODER_AUTOTUNE:
+        return default
+
+    res_class = resolution_class(width, height)
+    key = _cache_key(res_class)
+    with _LOCK:
+        cached = _load_cache().get(key)
+    if cached:
+        return {"preset": cached["preset"], "crf": cached["crf"], "source": "cache", "class": res_class}
+
+    candidates = _parse_candidates(settings.ENCODER_AUTOTUNE_CANDIDATES)
+    if not candidates:
+        return default
+    length = float(settings.ENCODER_AUTOTUNE_SAMPLE_SECONDS)
+    if duration and duration > length:
+        start = max(0.0, duration / 2 - length / 2)
+    else:
+        start, length = 0.0, float(duration or length)
+
+    # Amostras são descartáveis: tmpfs quando couberem (estimativa pelo bitrate máximo)
+    vb = max(settings.VIDEO_MIN_BITRATE_KBPS, settings.VIDEO_TARGET_BITRATE_KBPS)
+    expected = int(vb * 1.2 * 1000 / 8 * length) * len(candidates)
+    results = []
+    with tempfile.TemporaryDirectory(prefix="autotune_", dir=scratch.scratch_dir(expected)) as workdir:
+        for preset, crf in candidates:
+            r = _measure_candidate(ffmpeg_exe, input_path, vf, start, length, preset, crf, rate_args or [], workdir)
+            if r:
+                results.append(r)
+    if not results:
+        log.warning("Auto-tune sem resultados para %s, usando padrão", res_class)
+        return default
+
+    passing = [r for r in results if _meets_floor(r)]
+    if passing:
+        best = min(passing, key=lambda r: r["encode_s"])
+    else:
+        # Nenhum atinge o piso: fica com o de melhor qualidade
+        best = max(results, key=lambda r: r["ssim"])
+    log.info("Auto-tune %s: preset=%s crf=%s (ssim=%.4f, %.2fs; %d/%d candidatos no piso)",
+             res_class, best["preset"], best["crf"], best["ssim"], best["encode_s"], len(passing), len(results))
+
+    with _LOCK:
+        _load_cache()[key] = {
+            "preset": best["preset"],
+            "crf": best["crf"],
+            "measured": results,
+            "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        _save_cache()
+    return {"preset": best["preset"], "crf": best["crf"], "source": "autotune", "class": res_class}
@@ -0,0 +1,201 @@
+"""Envio de um registro para vários destinos (Gabriel, Marli...) com um upload.
+
+Cada registro guarda seus destinos (coluna ``destinations``, ex.:
+``"Gabriel,Marli"``); sem ela vale o destino selecionado na GUI
+(``SELECTED_SEND_TARGET``, onde ``"Ambos"`` = todos).
+
+``fan_out`` faz no máximo um upload por bot: o ``file_id`` devolvido pelo
+Telegram só vale para o bot que fez o upload, então destinos que usam o mesmo
+token reenviam pelo ``file_id`` (sem bytes) e destinos de outro bot fazem o
+próprio upload. Os destinos rodam em paralelo, cada um com seu limitador de
+taxa. A tabela ``deliveries`` registra o resultado por destino: numa nova
+tentativa só os destinos que falharam são refeitos.
+
+O envio HTTP em si fica com o chamador (``send_fn``), como no
+``DownloadScheduler``.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from . import metrics
+from .config import settings
+from .db import select_deliveries, upsert_delivery
+from .logs import get_logger
+
+log = get_logger(__name__, stage="send")
+
+TARGETS = ("Gabriel", "Marli")
+ALL_TARGETS = "Ambos"
+
+# send_fn(target, caminho, caption, record_id, file_id, upload_progress) -> (ok, erro, resposta JSON)
+SendFn = Callable[[str, str, str, Optional[int], Optional[str], Optional[Callable[[int, int], None]]],
+                  Tuple[bool, Optional[str], Dict[str, Any]]]
+
+
+def destination(target: str) -> Tuple[str, str]:
+    """(token, chat_id) de um destino."""
+    # Uso getattr para evitar AttributeError caso variáveis específicas não existam
+    if target.strip().lower() == "marli":
+        token = getattr(settings, "TELEGRAM_SEND_TOKEN_MARLI", "") or getattr(settings, "TELEGRAM_SEND_TOKEN", "")
+        chat_id = getattr(settings, "TELEGRAM_CHAT_ID_MARLI", "") or getattr(settings, "TELEGRAM_CHAT_ID", "")
+    else:
+        # Gabriel por padrão. Usar token de envio específico do Gabriel primeiro,
+        # depois fallback para token genérico ou token do bot.
+        token = getattr(settings, "TELEGRAM_SEND_TOKEN_GABRIEL", "") or getattr(settings, "TELEGRAM_SEND_TOKEN", "") or getattr(settings, "TELEGRAM_BOT_TOKEN", "")
+        chat_id = getattr(settings, "TELEGRAM_CHAT_ID_GABRIEL", "") or getattr(settings, "TELEGRAM_CHAT_ID", "")
+    return token, chat_id
+
+
+def bot_id(token: str) -> str:
+    """Parte pública do token (id do bot), usada para saber onde um file_id vale."""
+    return token.split(":", 1)[0]
+
+
+def parse_destinations(value: Optional[str]) -> List[str]:
+    names = []
+    for raw in (value or "").split(","):
+        raw = raw.strip()
+        if not raw:
+            continue
+        if raw.lower() == ALL_TARGETS.lower():
+            names.extend(TARGETS)
+            continue
+        # Normaliza para o nome canônico ("marli" -> "Marli")
+        names.append(next((t for t in TARGETS if t.lower() == raw.lower()), raw))
+    return list(dict.fromkeys(names))
+
+
+def selected_destinations() -> str:
+    """Destinos da seleção atual da GUI, no formato da coluna ``destinations``."""
+    return ",".join(parse_destinations(str(getattr(settings, "SELECTED_SEND_TARGET", "Gabriel")))) or TARGETS[0]
+
+
+def record_targets(rec) -> List[str]:
+    value = rec["destinations"] if rec is not None and "destinations" in rec.keys() else None
+    return parse_destinations(value or selected_destinations())
+
+
+class RateLimiter:
+    """Intervalo mínimo entre chamadas a um destino; respeita ``retry_after``."""
+
+    def __init__(self, min_interval: float):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.min_interval
+        if delay > 0:
+            time.sleep(delay)
+
+    def block(self, seconds: float):
+        with self._lock:
+            self._next = max(self._next, time.monotonic() + seconds)
+
+
+_limiters_lock = threading.Lock()
+_limiters: Dict[str, RateLimiter] = {}
+
+
+def limiter(target: str) -> RateLimiter:
+    with _limiters_lock:
+        lim = _limiters.get(target)
+        if lim is None:
+            lim = RateLimiter(settings.TELEGRAM_SEND_MIN_INTERVAL_SECONDS)
+            _limiters[target] = lim
+        return lim
+
+
+def message_file_id(payload: Dict[str, Any]) -> Optional[str]:
+    result = payload.get("result") or {}
+    for kind in ("video", "document", "animation"):
+        media = result.get(kind)
+        if isinstance(media, dict) and media.get("file_id"):
+            return media["file_id"]
+    return None
+
+
+def _send_one(send_fn: SendFn, target: str, path: str, caption: str, record_id: Optional[int],
+              file_id: Optional[str], upload_progress) -> Tuple[bool, Optional[str], Dict[str, Any]]:
+    lim = limiter(target)
+    for attempt in range(2):
+        lim.wait()
+        ok, err, payload = send_fn(target, path, caption, record_id, file_id, upload_progress)
+        retry_after = (payload.get("parameters") or {}).get("retry_after")
+        if ok or not retry_after or attempt:
+            return ok, err, payload
+        # Flood control: bloqueia o destino pelo tempo pedido e tenta de novo
+        log.warning("Flood control em %s, aguardando %ss", target, retry_after, extra={"record_id": record_id})
+        lim.block(float(retry_after))
+    return False, err, payload
+
+
+def fan_out(send_fn: SendFn, record_id: Optional[int], path: str, caption: str, targets: List[str],
+            upload_progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, Tuple[bool, Optional[str]]]:
+    """Entrega ``path`` a todos os ``targets``. Retorna ``{target: (ok, erro)}``."""
+    results: Dict[str, Tuple[bool, Optional[str]]] = {}
+    previous: Dict[str, Any] = {}
+    if record_id is not None:
+        try:
+            previous = {r["target"]: r for r in select_deliveries(record_id)}
+        except Exception as e:
+            log.warning("Falha ao ler entregas: %s", e, extra={"record_id": record_id})
+    # file_id já conhecido por bot (de entregas anteriores deste registro)
+    file_ids: Dict[str, str] = {r["bot_id"]: r["file_id"] for r in previous.values() if r["file_id"] and r["bot_id"]}
+
+    by_bot: Dict[str, List[Tuple[str, str]]] = {}
+    for target in targets:
+        prev = previous.get(target)
+        if prev is not None and prev["status"] == "sent":
+            results[target] = (True, None)
+            continue
+        token, chat_id = destination(target)
+        if not token or not chat_id:
+            results[target] = (False, "token/chat_id não configurados")
+            continue
+        by_bot.setdefault(bot_id(token), []).append((target, chat_id))
+    if not by_bot:
+        return results
+
+    def _deliver(target: str, chat_id: str, bot: str, file_id: Optional[str], progress) -> Tuple[bool, Optional[str]]:
+        try:
+            ok, err, payload = _send_one(send_fn, target, path, caption, record_id, file_id, progress)
+        except Exception as e:
+            ok, err, payload = False, f"{type(e).__name__}: {e}", {}
+        new_file_id = message_file_id(payload) if ok else None
+        if new_file_id:
+            file_ids.setdefault(bot, new_file_id)
+        metrics.inc("shopee_deliveries_total", labels={"target": target, "mode": "file_id" if file_id else "upload",
+                                                       "status": "ok" if ok else "fail"},
+                    help="Entregas por destino (upload ou reenvio por file_id)")
+        if record_id is not None:
+            try:
+                upsert_delivery(record_id, target, str(chat_id), bot, "sent" if ok else "failed",
+                                (payload.get("result") or {}).get("message_id"), new_file_id, err)
+            except Exception as e:
+                log.warning("Falha ao registrar entrega: %s", e, extra={"record_id": record_id})
+        return ok, err
+
+    workers = sum(len(v) for v in by_bot.values())
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="send") as pool:
+        # 1) um upload por bot sem file_id conhecido (bots diferentes em paralelo)
+        first = {}
+        for i, (bot, items) in enumerate(by_bot.items()):
+            if bot in file_ids:
+                continue
+            target, chat_id = items.pop(0)
+            # Progresso de upload só do primeiro, para não intercalar percentuais
+            first[target] = pool.submit(_deliver, target, chat_id, bot, None, upload_progress if i == 0 else None)
+        for target, fut in first.items():
+            results[target] = fut.result()
+        # 2) demais destinos pelo file_id do mesmo bot (upload se não houver)
+        rest = {target: pool.submit(_deliver, target, chat_id, bot, file_ids.get(bot), None)
+                for bot, items in by_bot.items() for target, chat_id in items}
+        for target, fut in rest.items():
+            results[target] = fut.result()
+    return results
@@ -0,0 +1,154 @@
+"""Utilitários de arquivo compartilhados pelo pipeline."""
+import errno
+import hashlib
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional, Tuple
+
+_HASH_CHUNK = 1024 * 1024
+
+# Marca no nome dos arquivos temporários de saída (ver AtomicOutput)
+TEMP_MARKER = ".tmp"
+
+_hash_lock = threading.Lock()
+# (caminho absoluto, tamanho, mtime_ns) -> sha256 hex
+_hash_memo: Dict[Tuple[str, int, int], str] = {}
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 do conteúdo do arquivo (memoizado por caminho/tamanho/mtime).
+
+    Vídeos grandes são lidos uma única vez por versão do arquivo; se o arquivo
+    mudar no disco (tamanho ou mtime), o hash é recalculado.
+    """
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _hash_lock:
+        cached = _hash_memo.get(key)
+    if cached:
+        return cached
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(_HASH_CHUNK)
+            if not chunk:
+                break
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _hash_lock:
+        _hash_memo[key] = digest
+    return digest
+
+
+def thumbnail_path(video_path: str) -> str:
+    """Miniatura JPEG gerada junto com o vídeo final (mesmo nome, ``.jpg``)."""
+    return os.path.splitext(video_path)[0] + ".jpg"
+
+
+def rendition_path(video_path: str, name: str) -> str:
+    """Rendition extra do final (``<final>_<nome>.mp4``)."""
+    return os.path.splitext(video_path)[0] + f"_{name}.mp4"
+
+
+def link_or_copy(src: str, dst: str) -> str:
+    """Publica ``src`` em ``dst`` via hardlink (sem copiar bytes); cópia se não der.
+
+    Retorna ``"link"`` ou ``"copy"``. A troca em ``dst`` é atômica.
+    """
+    tmp = dst + TEMP_MARKER
+    try:
+        os.remove(tmp)
+    except OSError:
+        pass
+    try:
+        os.link(src, tmp)
+        how = "link"
+    except OSError:
+        # Sistemas de arquivos sem hardlink (ou volumes diferentes)
+        shutil.copy2(src, tmp)
+        how = "copy"
+    os.replace(tmp, dst)
+    return how
+
+
+class AtomicOutput:
+    """Arquivo de saída publicado só depois de verificado.
+
+    O produtor escreve em ``tmp_path`` (mesmo diretório do destino, mesma
+    extensão para o FFmpeg inferir o container) e chama ``commit()``, que
+    valida e faz ``os.replace`` para o caminho final. Saindo do bloco sem
+    commit (erro, timeout, processo morto), o temporário é apagado: um arquivo
+    truncado nunca aparece no caminho final.
+
+    Com ``tmp_dir`` (ex.: scratch em tmpfs) o temporário fica lá; se for outro
+    sistema de arquivos, o commit copia para o destino (ainda atômico).
+
+        with atomic_output(out_path) as out:
+            rodar_ffmpeg(..., out.tmp_path)
+            ok = out.commit(verify=arquivo_valido)
+    """
+
+    def __init__(self, final_path: str, tmp_dir: Optional[str] = None):
+        self.final_path = final_path
+        directory = tmp_dir or os.path.dirname(os.path.abspath(final_path))
+        name, ext = os.path.splitext(os.path.basename(final_path))
+        self.tmp_path = os.path.join(directory, f".{name}.{uuid.uuid4().hex[:8]}{TEMP_MARKER}{ext}")
+        self.committed = False
+
+    def commit(self, verify: Optional[Callable[[str], bool]] = None) -> bool:
+        if not os.path.exists(self.tmp_path) or os.path.getsize(self.tmp_path) == 0:
+            return False
+        if verify is not None and not verify(self.tmp_path):
+            return False
+        try:
+            os.replace(self.tmp_path, self.final_path)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            link_or_copy(self.tmp_path, self.final_path)
+            self.discard()
+        self.committed = True
+        return True
+
+    def discard(self):
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+    def __enter__(self) -> "AtomicOutput":
+        os.makedirs(os.path.dirname(self.tmp_path), exist_ok=True)
+        os.makedirs(os.path.dirname(os.path.abspath(self.final_path)), exist_ok=True)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.committed:
+            self.discard()
+        return False
+
+
+def atomic_output(final_path: str, tmp_dir: Optional[str] = None) -> AtomicOutput:
+    return AtomicOutput(final_path, tmp_dir)
+
+
+def cleanup_stale_temp(directory: str, max_age_seconds: int = 3600) -> int:
+    """Apaga temporários de execuções interrompidas (``.*.tmp.*``). Retorna quantos."""
+    removed = 0
+    cutoff = time.time() - max_age_seconds
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return 0
+    for entry in entries:
+        if not (entry.name.startswith(".") and TEMP_MARKER in entry.name):
+            continue
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
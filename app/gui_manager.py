@@ -6,9 +6,14 @@ from typing import Optional
 import sqlite3
 
 from .config import settings
+from . import checkpoints, fanout, metrics, retention
 from .simple_processor import process_all_videos, _process_record
 from .db import init_db, insert_original, select_pending_or_failed, get_original_record, get_conn
 from .bot_ingest import run_bot_asyncio
+from .downloader import DownloadScheduler
+from .logs import get_logger
+
+log = get_logger(__name__, stage="gui")
 
 
 class LogTerminal:
@@ -283,7 +288,8 @@ class VideoFormWindow:
                     telegram_file_id=None,
                     original_path=None,
                     link_produto=produto_link if produto_link else None,
-                    descricao=descricao if descricao else None
+                    descricao=descricao if descricao else None,
+                    destinations=fanout.selected_destinations()
                 )
                 ids_inseridos.append(rec_id)
                 # Mapear entry <-> id do banco para atualizar UI por callbacks
@@ -303,7 +309,8 @@ class VideoFormWindow:
     
     def _process_videos_thread(self, ids: list):
         """Processar vídeos em background com logs detalhados"""
-        for vid_id in ids:
+        for idx, vid_id in enumerate(ids):
+            metrics.set_gauge("shopee_queue_depth", len(ids) - idx)
             try:
                 self.log_terminal.log(f"🔄 Processando ID {vid_id}...", "PROCESSING")
                 
@@ -353,12 +360,13 @@ class VideoFormWindow:
                 self.log_terminal.log(f"❌ Erro geral no ID {vid_id}: {e}", "ERROR")
                 self.log_terminal.update_stats(falhas=1)
         
+        metrics.set_gauge("shopee_queue_depth", 0)
         self.log_terminal.log("=== PROCESSAMENTO FINALIZADO ===", "SUCCESS")
     
     def _process_by_stages_thread(self, ids: list):
         """Processar por etapas: 1) Baixar todos → 2) Processar todos → 3) Enviar todos"""
         from .video_tools import ensure_shopee_ready, validate_min_height, ffprobe_media
-        from .db import update_original_path, insert_or_update_processed, increment_retry
+        from .db import insert_or_update_processed, increment_retry, update_renditions
         
         self.log_terminal.log("=== ETAPA 1: BAIXANDO TODOS OS VÍDEOS ===", "PROCESSING")
         
@@ -366,46 +374,33 @@ class VideoFormWindow:
         def progress_cb(record_id: int, stage: str, status: str):
             self._progress_ui(record_id, stage, status)
         
-        # ETAPA 1: Baixar todos
+        # ETAPA 1: Baixar todos (em paralelo, respeitando o limite por host)
+        from .simple_processor import _download_record
+        scheduler = DownloadScheduler(lambda rid: _download_record(rid, progress_cb=progress_cb))
+        scheduler.schedule_all(ids)
         downloaded = {}
-        for vid_id in ids:
-            try:
-                progress_cb(vid_id, "download", "start")
-                rec = get_original_record(vid_id)
-                if not rec:
-                    self.log_terminal.log(f"❌ ID {vid_id} não encontrado", "ERROR")
-                    progress_cb(vid_id, "download", "fail")
-                    continue
-                
-                source_type = rec["source_type"] if "source_type" in rec.keys() else None
-                source_url = rec["source_url"] if "source_url" in rec.keys() else None
-                telegram_file_id = rec["telegram_file_id"] if "telegram_file_id" in rec.keys() else None
-                link_produto = rec["link_produto"] if "link_produto" in rec.keys() else None
-                descricao = rec["descricao"] if "descricao" in rec.keys() else None
-                
-                # Baixar
-                from .simple_processor import _download_from_url, _download_from_telegram_file_id
-                original_path = None
-                if source_type == "url" and source_url:
-                    original_path = _download_from_url(source_url, settings.DOWNLOAD_DIR)
-                elif source_type == "telegram" and telegram_file_id:
-                    original_path = _download_from_telegram_file_id(telegram_file_id, settings.DOWNLOAD_DIR)
-                
-                if original_path:
-                    update_original_path(vid_id, original_path)
-                    w, h, d, s = ffprobe_media(original_path)
-                    insert_or_update_processed(vid_id, None, "pending", None, (w, h, d, s), link_produto, descricao)
-                    downloaded[vid_id] = {"path": original_path, "link_produto": link_produto, "descricao": descricao}
-                    self.log_terminal.log(f"✅ ID {vid_id} baixado", "SUCCESS")
-                    progress_cb(vid_id, "download", "ok")
-                else:
-                    self.log_terminal.log(f"❌ Falha no download do ID {vid_id}", "ERROR")
-                    insert_or_update_processed(vid_id, None, "failed", "download_failed", (None, None, None, None), link_produto, descricao)
-                    increment_retry(vid_id)
+        try:
+            for vid_id in ids:
+                try:
+                    original_path = scheduler.result(vid_id)
+                    rec = get_original_record(vid_id)
+                    if not rec:
+                        self.log_terminal.log(f"❌ ID {vid_id} não encontrado", "ERROR")
+                        progress_cb(vid_id, "download", "fail")
+                        continue
+                    link_produto = rec["link_produto"] if "link_produto" in rec.keys() else None
+                    descricao = rec["descricao"] if "descricao" in rec.keys() else None
+                    if original_path:
+                        downloaded[vid_id] = {"path": original_path, "link_produto": link_produto, "descricao": descricao,
+                                              "targets": fanout.record_targets(rec)}
+                        self.log_terminal.log(f"✅ ID {vid_id} baixado", "SUCCESS")
+                    else:
+                        self.log_terminal.log(f"❌ Falha no download do ID {vid_id}", "ERROR")
+                except Exception as e:
+                    self.log_terminal.log(f"❌ Erro no download ID {vid_id}: {e}", "ERROR")
                     progress_cb(vid_id, "download", "fail")
-            except Exception as e:
-                self.log_terminal.log(f"❌ Erro no download ID {vid_id}: {e}", "ERROR")
-                progress_cb(vid_id, "download", "fail")
+        finally:
+            scheduler.shutdown()
         
         self.log_terminal.log(f"=== ETAPA 2: PROCESSANDO {len(downloaded)} VÍDEOS ===", "PROCESSING")
         
@@ -414,12 +409,25 @@ class VideoFormWindow:
         for vid_id, data in downloaded.items():
             try:
                 progress_cb(vid_id, "process", "start")
-                processed_path, report = ensure_shopee_ready(data["path"])
+                encoded = checkpoints.completed(vid_id).get("encoded")
+                if encoded:
+                    # Encode anterior ainda válido: só falta o envio
+                    processed_path = encoded["path"]
+                    self.log_terminal.log(f"↻ ID {vid_id}: reaproveitando arquivo já processado", "INFO")
+                else:
+                    from .simple_processor import _encode_progress_cb
+                    processed_path, report = ensure_shopee_ready(data["path"], progress_cb=_encode_progress_cb(vid_id, progress_cb))
+                    renditions = report.get("renditions") or {}
+                    checkpoints.mark(vid_id, "encoded", processed_path, meta={"changed": report.get("changed"), "renditions": renditions})
+                    if renditions:
+                        update_renditions(vid_id, renditions)
+                    retention.after_process(vid_id, data["path"], processed_path, renditions.values())
                 ok = validate_min_height(processed_path, settings.VIDEO_TARGET_MIN_HEIGHT)
 
                 w, h, d, s = ffprobe_media(processed_path)
                 insert_or_update_processed(vid_id, processed_path, "pending", None, (w, h, d, s), data["link_produto"], data["descricao"])
-                processed[vid_id] = {"path": processed_path, "link_produto": data["link_produto"], "descricao": data["descricao"]}
+                processed[vid_id] = {"path": processed_path, "link_produto": data["link_produto"], "descricao": data["descricao"],
+                                     "targets": data["targets"]}
                 if ok:
                     self.log_terminal.log(f"✅ ID {vid_id} processado (Shopee-ready)", "SUCCESS")
                 else:
@@ -431,13 +439,17 @@ class VideoFormWindow:
         
         self.log_terminal.log(f"=== ETAPA 3: ENVIANDO {len(processed)} VÍDEOS ===", "PROCESSING")
         
-        # ETAPA 3: Enviar todos
+        # ETAPA 3: Enviar todos (em álbuns de até 10 com TELEGRAM_MEDIA_GROUP;
+        # registros com vários destinos fazem um upload e reenviam por file_id)
+        from .simple_processor import _deliver, _send_batch, _upload_progress_cb
+        ready = []
         for vid_id, data in processed.items():
             try:
                 progress_cb(vid_id, "send", "start")
                 
                 # Obter resolução do vídeo processado
                 w, h, d, s = ffprobe_media(data["path"])
+                data["meta"] = (w, h, d, s)
                 resolution_text = f"{h}p" if h else "N/A"
                 
                 # Montar caption com descrição + resolução, depois link do produto
@@ -451,12 +463,39 @@ class VideoFormWindow:
                     caption_parts.append(str(data["link_produto"]))
                 
                 caption = "\n\n".join(caption_parts) if caption_parts else ""
-                
-                from .simple_processor import _send_to_telegram
-                sent_ok, err = _send_to_telegram(data["path"], caption=caption)
+                ready.append((vid_id, data["path"], caption))
+            except Exception as e:
+                self.log_terminal.log(f"❌ Erro no envio ID {vid_id}: {e}", "ERROR")
+                progress_cb(vid_id, "send", "fail")
+
+        batch_results = {}
+        if settings.TELEGRAM_MEDIA_GROUP:
+            # Álbuns por destino, para registros com um único destino; falhas
+            # de um álbum caem para envio individual dentro de _send_batch
+            by_target = {}
+            for item in ready:
+                targets = processed[item[0]]["targets"]
+                if len(targets) == 1:
+                    by_target.setdefault(targets[0], []).append(item)
+            for target, items in by_target.items():
+                if len(items) > 1:
+                    metas = {rid: dict(zip(("width", "height", "duration"), processed[rid]["meta"][:3])) for rid, _, _ in items}
+                    batch_results.update(_send_batch(items, progress_cb, target=target, video_meta=metas))
+
+        for vid_id, path, caption in ready:
+            data = processed[vid_id]
+            try:
+                w, h, d, s = data["meta"]
+                if vid_id in batch_results:
+                    sent_ok, err = batch_results[vid_id]
+                else:
+                    sent_ok, err = _deliver(vid_id, path, caption, data["targets"],
+                                            upload_progress=_upload_progress_cb(vid_id, progress_cb),
+                                            video_meta={"width": w, "height": h, "duration": d})
                 
                 if sent_ok:
                     insert_or_update_processed(vid_id, data["path"], "processed", None, (w, h, d, s), data["link_produto"], data["descricao"])
+                    checkpoints.mark(vid_id, "sent", data["path"], meta={"width": w, "height": h, "duration": d, "size_bytes": s})
                     self.log_terminal.log(f"✅ ID {vid_id} enviado", "SUCCESS")
                     progress_cb(vid_id, "send", "ok")
                     self.log_terminal.update_stats(enviados=1)
@@ -497,7 +536,8 @@ class VideoFormWindow:
                     telegram_file_id=None,
                     original_path=None,
                     link_produto=produto_link if produto_link else None,
-                    descricao=descricao if descricao else None
+                    descricao=descricao if descricao else None,
+                    destinations=fanout.selected_destinations()
                 )
                 ids_inseridos.append(rec_id)
                 entry["db_id"] = rec_id
@@ -570,7 +610,11 @@ class VideoFormWindow:
             entry = self._entry_by_db_id.get(record_id)
             if not entry:
                 return
-            icon = "⏳" if status == "start" else ("✅" if status == "ok" else "❌")
+            if status.startswith("progress:"):
+                # Progresso do encode (ex.: "progress:42")
+                icon = f"{status.split(':', 1)[1]}%"
+            else:
+                icon = "⏳" if status == "start" else ("✅" if status == "ok" else "❌")
             if stage == "download":
                 entry["lbl_download"].config(text=icon)
             elif stage == "process":
@@ -870,11 +914,13 @@ def _run_bot():
     try:
         run_bot_asyncio()
     except Exception as e:
-        print(f"[BOT] erro: {e}")
+        log.exception("Erro no bot: %s", e, extra={"stage": "bot"})
 
 
 def start_gui():
     init_db()
+    metrics.start_metrics_server()
+    retention.run_maintenance()
     
     root = tk.Tk()
     root.title("Sistema Shopee Telegram - Gerenciador de Vídeos")
@@ -986,7 +1032,7 @@ def start_gui():
             except Exception:
                 pass
 
-        target_combo = ttk.Combobox(control_frame, values=("Gabriel", "Marli"), width=8, textvariable=send_target_var, state="readonly")
+        target_combo = ttk.Combobox(control_frame, values=fanout.TARGETS + (fanout.ALL_TARGETS,), width=8, textvariable=send_target_var, state="readonly")
         target_combo.bind("<<ComboboxSelected>>", _on_target_change)
         target_combo.pack(side=tk.LEFT, padx=2)
     except Exception:
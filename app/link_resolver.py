@@ -0,0 +1,164 @@
+"""Resolve links colados no bot (compartilhamento/encurtados) para a URL do vídeo.
+
+O texto recebido por ``handle_text`` vira ``source_url`` como veio: pode ser
+um link curto (``s.shopee.com.br/...``) que só redireciona, uma página HTML
+de produto ou já o MP4 na CDN. ``resolve`` devolve a URL a baixar:
+
+1. extrai a primeira URL http(s) do texto e remove parâmetros de rastreio
+2. consulta o cache (tabela ``url_cache``, válido por ``URL_CACHE_TTL_SECONDS``)
+3. faz um GET seguindo redirecionamentos; se a resposta já é vídeo, a URL
+   final é a de mídia, sem baixar o corpo
+4. se é HTML, lê até ``MAX_HTML_BYTES`` e procura ``og:video``,
+   ``<video>/<source src>`` ou um link ``.mp4`` no conteúdo (inclusive JSON
+   embutido com ``\\/``)
+
+Envios repetidos do mesmo vídeo de produto pulam os passos 3-4. Se nada for
+encontrado, a URL original segue para o download (e a verificação de
+``preflight`` recusa o HTML com erro específico).
+
+A sessão HTTP vem do chamador; nada aqui depende do host, então o resolvedor
+funciona contra um servidor local de teste: ``scripts/check_link_resolver.py``.
+"""
+import html
+import re
+import time
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+
+from . import metrics
+from .config import settings
+from .db import delete_url_cache, get_url_cache, put_url_cache
+from .downloader import host_slot
+from .logs import get_logger
+
+log = get_logger(__name__, stage="download")
+
+BROWSER_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36",
+    "Accept": "*/*",
+    "Connection": "keep-alive",
+    "Referer": "https://shopee.com.br/",
+}
+
+# Página de produto não precisa ser lida inteira para achar o og:video
+MAX_HTML_BYTES = 2 * 1024 * 1024
+
+_MEDIA_EXTENSIONS = (".mp4", ".m4v", ".mov", ".webm", ".mkv")
+_TRACKING_PARAMS = ("utm_", "smtt", "share_", "fbclid", "gclid")
+
+_URL_RE = re.compile(r"https?://[^\s<>\"']+", re.IGNORECASE)
+_META_RE = re.compile(r"<meta\b[^>]*>", re.IGNORECASE)
+_ATTR_RE = re.compile(r"""([a-zA-Z:_-]+)\s*=\s*("([^"]*)"|'([^']*)')""")
+_SRC_RE = re.compile(r"""<(?:video|source)\b[^>]*?\bsrc\s*=\s*["']([^"']+)["']""", re.IGNORECASE)
+_MP4_RE = re.compile(r"""https?:(?://|\\/\\/)[^\s"'<>]+?\.mp4(?:\?[^\s"'<>]*)?""", re.IGNORECASE)
+_OG_VIDEO = ("og:video:secure_url", "og:video:url", "og:video", "twitter:player:stream")
+
+
+def normalize(text: str) -> Optional[str]:
+    """Primeira URL do texto, sem fragmento e sem parâmetros de rastreio."""
+    m = _URL_RE.search(text or "")
+    if not m:
+        return None
+    parts = urlsplit(m.group(0).rstrip(").,;"))
+    pairs = parse_qsl(parts.query, keep_blank_values=True)
+    query = [(k, v) for k, v in pairs if not k.lower().startswith(_TRACKING_PARAMS)]
+    # Query reescrita só se algo saiu (URLs assinadas da CDN ficam intactas)
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path,
+                       urlencode(query) if len(query) != len(pairs) else parts.query, ""))
+
+
+def _is_media_url(url: str) -> bool:
+    return urlsplit(url).path.lower().endswith(_MEDIA_EXTENSIONS)
+
+
+def _is_media_response(content_type: str) -> bool:
+    content_type = content_type.split(";", 1)[0].strip().lower()
+    return content_type.startswith("video/") or content_type in ("application/octet-stream", "application/mp4")
+
+
+def extract_media_url(page: str, base_url: str) -> Optional[str]:
+    """URL do vídeo numa página HTML (og:video, <video>/<source>, link .mp4)."""
+    metas = {}
+    for tag in _META_RE.findall(page):
+        attrs = {m.group(1).lower(): m.group(3) if m.group(3) is not None else m.group(4)
+                 for m in _ATTR_RE.finditer(tag)}
+        key = (attrs.get("property") or attrs.get("name") or "").lower()
+        if key in _OG_VIDEO and attrs.get("content"):
+            metas.setdefault(key, attrs["content"])
+    candidates = [metas[k] for k in _OG_VIDEO if k in metas]
+    candidates += _SRC_RE.findall(page)
+    candidates += [m.replace("\\/", "/") for m in _MP4_RE.findall(page)]
+    for raw in candidates:
+        url = urljoin(base_url, html.unescape(raw).replace("\\u002F", "/").strip())
+        if url.lower().startswith(("http://", "https://")):
+            return url
+    return None
+
+
+def fetch_media_url(session, url: str) -> Optional[str]:
+    """Segue redirecionamentos e devolve a URL de mídia, ou None se a página não tiver.
+
+    Erros HTTP (ex.: 404) levantam exceção do ``requests``.
+    """
+    with host_slot(url), session.get(url, stream=True, timeout=30, headers=BROWSER_HEADERS,
+                                     allow_redirects=True) as r:
+        r.raise_for_status()
+        final_url = r.url or url
+        if _is_media_response(r.headers.get("Content-Type") or ""):
+            # Já é o vídeo: só a URL final interessa, o corpo fica para o download
+            return final_url
+        body = b""
+        for chunk in r.iter_content(chunk_size=64 * 1024):
+            body += chunk
+            if len(body) >= MAX_HTML_BYTES:
+                break
+        encoding = r.encoding or "utf-8"
+    return extract_media_url(body.decode(encoding, errors="replace"), final_url)
+
+
+def resolve(session, text: str) -> str:
+    """URL a baixar para o ``source_url`` recebido (a própria, se não resolver)."""
+    url = normalize(text)
+    if not url:
+        return text.strip()
+    if not settings.URL_RESOLVE or _is_media_url(url):
+        return url
+    now = time.time()
+    try:
+        cached = get_url_cache(url, now)
+    except Exception as e:
+        log.warning("Falha ao ler cache de URLs: %s", e)
+        cached = None
+    if cached:
+        metrics.inc("shopee_url_resolve_total", labels={"result": "cache"},
+                    help="Resolução de links de compartilhamento")
+        return cached
+
+    with metrics.timer("shopee_url_resolve_seconds", help="Duração da resolução de links") as t:
+        try:
+            media_url = fetch_media_url(session, url)
+        except Exception as e:
+            log.warning("Falha ao resolver link: %s", e)
+            media_url = None
+        t.labels["status"] = "ok" if media_url else "unresolved"
+    metrics.inc("shopee_url_resolve_total", labels={"result": "resolved" if media_url else "unresolved"})
+    if not media_url:
+        return url
+    log.debug("Link resolvido para mídia em %.0f ms", t.elapsed * 1000)
+    if settings.URL_CACHE_TTL_SECONDS > 0:
+        try:
+            put_url_cache(url, media_url, now + settings.URL_CACHE_TTL_SECONDS, now)
+        except Exception as e:
+            log.warning("Falha ao gravar cache de URLs: %s", e)
+    return media_url
+
+
+def forget(text: str):
+    """Invalida o mapeamento (ex.: a URL da CDN expirou e o download deu 403/404)."""
+    url = normalize(text)
+    if not url:
+        return
+    try:
+        delete_url_cache(url)
+    except Exception as e:
+        log.warning("Falha ao invalidar cache de URLs: %s", e)
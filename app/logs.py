@@ -0,0 +1,164 @@
+"""Logging estruturado do pipeline.
+
+- Saída em texto legível (padrão) ou JSON lines (``LOG_FORMAT=json``)
+- Handler com fila (QueueHandler/QueueListener): quem loga só enfileira o
+  registro; a escrita no console/arquivo acontece numa thread separada
+- Nível global via ``LOG_LEVEL`` e por módulo via
+  ``LOG_LEVELS="app.video_tools=DEBUG,app.db=WARNING"``
+- Arquivo opcional via ``LOG_FILE`` (sempre em JSON lines)
+
+Campos estruturados aceitos em ``extra``: record_id, stage, duration_ms, bytes.
+
+Este módulo lê apenas variáveis de ambiente (não importa ``config``), pois o
+próprio ``config`` loga durante o import.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+# Campos extras que viram chaves no JSON / sufixo key=value no texto
+STRUCTURED_FIELDS = ("record_id", "stage", "duration_ms", "bytes")
+
+_ROOT = "app"
+_LOCK = threading.Lock()
+_listener: Optional[QueueListener] = None
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class _TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        ts = datetime.fromtimestamp(record.created).strftime("%H:%M:%S")
+        stage = getattr(record, "stage", None)
+        prefix = f"[{str(stage).upper()}] " if stage else ""
+        line = f"{ts} {record.levelname:<7} {prefix}{record.getMessage()}"
+        fields = [f"{f}={getattr(record, f)}" for f in STRUCTURED_FIELDS
+                  if f != "stage" and getattr(record, f, None) is not None]
+        if fields:
+            line += " (" + " ".join(fields) + ")"
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve mensagem e traceback na thread de origem, preservando os
+        # campos estruturados para o formatter que roda na thread do listener.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+class _StageAdapter(logging.LoggerAdapter):
+    """Adapter que injeta ``stage`` padrão e mescla o ``extra`` de cada chamada."""
+
+    def process(self, msg, kwargs):
+        extra = kwargs.get("extra")
+        if extra:
+            merged = dict(self.extra)
+            merged.update(extra)
+            kwargs["extra"] = merged
+        else:
+            kwargs["extra"] = self.extra
+        return msg, kwargs
+
+
+def _level(name: str, default: Optional[int] = None) -> Optional[int]:
+    value = logging.getLevelName(str(name).strip().upper())
+    return value if isinstance(value, int) else default
+
+
+def _parse_levels(spec: str) -> Dict[str, int]:
+    levels: Dict[str, int] = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, level = item.split("=", 1)
+        value = _level(level)
+        if value is not None:
+            levels[name.strip()] = value
+    return levels
+
+
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        try:
+            _listener.stop()
+        except Exception:
+            pass
+        _listener = None
+
+
+def setup_logging(force: bool = False):
+    """Configura o logger ``app`` (idempotente; chamado por ``get_logger``)."""
+    global _listener
+    with _LOCK:
+        if _listener is not None and not force:
+            return
+        _stop_listener()
+
+        root = logging.getLogger(_ROOT)
+        for h in list(root.handlers):
+            root.removeHandler(h)
+        root.setLevel(_level(os.environ.get("LOG_LEVEL", "INFO"), logging.INFO))
+        root.propagate = False
+        for name, level in _parse_levels(os.environ.get("LOG_LEVELS", "")).items():
+            logging.getLogger(name).setLevel(level)
+
+        console = logging.StreamHandler(sys.stdout)
+        if os.environ.get("LOG_FORMAT", "text").strip().lower() == "json":
+            console.setFormatter(_JsonFormatter())
+        else:
+            console.setFormatter(_TextFormatter())
+        handlers = [console]
+
+        log_file = os.environ.get("LOG_FILE", "").strip()
+        if log_file:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+                fh = logging.FileHandler(log_file, encoding="utf-8")
+                fh.setFormatter(_JsonFormatter())
+                handlers.append(fh)
+            except Exception:
+                pass
+
+        q: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+        root.addHandler(_QueueHandler(q))
+        _listener = QueueListener(q, *handlers, respect_handler_level=True)
+        _listener.start()
+
+
+def get_logger(name: str, stage: Optional[str] = None) -> logging.LoggerAdapter:
+    """Retorna o logger do módulo com ``stage`` padrão (ex.: ``"ffmpeg"``)."""
+    setup_logging()
+    return _StageAdapter(logging.getLogger(name), {"stage": stage} if stage else {})
+
+
+atexit.register(_stop_listener)
@@ -0,0 +1,286 @@
+"""Métricas in-process do pipeline (contadores, gauges e histogramas).
+
+Os dados ficam em memória e podem ser lidos de duas formas:
+- ``render_prometheus()``: formato texto do Prometheus (endpoint ``/metrics``)
+- ``snapshot()``: dict serializável em JSON com p50/p95/p99 (endpoint ``/metrics.json``)
+
+O servidor HTTP é opcional e só sobe quando ``METRICS_PORT`` > 0.
+"""
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from .config import settings
+from .logs import get_logger
+
+log = get_logger(__name__, stage="metrics")
+
+# Buckets em segundos: cobre desde queries no SQLite até transcodes longos
+DEFAULT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# Buckets de vazão (MB/s) para downloads/uploads
+THROUGHPUT_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 50, 100)
+# Quantas amostras recentes guardar por série para calcular quantis no snapshot
+_QUANTILE_WINDOW = 1024
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+_LOCK = threading.Lock()
+_counters: Dict[str, Dict[LabelKey, float]] = {}
+_gauges: Dict[str, Dict[LabelKey, float]] = {}
+_histograms: Dict[str, Dict[LabelKey, "_Histogram"]] = {}
+_help: Dict[str, str] = {}
+
+_server: Optional[ThreadingHTTPServer] = None
+
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent: deque = deque(maxlen=_QUANTILE_WINDOW)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+        for i, b in enumerate(self.buckets):
+            if value <= b:
+                self.counts[i] += 1
+                break
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.recent:
+            return None
+        data = sorted(self.recent)
+        idx = min(len(data) - 1, max(0, int(round(q * (len(data) - 1)))))
+        return data[idx]
+
+
+def _label_key(labels: Optional[Dict[str, Any]]) -> LabelKey:
+    if not labels:
+        return ()
+    return tuple(sorted((str(k), str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1.0, labels: Optional[Dict[str, Any]] = None, help: Optional[str] = None):
+    """Incrementa um contador."""
+    key = _label_key(labels)
+    with _LOCK:
+        if help:
+            _help.setdefault(name, help)
+        series = _counters.setdefault(name, {})
+        series[key] = series.get(key, 0.0) + value
+
+
+def set_gauge(name: str, value: float, labels: Optional[Dict[str, Any]] = None, help: Optional[str] = None):
+    """Define o valor atual de um gauge (ex.: profundidade da fila)."""
+    key = _label_key(labels)
+    with _LOCK:
+        if help:
+            _help.setdefault(name, help)
+        _gauges.setdefault(name, {})[key] = float(value)
+
+
+def observe(name: str, value: float, labels: Optional[Dict[str, Any]] = None, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, help: Optional[str] = None):
+    """Registra uma amostra em um histograma."""
+    key = _label_key(labels)
+    with _LOCK:
+        if help:
+            _help.setdefault(name, help)
+        series = _histograms.setdefault(name, {})
+        hist = series.get(key)
+        if hist is None:
+            hist = series[key] = _Histogram(buckets)
+        hist.observe(float(value))
+
+
+class _Timer:
+    def __init__(self, labels: Optional[Dict[str, Any]]):
+        self.labels: Dict[str, Any] = dict(labels or {})
+        self.start = time.perf_counter()
+        self.elapsed = 0.0
+
+
+@contextmanager
+def timer(name: str, labels: Optional[Dict[str, Any]] = None, help: Optional[str] = None) -> Iterator[_Timer]:
+    """Mede a duração de um bloco em segundos.
+
+    O chamador pode ajustar ``t.labels`` dentro do bloco (ex.: ``status``).
+    Se o bloco lançar exceção, ``status=error`` é usado quando não definido.
+    """
+    t = _Timer(labels)
+    try:
+        yield t
+    except BaseException:
+        t.labels.setdefault("status", "error")
+        raise
+    finally:
+        t.elapsed = time.perf_counter() - t.start
+        observe(name, t.elapsed, t.labels, help=help)
+
+
+def timed(name: str, **labels: Any):
+    """Decorator que registra a duração da função no histograma ``name``."""
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timer(name, labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def record_transfer(name: str, nbytes: int, seconds: float, labels: Optional[Dict[str, Any]] = None):
+    """Registra bytes transferidos e a vazão (MB/s) de um download/upload."""
+    inc(f"{name}_bytes_total", nbytes, labels)
+    if seconds > 0 and nbytes > 0:
+        observe(f"{name}_throughput_mbps", (nbytes / (1024 * 1024)) / seconds, labels, buckets=THROUGHPUT_BUCKETS)
+
+
+def reset():
+    """Zera todas as séries (útil para benchmarks)."""
+    with _LOCK:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+
+# ==========================
+# Exportação
+# ==========================
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(key)
+    if extra:
+        items.append(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _fmt_num(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+def render_prometheus() -> str:
+    """Retorna todas as séries no formato texto de exposição do Prometheus."""
+    lines = []
+    with _LOCK:
+        for name in sorted(_counters):
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} counter")
+            for key, v in sorted(_counters[name].items()):
+                lines.append(f"{name}{_fmt_labels(key)} {_fmt_num(v)}")
+        for name in sorted(_gauges):
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} gauge")
+            for key, v in sorted(_gauges[name].items()):
+                lines.append(f"{name}{_fmt_labels(key)} {_fmt_num(v)}")
+        for name in sorted(_histograms):
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, h in sorted(_histograms[name].items()):
+                acc = 0
+                for b, c in zip(h.buckets, h.counts):
+                    acc += c
+                    lines.append(f"{name}_bucket{_fmt_labels(key, ('le', _fmt_num(b)))} {acc}")
+                lines.append(f"{name}_bucket{_fmt_labels(key, ('le', '+Inf'))} {h.count}")
+                lines.append(f"{name}_sum{_fmt_labels(key)} {_fmt_num(h.sum)}")
+                lines.append(f"{name}_count{_fmt_labels(key)} {h.count}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot() -> Dict[str, Any]:
+    """Snapshot JSON-serializável com contadores, gauges e quantis dos histogramas."""
+    with _LOCK:
+        return {
+            "timestamp": time.time(),
+            "counters": {
+                name: [{"labels": dict(k), "value": v} for k, v in sorted(series.items())]
+                for name, series in sorted(_counters.items())
+            },
+            "gauges": {
+                name: [{"labels": dict(k), "value": v} for k, v in sorted(series.items())]
+                for name, series in sorted(_gauges.items())
+            },
+            "histograms": {
+                name: [
+                    {
+                        "labels": dict(k),
+                        "count": h.count,
+                        "sum": h.sum,
+                        "p50": h.quantile(0.50),
+                        "p95": h.quantile(0.95),
+                        "p99": h.quantile(0.99),
+                    }
+                    for k, h in sorted(series.items())
+                ]
+                for name, series in sorted(_histograms.items())
+            },
+        }
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            body = render_prometheus().encode("utf-8")
+            ctype = "text/plain; version=0.0.4; charset=utf-8"
+        elif path == "/metrics.json":
+            body = json.dumps(snapshot()).encode("utf-8")
+            ctype = "application/json"
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Silencia o log padrão de cada requisição
+        pass
+
+
+def start_metrics_server(port: Optional[int] = None, host: Optional[str] = None) -> Optional[ThreadingHTTPServer]:
+    """Sobe o servidor HTTP de métricas em thread daemon (idempotente).
+
+    Retorna None quando desabilitado (porta 0) ou se a porta não puder ser aberta.
+    """
+    global _server
+    port = settings.METRICS_PORT if port is None else port
+    host = settings.METRICS_HOST if host is None else host
+    if not port:
+        return None
+    with _LOCK:
+        if _server is not None:
+            return _server
+        try:
+            _server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+        except OSError as e:
+            log.error("Não foi possível abrir %s:%s: %s", host, port, e)
+            return None
+        _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    log.info("Endpoint em http://%s:%s/metrics (JSON: /metrics.json)", host, port)
+    return _server
@@ -0,0 +1,85 @@
+"""Corpo ``multipart/form-data`` em streaming para uploads grandes.
+
+Com ``files=`` o ``requests`` monta o corpo inteiro em memória antes de
+enviar (o vídeo todo + cópias). ``MultipartEncoder`` calcula o
+``Content-Length`` de antemão e gera o corpo em blocos de ``CHUNK_SIZE``
+lidos direto do arquivo, então a memória por upload fica constante:
+
+    enc = MultipartEncoder({"chat_id": "123"}, {"video": ("a.mp4", "/caminho/a.mp4", "video/mp4")})
+    SESSION.post(url, data=enc, headers={"Content-Type": enc.content_type})
+
+O ``requests`` usa ``len(enc)`` como ``Content-Length`` e itera o objeto para
+escrever no socket. Cada iteração reabre os arquivos, então o mesmo encoder
+pode ser reenviado.
+"""
+import os
+import uuid
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+CHUNK_SIZE = 1024 * 1024
+
+# nome do campo -> (nome do arquivo, caminho no disco, content-type)
+FileSpec = Tuple[str, str, str]
+
+
+def _quote(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', "%22").replace("\r", " ").replace("\n", " ")
+
+
+class MultipartEncoder:
+    """Corpo multipart com tamanho conhecido, gerado sob demanda."""
+
+    def __init__(
+        self,
+        fields: Dict[str, Union[str, int, float]],
+        files: Dict[str, FileSpec],
+        chunk_size: int = CHUNK_SIZE,
+        progress_cb: Optional[Callable[[int, int], None]] = None,
+    ):
+        self.boundary = uuid.uuid4().hex
+        self.chunk_size = chunk_size
+        self.progress_cb = progress_cb
+        # Partes: bytes prontos (campos/cabeçalhos) ou caminho de arquivo
+        self._parts: List[Union[bytes, str]] = []
+        for name, value in fields.items():
+            if value is None:
+                continue
+            self._parts.append(
+                f'--{self.boundary}\r\nContent-Disposition: form-data; name="{_quote(name)}"\r\n\r\n'.encode("utf-8")
+                + str(value).encode("utf-8") + b"\r\n"
+            )
+        for name, (filename, path, content_type) in files.items():
+            self._parts.append(
+                (f'--{self.boundary}\r\nContent-Disposition: form-data; name="{_quote(name)}"; '
+                 f'filename="{_quote(filename)}"\r\nContent-Type: {content_type}\r\n\r\n').encode("utf-8")
+            )
+            self._parts.append(path)
+            self._parts.append(b"\r\n")
+        self._parts.append(f"--{self.boundary}--\r\n".encode("ascii"))
+        self._length = sum(len(p) if isinstance(p, bytes) else os.path.getsize(p) for p in self._parts)
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> Iterator[bytes]:
+        sent = 0
+        for part in self._parts:
+            if isinstance(part, bytes):
+                sent += len(part)
+                yield part
+                continue
+            with open(part, "rb") as f:
+                while True:
+                    chunk = f.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    sent += len(chunk)
+                    if self.progress_cb:
+                        self.progress_cb(sent, self._length)
+                    yield chunk
+        if self.progress_cb:
+            self.progress_cb(sent, self._length)
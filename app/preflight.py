@@ -0,0 +1,70 @@
+"""Verificação rápida de downloads: recusa o que claramente não é vídeo.
+
+Páginas HTML de erro, respostas de captcha/JSON e corpos vazios chegavam até
+o ffprobe/encode e só falhavam minutos depois, após upscale e fallback.
+Aqui a transferência é abortada logo no início:
+
+- ``check_headers``: ``Content-Type`` de texto/imagem/JSON ou
+  ``Content-Length: 0``
+- ``check_signature``: os primeiros bytes do corpo precisam ter a assinatura
+  de um container de vídeo (MP4/MOV ``ftyp``/``moov``..., Matroska/WebM,
+  AVI, FLV)
+
+Recusas levantam ``DownloadRejected`` com um motivo curto, gravado no banco
+como ``download_rejected:<motivo>``.
+"""
+from typing import Mapping, Optional
+
+# Bytes necessários para reconhecer qualquer assinatura abaixo
+SNIFF_BYTES = 12
+
+# Content-Types que nunca são vídeo (vídeo, octet-stream ou ausente passam)
+_REJECTED_TYPES = ("text/", "image/", "audio/", "application/json", "application/xml",
+                   "application/xhtml", "application/javascript")
+
+# Caixas que podem abrir um MP4/MOV (offset 4)
+_MP4_BOXES = {b"ftyp", b"moov", b"mdat", b"free", b"skip", b"wide", b"pnot"}
+
+
+class DownloadRejected(Exception):
+    """Resposta recusada antes do download completo (não é vídeo)."""
+
+    def __init__(self, reason: str, detail: str = ""):
+        super().__init__(f"{reason}: {detail}" if detail else reason)
+        self.reason = reason
+        self.detail = detail
+
+    @property
+    def error_message(self) -> str:
+        return f"download_rejected:{self.reason}"
+
+
+def check_headers(headers: Mapping[str, str]):
+    content_type = (headers.get("Content-Type") or "").split(";", 1)[0].strip().lower()
+    if content_type and content_type.startswith(_REJECTED_TYPES):
+        raise DownloadRejected("content_type", content_type)
+    length = headers.get("Content-Length")
+    if length is not None and length.strip() == "0":
+        raise DownloadRejected("empty_body", "Content-Length: 0")
+
+
+def video_signature(head: bytes) -> Optional[str]:
+    """Container reconhecido pelos primeiros bytes, ou None."""
+    if len(head) >= 8 and head[4:8] in _MP4_BOXES:
+        return "mp4"
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return "matroska"
+    if head.startswith(b"RIFF") and head[8:12] == b"AVI ":
+        return "avi"
+    if head.startswith(b"FLV\x01"):
+        return "flv"
+    return None
+
+
+def check_signature(head: bytes):
+    if not head:
+        raise DownloadRejected("empty_body")
+    if video_signature(head) is None:
+        # Trecho curto e legível para o log (ex.: "<!DOCTYPE html>")
+        sample = head[:SNIFF_BYTES].decode("latin-1").encode("unicode_escape").decode("ascii")
+        raise DownloadRejected("not_video", sample)
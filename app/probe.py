@@ -0,0 +1,253 @@
+"""Leitura de metadados de MP4/MOV em processo, sem ``ffprobe``.
+
+Percorre as caixas (boxes) do container e lê só os cabeçalhos do ``moov``:
+``mvhd``/``mdhd`` (duração), ``hdlr`` (tipo da trilha), ``stsd`` (codec e
+dimensões), ``stts`` (frames) e ``stsz`` (bytes da trilha, para o bitrate).
+Custa alguns microssegundos em vez de iniciar um processo.
+
+Cobre o caso comum do pipeline (MP4 com H.264/HEVC e AAC). Para qualquer
+outra coisa (outro container, codec desconhecido, MP4 fragmentado, arquivo
+truncado) ``probe_mp4`` retorna None e o chamador usa o ``ffprobe``.
+
+O resultado tem o mesmo formato de ``video_tools.analyze_video``.
+"""
+import os
+import struct
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Limite do moov lido para memória (moov de vídeos curtos tem poucos KB)
+_MAX_MOOV_BYTES = 64 * 1024 * 1024
+
+# O que o ffprobe reporta como format_name para a família MP4/MOV
+_FORMAT_NAME = "mov,mp4,m4a,3gp,3g2,mj2"
+
+_VIDEO_CODECS = {b"avc1": "h264", b"avc3": "h264", b"hvc1": "hevc", b"hev1": "hevc"}
+# objectTypeIndication do esds que o ffprobe reporta como "aac"
+_AAC_OBJECT_TYPES = {0x40, 0x66, 0x67, 0x68}
+
+_CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+
+
+class _Unsupported(Exception):
+    """Estrutura fora do caso comum: deixar para o ffprobe."""
+
+
+def _boxes(buf: bytes, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[bytes, int, int]]:
+    """(tipo, início do conteúdo, fim) das caixas em ``buf[start:end]``."""
+    end = len(buf) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", buf, pos)
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                raise _Unsupported("largesize truncado")
+            size = struct.unpack_from(">Q", buf, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            raise _Unsupported("caixa truncada")
+        yield kind, pos + header, pos + size
+        pos += size
+
+
+def _read_moov(path: str) -> Tuple[bytes, int]:
+    """Conteúdo da caixa ``moov`` e tamanho do arquivo; valida as caixas de topo."""
+    file_size = os.path.getsize(path)
+    moov = None
+    with open(path, "rb") as f:
+        pos = 0
+        first = True
+        while pos + 8 <= file_size:
+            f.seek(pos)
+            header = f.read(16)
+            size, kind = struct.unpack_from(">I4s", header, 0)
+            if first and kind not in (b"ftyp", b"wide", b"free", b"moov", b"mdat", b"skip"):
+                raise _Unsupported("não é MP4/MOV")
+            first = False
+            hlen = 8
+            if size == 1:
+                size = struct.unpack_from(">Q", header, 8)[0]
+                hlen = 16
+            elif size == 0:
+                size = file_size - pos
+            if size < hlen or pos + size > file_size:
+                # Caixa declarada além do fim: arquivo truncado
+                raise _Unsupported("arquivo truncado")
+            if kind == b"moof":
+                raise _Unsupported("MP4 fragmentado")
+            if kind == b"moov":
+                if size > _MAX_MOOV_BYTES:
+                    raise _Unsupported("moov grande demais")
+                f.seek(pos + hlen)
+                moov = f.read(size - hlen)
+            pos += size
+    if moov is None:
+        raise _Unsupported("sem moov")
+    return moov, file_size
+
+
+def _time_header(buf: bytes, start: int) -> Tuple[int, int]:
+    """(timescale, duration) de ``mvhd``/``mdhd``."""
+    version = buf[start]
+    if version == 1:
+        timescale, duration = struct.unpack_from(">IQ", buf, start + 4 + 16)
+    else:
+        timescale, duration = struct.unpack_from(">II", buf, start + 4 + 8)
+    return timescale, duration
+
+
+def _esds_object_type(buf: bytes, start: int, end: int) -> Optional[int]:
+    """objectTypeIndication do DecoderConfigDescriptor dentro do ``esds``."""
+    pos = start + 4  # version/flags
+
+    def _descriptor(pos: int) -> Tuple[int, int, int]:
+        tag = buf[pos]
+        pos += 1
+        length = 0
+        for _ in range(4):
+            b = buf[pos]
+            pos += 1
+            length = (length << 7) | (b & 0x7F)
+            if not b & 0x80:
+                break
+        return tag, pos, length
+
+    tag, pos, _ = _descriptor(pos)
+    if tag != 0x03:
+        return None
+    flags = buf[pos + 2]
+    pos += 3
+    if flags & 0x80:
+        pos += 2
+    if flags & 0x40:
+        pos += 1 + buf[pos]
+    if flags & 0x20:
+        pos += 2
+    if pos >= end:
+        return None
+    tag, pos, _ = _descriptor(pos)
+    if tag != 0x04 or pos >= end:
+        return None
+    return buf[pos]
+
+
+def _sample_entry(buf: bytes, start: int, end: int, handler: bytes) -> Dict[str, Any]:
+    """Codec e dimensões da primeira entrada do ``stsd``."""
+    entries = list(_boxes(buf, start + 8, end))
+    if not entries:
+        raise _Unsupported("stsd vazio")
+    kind, e_start, e_end = entries[0]
+    if handler == b"vide":
+        codec = _VIDEO_CODECS.get(kind)
+        if not codec:
+            raise _Unsupported(f"codec de vídeo {kind!r}")
+        width, height = struct.unpack_from(">HH", buf, e_start + 24)
+        return {"codec": codec, "width": width, "height": height}
+    if kind != b"mp4a":
+        raise _Unsupported(f"codec de áudio {kind!r}")
+    version = struct.unpack_from(">H", buf, e_start + 8)[0]
+    # Entrada de áudio: 28 bytes (v0), +16 (QuickTime v1), +36 (v2)
+    children = e_start + 28 + {0: 0, 1: 16, 2: 36}.get(version, 0)
+    for child, c_start, c_end in _boxes(buf, children, e_end):
+        if child == b"esds":
+            if _esds_object_type(buf, c_start, c_end) in _AAC_OBJECT_TYPES:
+                return {"codec": "aac"}
+            break
+    raise _Unsupported("mp4a sem AAC reconhecível")
+
+
+def _track(buf: bytes, start: int, end: int) -> Optional[Dict[str, Any]]:
+    found: Dict[bytes, Tuple[int, int]] = {}
+
+    def _walk(s: int, e: int):
+        for kind, c_start, c_end in _boxes(buf, s, e):
+            if kind in _CONTAINERS:
+                _walk(c_start, c_end)
+            elif kind in (b"mdhd", b"hdlr", b"stsd", b"stts", b"stsz", b"stz2"):
+                found.setdefault(kind, (c_start, c_end))
+
+    _walk(start, end)
+    if b"hdlr" not in found or b"mdhd" not in found:
+        return None
+    handler = buf[found[b"hdlr"][0] + 8:found[b"hdlr"][0] + 12]
+    if handler not in (b"vide", b"soun"):
+        return None
+    if b"stsd" not in found:
+        raise _Unsupported("trilha sem stsd")
+    track = _sample_entry(buf, *found[b"stsd"], handler)
+    track["handler"] = handler
+    timescale, duration = _time_header(buf, found[b"mdhd"][0])
+    track["duration"] = duration / timescale if timescale and duration else None
+
+    if handler == b"vide":
+        if b"stts" in found:
+            s = found[b"stts"][0]
+            count = struct.unpack_from(">I", buf, s + 4)[0]
+            frames = 0
+            total = 0
+            for i in range(count):
+                n, delta = struct.unpack_from(">II", buf, s + 8 + i * 8)
+                frames += n
+                total += n * delta
+            track["frames"] = frames
+            if frames and total and timescale:
+                track["fps"] = round(frames * timescale / total, 2)
+        if b"stz2" in found:
+            raise _Unsupported("stz2")
+        if b"stsz" in found:
+            s = found[b"stsz"][0]
+            sample_size, count = struct.unpack_from(">II", buf, s + 4)
+            if sample_size:
+                track["bytes"] = sample_size * count
+            else:
+                track["bytes"] = sum(struct.unpack_from(f">{count}I", buf, s + 12))
+    return track
+
+
+def probe_mp4(path: str) -> Optional[Dict[str, Any]]:
+    """Metadados no formato de ``analyze_video``, ou None para usar o ffprobe."""
+    try:
+        moov, file_size = _read_moov(path)
+        info: Dict[str, Any] = {
+            "width": None, "height": None, "duration": None,
+            "vcodec": None, "acodec": None, "format": _FORMAT_NAME,
+            "bitrate_kbps": None, "has_audio": False,
+            "fps": None,
+        }
+        tracks: List[Dict[str, Any]] = []
+        for kind, start, end in _boxes(moov):
+            if kind == b"mvhd":
+                timescale, duration = _time_header(moov, start)
+                if timescale and duration:
+                    info["duration"] = duration / timescale
+            elif kind == b"mvex":
+                raise _Unsupported("MP4 fragmentado")
+            elif kind == b"trak":
+                track = _track(moov, start, end)
+                if track:
+                    tracks.append(track)
+    except (_Unsupported, struct.error, IndexError, OSError):
+        return None
+
+    video = next((t for t in tracks if t["handler"] == b"vide"), None)
+    audio = next((t for t in tracks if t["handler"] == b"soun"), None)
+    if video is None or not video.get("width") or not video.get("height"):
+        return None
+    info["vcodec"] = video["codec"]
+    info["width"] = video["width"]
+    info["height"] = video["height"]
+    info["fps"] = video.get("fps")
+    if info["duration"] is None:
+        info["duration"] = video.get("duration")
+    # Mesma preferência do analyze_video: bitrate do vídeo, senão do container
+    v_duration = video.get("duration") or info["duration"]
+    if video.get("bytes") and v_duration:
+        info["bitrate_kbps"] = max(1, int(video["bytes"] * 8 / v_duration) // 1000)
+    elif info["duration"]:
+        info["bitrate_kbps"] = max(1, int(file_size * 8 / info["duration"]) // 1000)
+    if audio is not None:
+        info["acodec"] = audio["codec"]
+        info["has_audio"] = True
+    return info
@@ -0,0 +1,177 @@
+"""Retenção de arquivos em ``DOWNLOAD_DIR``/``PROCESSED_DIR``.
+
+- Cada arquivo gerado para um registro é rastreado na tabela ``artifacts``
+- Assim que o final existe, os intermediários do registro são apagados
+  (``*_ffmpeg.mp4``, ``*_v2x.mp4``, ``*_shopee_simple.mp4``...)
+- Originais e finais de registros já enviados são removidos após
+  ``RETENTION_SENT_MAX_AGE_DAYS`` ou, do mais antigo para o mais novo, quando
+  o total rastreado passa de ``RETENTION_DISK_QUOTA_GB``
+- Novos downloads são recusados se o espaço livre ficar abaixo de
+  ``RETENTION_MIN_FREE_GB`` (após tentar liberar espaço)
+
+O total em uso vem da tabela (sem varrer diretórios enormes).
+"""
+import os
+import shutil
+from typing import Iterable, Optional
+
+from . import artifact_store, metrics, scratch
+from .config import settings
+from .db import (
+    artifacts_total_bytes,
+    mark_artifact_deleted,
+    record_artifact,
+    select_artifacts,
+    select_evictable_artifacts,
+)
+from .fileutils import cleanup_stale_temp, thumbnail_path
+from .logs import get_logger
+
+log = get_logger(__name__, stage="retention")
+
+# Sufixos que o pipeline (atual e legado) gera em PROCESSED_DIR por vídeo
+_INTERMEDIATE_SUFFIXES = ("_ffmpeg.mp4", "_v2x.mp4", "_shopee.mp4", "_shopee_simple.mp4")
+
+_GB = 1024 ** 3
+
+
+def _remove(path: str) -> int:
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except FileNotFoundError:
+        return 0
+    except OSError as e:
+        log.warning("Não foi possível remover %s: %s", path, e)
+        return -1
+
+
+def track_download(record_id: int, path: Optional[str]):
+    if settings.RETENTION_ENABLED and path:
+        record_artifact(record_id, "original", path)
+
+
+def after_process(record_id: int, original_path: Optional[str], final_path: Optional[str], extra_finals: Iterable[str] = ()):
+    """Registra o final (e ``extra_finals``, ex.: renditions) e apaga os intermediários do registro."""
+    if not settings.RETENTION_ENABLED or not final_path or not os.path.exists(final_path):
+        return
+    final_abs = os.path.abspath(final_path)
+    keep = {final_abs}
+    if original_path:
+        keep.add(os.path.abspath(original_path))
+        record_artifact(record_id, "original", original_path)
+    if not original_path or final_abs != os.path.abspath(original_path):
+        record_artifact(record_id, "final", final_path)
+    # Miniatura e renditions seguem o ciclo de vida do final
+    for extra in [thumbnail_path(final_path)] + list(extra_finals):
+        if os.path.exists(extra):
+            keep.add(os.path.abspath(extra))
+            record_artifact(record_id, "final", extra)
+
+    candidates = set()
+    if original_path:
+        base = os.path.splitext(os.path.basename(original_path))[0]
+        dirs = [settings.PROCESSED_DIR]
+        if scratch.current_dir():
+            dirs.append(scratch.current_dir())
+        candidates.update(os.path.join(d, base + sfx) for d in dirs for sfx in _INTERMEDIATE_SUFFIXES)
+    # Intermediários rastreados e finais de tentativas anteriores com outro nome
+    stale = [row for row in select_artifacts(record_id, ("intermediate", "final"))
+             if os.path.abspath(row["path"]) not in keep]
+    candidates.update(row["path"] for row in stale)
+
+    freed = 0
+    for path in candidates:
+        if os.path.abspath(path) in keep:
+            continue
+        removed = _remove(path)
+        if removed > 0:
+            freed += removed
+    for row in stale:
+        mark_artifact_deleted(row["id"])
+    if freed:
+        metrics.inc("shopee_retention_freed_bytes_total", freed, labels={"reason": "intermediate"})
+        log.info("Intermediários removidos: %.1f MB", freed / (1024 * 1024), extra={"record_id": record_id})
+
+
+def evict_sent(max_age_days: Optional[float] = None, quota_bytes: Optional[int] = None) -> int:
+    """Remove originais/finais já enviados por idade e por cota. Retorna bytes liberados."""
+    if not settings.RETENTION_ENABLED:
+        return 0
+    if max_age_days is None:
+        max_age_days = settings.RETENTION_SENT_MAX_AGE_DAYS
+    if quota_bytes is None:
+        quota_bytes = int(settings.RETENTION_DISK_QUOTA_GB * _GB)
+
+    freed = 0
+
+    def _evict(row, reason: str) -> int:
+        removed = _remove(row["path"])
+        if removed < 0:
+            return 0
+        mark_artifact_deleted(row["id"])
+        metrics.inc("shopee_retention_freed_bytes_total", removed, labels={"reason": reason})
+        return row["size_bytes"] or removed
+
+    if max_age_days and max_age_days > 0:
+        for row in select_evictable_artifacts(max_age_days):
+            freed += _evict(row, "age")
+
+    if quota_bytes and quota_bytes > 0:
+        total = artifacts_total_bytes()
+        if total > quota_bytes:
+            for row in select_evictable_artifacts():
+                if total <= quota_bytes:
+                    break
+                released = _evict(row, "quota")
+                total -= released
+                freed += released
+            if total > quota_bytes:
+                log.warning("Cota de disco excedida (%.1f GB) sem arquivos enviados para remover", total / _GB)
+
+    if freed:
+        log.info("Retenção: %.1f MB liberados", freed / (1024 * 1024))
+    metrics.set_gauge("shopee_retention_tracked_bytes", artifacts_total_bytes())
+    return freed
+
+
+def run_maintenance():
+    """Limpa temporários órfãos e aplica a retenção e a evicção do cache."""
+    try:
+        # Temporários de execuções interrompidas (ver fileutils.AtomicOutput)
+        for directory in (settings.PROCESSED_DIR, os.path.join(settings.PROCESSED_DIR, "video2x_cache")):
+            cleanup_stale_temp(directory)
+        scratch.cleanup()
+        evict_sent()
+        artifact_store.evict()
+    except Exception as e:
+        log.warning("Falha na manutenção de retenção: %s", e)
+
+
+def _free_bytes(path: str) -> int:
+    os.makedirs(path, exist_ok=True)
+    return shutil.disk_usage(path).free
+
+
+def has_free_space(path: Optional[str] = None) -> bool:
+    """True se há espaço acima do mínimo para um novo download.
+
+    Abaixo do mínimo, tenta liberar espaço (retenção + cache) antes de recusar.
+    """
+    min_free = int(settings.RETENTION_MIN_FREE_GB * _GB)
+    if min_free <= 0:
+        return True
+    path = path or settings.DOWNLOAD_DIR
+    free = _free_bytes(path)
+    if free >= min_free:
+        return True
+    log.warning("Pouco espaço livre (%.2f GB), aplicando retenção...", free / _GB)
+    run_maintenance()
+    free = _free_bytes(path)
+    metrics.set_gauge("shopee_disk_free_bytes", free)
+    if free >= min_free:
+        return True
+    log.error("Espaço livre %.2f GB abaixo do mínimo de %.2f GB: download recusado",
+              free / _GB, settings.RETENTION_MIN_FREE_GB)
+    return False
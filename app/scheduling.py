@@ -0,0 +1,104 @@
+"""Ordem da fila de processamento: menor custo estimado primeiro, com envelhecimento.
+
+Em ordem de tabela, um vídeo de 60 s em 1080p que vai pelo Video2X segura
+dezenas de clipes de 10 s atrás dele. Com ``SCHEDULING=cost`` a fila é
+ordenada pelo custo estimado de cada registro:
+
+    custo = duração (s) x pixels (MP) x fator de upscale
+
+O fator é ``SCHED_VIDEO2X_COST_FACTOR`` quando ``plan_upscale`` escolhe o
+Video2X, senão 1. O custo é gravado na coluna ``priority`` antes do
+download: vídeos do Telegram com os metadados da mensagem e links com um
+ffprobe na URL antes de ordenar a fila (``SCHED_PROBE_TIMEOUT_SECONDS``).
+Depois do download o custo é refeito com o original. Registros que não
+puderam ser medidos usam a mediana dos custos conhecidos.
+
+Envelhecimento: a pontuação é ``custo / (1 + espera / SCHED_AGING_SECONDS)``,
+então um registro caro que espera há muito tempo acaba passando na frente
+dos novos e nunca fica parado para sempre.
+"""
+import calendar
+import json
+import statistics
+import time
+from typing import Any, Iterable, List, Optional, Sequence
+
+from .config import settings
+from .db import select_checkpoints, update_priority
+from .logs import get_logger
+from .video_tools import plan_upscale
+
+log = get_logger(__name__, stage="pipeline")
+
+# Piso do custo: sem isso um custo 0 nunca perderia para um registro envelhecido
+_MIN_COST = 0.001
+
+
+def estimate_cost(width: Optional[int], height: Optional[int], duration: Optional[float]) -> Optional[float]:
+    """Custo estimado (megapixel-segundos, ponderado pelo upscale); None sem metadados."""
+    if not width or not height or not duration:
+        return None
+    factor = settings.SCHED_VIDEO2X_COST_FACTOR if plan_upscale(width, height)["route"] == "video2x" else 1.0
+    return round(max(_MIN_COST, duration * width * height / 1e6 * factor), 3)
+
+
+def record_cost(record_id: int, width: Optional[int], height: Optional[int], duration: Optional[float]) -> Optional[float]:
+    """Calcula e grava o custo do registro (coluna ``priority``)."""
+    cost = estimate_cost(width, height, duration)
+    if cost is None:
+        return None
+    try:
+        update_priority(record_id, cost)
+    except Exception as e:
+        # Só afeta a ordem da fila; não derruba o pipeline
+        log.warning("Falha ao gravar custo estimado: %s", e, extra={"record_id": record_id})
+    return cost
+
+
+def cost_enabled() -> bool:
+    return (settings.SCHEDULING or "cost").strip().lower() == "cost"
+
+
+def _probed_cost(record_id: int) -> Optional[float]:
+    """Custo a partir do checkpoint ``probed`` (registros medidos antes da coluna ``priority``)."""
+    try:
+        row = next((r for r in select_checkpoints(record_id) if r["stage"] == "probed"), None)
+        meta = json.loads(row["meta"] or "{}") if row is not None else {}
+    except Exception:
+        return None
+    return record_cost(record_id, meta.get("width"), meta.get("height"), meta.get("duration"))
+
+
+def _age_seconds(created_at: Optional[str], now: float) -> float:
+    # CURRENT_TIMESTAMP do SQLite: "AAAA-MM-DD HH:MM:SS" em UTC
+    try:
+        return max(0.0, now - calendar.timegm(time.strptime(created_at, "%Y-%m-%d %H:%M:%S")))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def order(rows: Iterable[Sequence[Any]], now: Optional[float] = None) -> List[int]:
+    """Ids da fila na ordem de processamento.
+
+    ``rows`` vem de ``select_pending_or_failed``: ``(id, priority, created_at)``.
+    """
+    rows = list(rows)
+    if not cost_enabled():
+        return [r[0] for r in rows]
+    now = time.time() if now is None else now
+    costs = {}
+    for r in rows:
+        cost = r[1] if len(r) > 1 else None
+        costs[r[0]] = cost if cost is not None else _probed_cost(r[0])
+    known = [c for c in costs.values() if c is not None]
+    default = statistics.median(known) if known else 1.0
+    aging = max(1, settings.SCHED_AGING_SECONDS)
+
+    def _score(r) -> float:
+        cost = costs[r[0]] if costs[r[0]] is not None else default
+        age = _age_seconds(r[2] if len(r) > 2 else None, now)
+        return max(_MIN_COST, cost) / (1 + age / aging)
+
+    ranked = sorted(rows, key=lambda r: (_score(r), r[0]))
+    log.debug("Fila ordenada por custo: %d registros (%d com custo medido)", len(ranked), len(known))
+    return [r[0] for r in ranked]
@@ -0,0 +1,130 @@
+"""Diretório de rascunho em RAM (tmpfs) para arquivos intermediários.
+
+Arquivos escritos e logo relidos vão para ``SCRATCH_DIR`` (padrão:
+``/dev/shm`` quando existir): o temporário da saída do Video2X, os
+temporários do encode final e das renditions (o ``+faststart`` reescreve o
+arquivo inteiro e o probe de verificação o relê) e as amostras do auto-tune.
+Isso vale quando:
+
+- o tamanho estimado couber em ``SCRATCH_MAX_FILE_MB``
+- o tmpfs tiver espaço para ele
+- a RAM disponível continuar acima de ``SCRATCH_MIN_FREE_RAM_MB`` depois de
+  escrevê-lo (tmpfs consome memória)
+
+Caso contrário o chamador usa o diretório persistente de sempre. O caminho
+final é sempre no disco: ``AtomicOutput.commit`` copia o temporário validado
+para lá (ver ``fileutils.AtomicOutput``).
+"""
+import os
+import shutil
+import time
+from typing import Optional
+
+try:
+    import psutil
+except ImportError:
+    # Sem psutil a RAM disponível vem de /proc/meminfo (Linux)
+    psutil = None
+
+from .config import settings
+from .logs import get_logger
+
+log = get_logger(__name__, stage="scratch")
+
+_MB = 1024 * 1024
+_SUBDIR = "shopee_scratch"
+
+
+def _base_dir() -> Optional[str]:
+    if not settings.SCRATCH_ENABLED:
+        return None
+    configured = settings.SCRATCH_DIR.strip()
+    if configured:
+        return configured
+    return "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+def _available_ram() -> Optional[int]:
+    if psutil is not None:
+        try:
+            return int(psutil.virtual_memory().available)
+        except Exception:
+            return None
+    try:
+        with open("/proc/meminfo", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def current_dir() -> Optional[str]:
+    """Diretório de rascunho configurado (sem verificar espaço), ou None."""
+    base = _base_dir()
+    return os.path.join(base, _SUBDIR) if base else None
+
+
+def scratch_dir(expected_bytes: Optional[int]) -> Optional[str]:
+    """Diretório de rascunho para um arquivo de ``expected_bytes``, ou None."""
+    base = _base_dir()
+    if not base or not expected_bytes or expected_bytes <= 0:
+        return None
+    if expected_bytes > settings.SCRATCH_MAX_FILE_MB * _MB:
+        return None
+    path = current_dir()
+    try:
+        os.makedirs(path, exist_ok=True)
+        free = shutil.disk_usage(path).free
+    except OSError as e:
+        log.debug("Scratch indisponível (%s): %s", base, e)
+        return None
+    # Folga de 20%: a estimativa de tamanho é aproximada
+    if free < expected_bytes * 1.2:
+        return None
+    ram = _available_ram()
+    if ram is not None and ram - expected_bytes < settings.SCRATCH_MIN_FREE_RAM_MB * _MB:
+        log.debug("Pouca RAM livre (%.0f MB), intermediário vai para o disco", ram / _MB)
+        return None
+    return path
+
+
+def estimate_encoded_bytes(bitrate_kbps: Optional[float], duration: Optional[float]) -> Optional[int]:
+    """Tamanho esperado de um encode (kbps x duração, com folga para picos de bitrate)."""
+    if not bitrate_kbps or not duration:
+        return None
+    return int(bitrate_kbps * 1000 / 8 * duration * 1.5)
+
+
+def estimate_upscaled_bytes(input_path: str, src_height: Optional[int], target_height: int) -> Optional[int]:
+    """Estimativa grosseira: tamanho da fonte escalado pela razão de pixels."""
+    try:
+        size = os.path.getsize(input_path)
+    except OSError:
+        return None
+    if not src_height:
+        return size
+    ratio = max(1.0, target_height / src_height)
+    return int(size * ratio * ratio)
+
+
+def cleanup(max_age_seconds: int = 3600) -> int:
+    """Remove intermediários esquecidos no scratch. Retorna quantos."""
+    path = current_dir()
+    if not path:
+        return 0
+    removed = 0
+    cutoff = time.time() - max_age_seconds
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
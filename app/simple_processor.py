@@ -1,10 +1,15 @@
+import json
+import logging
 import os
-import shutil
 import time
+import uuid
 import requests
-from typing import Optional, Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Callable, Dict, Any, List, Tuple
 
 from .config import settings
+from . import checkpoints, fanout, link_resolver, metrics, preflight, retention, scheduling, telegram_api
+from .logs import get_logger
 from .db import (
     init_db,
     select_pending_or_failed,
@@ -12,135 +17,531 @@ from .db import (
     update_original_path,
     insert_or_update_processed,
     increment_retry,
+    update_renditions,
+    upsert_delivery,
 )
-from .video_tools import ensure_processed, ensure_shopee_ready, validate_min_height, ffprobe_media
+from .downloader import DownloadScheduler, configure_session, host_slot
+from .fileutils import link_or_copy, thumbnail_path
+from .multipart import MultipartEncoder
+from .video_tools import ensure_shopee_ready, validate_min_height, ffprobe_media, probe_url
 
 
-SESSION = requests.Session()
+SESSION = configure_session(requests.Session())
+
+log = get_logger(__name__, stage="pipeline")
 
 
 def _download_from_url(url: str, dest_dir: str) -> Optional[str]:
+    """Baixa ``url`` para ``dest_dir``. None em falha de rede/HTTP.
+
+    Levanta ``preflight.DownloadRejected`` quando a resposta não é vídeo
+    (Content-Type, corpo vazio ou assinatura), sem baixar o resto do corpo.
+    """
     try:
         os.makedirs(dest_dir, exist_ok=True)
         # Nome baseado em timestamp com fallback
-        local = os.path.join(dest_dir, str(int(time.time() * 1000)) + ".mp4")
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36",
-            "Accept": "*/*",
-            "Connection": "keep-alive",
-            "Referer": "https://shopee.com.br/",
-        }
-        with SESSION.get(url, stream=True, timeout=90, headers=headers) as r:
-            r.raise_for_status()
-            with open(local, "wb") as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
+        # (sufixo aleatório: downloads simultâneos podem cair no mesmo milissegundo)
+        local = os.path.join(dest_dir, f"{int(time.time() * 1000)}_{uuid.uuid4().hex[:6]}.mp4")
+        # Link de compartilhamento/encurtado -> URL do vídeo na CDN (com cache)
+        media_url = link_resolver.resolve(SESSION, url)
+        with metrics.timer("shopee_download_seconds", {"source": "url"}, help="Duração dos downloads") as t:
+            nbytes = 0
+            with host_slot(media_url), SESSION.get(media_url, stream=True, timeout=90,
+                                                   headers=link_resolver.BROWSER_HEADERS) as r:
+                if 400 <= r.status_code < 500:
+                    # URL da CDN expirada: a próxima tentativa resolve o link de novo
+                    link_resolver.forget(url)
+                r.raise_for_status()
+                # Recusa HTML/JSON/corpo vazio antes de gravar qualquer coisa
+                preflight.check_headers(r.headers)
+                chunks = r.iter_content(chunk_size=8192)
+                head = b""
+                for chunk in chunks:
+                    head += chunk
+                    if len(head) >= preflight.SNIFF_BYTES:
+                        break
+                preflight.check_signature(head)
+                with open(local, "wb") as f:
+                    f.write(head)
+                    nbytes += len(head)
+                    for chunk in chunks:
+                        if chunk:
+                            f.write(chunk)
+                            nbytes += len(chunk)
+            t.labels["status"] = "ok"
+        metrics.record_transfer("shopee_download", nbytes, t.elapsed, {"source": "url"})
+        log.debug("Download concluído: %s", os.path.basename(local),
+                  extra={"stage": "download", "duration_ms": int(t.elapsed * 1000), "bytes": nbytes})
         return local
+    except preflight.DownloadRejected as e:
+        log.warning("Download recusado (%s): %s", e.reason, e.detail, extra={"stage": "download"})
+        metrics.inc("shopee_download_rejected_total", labels={"reason": e.reason},
+                    help="Downloads recusados na verificação inicial (não é vídeo)")
+        raise
     except Exception as e:
-        print(f"[DL] erro: {e}")
+        log.error("Erro no download: %s", e, extra={"stage": "download"})
         return None
 
 
 def _download_from_telegram_file_id(file_id: str, dest_dir: str) -> Optional[str]:
-    # API getFile
+    # API getFile (com cache file_id -> file_path)
     try:
         os.makedirs(dest_dir, exist_ok=True)
         token = settings.TELEGRAM_BOT_TOKEN
         if not token:
-            print("[DL] token não configurado para download do Telegram.")
+            log.error("Token não configurado para download do Telegram.", extra={"stage": "download"})
             return None
-        url = f"https://api.telegram.org/bot{token}/getFile"
-        resp = SESSION.get(url, params={"file_id": file_id}, timeout=30)
-        data = resp.json()
-        if not data.get("ok"):
-            print("[DL] getFile falhou")
-            return None
-        file_path = data["result"]["file_path"]
-        # download do arquivo - NÃO logar a URL completa
-        file_url = f"https://api.telegram.org/file/bot{token}/{file_path}"
+        file_path = telegram_api.cached_file_path(token, file_id)
+        if file_path:
+            log.debug("getFile em cache", extra={"stage": "download"})
+        else:
+            url = telegram_api.api_url(token, "getFile")
+            with host_slot(url):
+                resp = SESSION.get(url, params={"file_id": file_id}, timeout=30)
+            data = resp.json()
+            if not data.get("ok"):
+                desc = data.get("description") or ""
+                if "too big" in desc.lower() and not telegram_api.is_custom_server():
+                    log.error("getFile falhou: arquivo acima de 20 MB (use TELEGRAM_API_BASE_URL com servidor local)",
+                              extra={"stage": "download"})
+                else:
+                    log.error("getFile falhou: %s", desc, extra={"stage": "download"})
+                return None
+            file_path = data["result"]["file_path"]
+            telegram_api.remember_file_path(token, file_id, file_path)
         local = os.path.join(dest_dir, os.path.basename(file_path))
-        with SESSION.get(file_url, stream=True, timeout=120) as r:
-            r.raise_for_status()
-            with open(local, "wb") as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
+
+        # Servidor Bot API local (--local): o arquivo já está no disco
+        src = telegram_api.local_file(file_path)
+        if src:
+            with metrics.timer("shopee_download_seconds", {"source": "telegram_local"}) as t:
+                how = link_or_copy(src, local)
+                t.labels["status"] = "ok"
+            nbytes = os.path.getsize(local)
+            metrics.record_transfer("shopee_download", nbytes, t.elapsed, {"source": "telegram_local"})
+            log.debug("Arquivo local do Bot API publicado (%s): %s", how, os.path.basename(local),
+                      extra={"stage": "download", "duration_ms": int(t.elapsed * 1000), "bytes": nbytes})
+            return local
+
+        # download do arquivo - NÃO logar a URL completa
+        file_url = telegram_api.file_url(token, file_path)
+        with metrics.timer("shopee_download_seconds", {"source": "telegram"}) as t:
+            nbytes = 0
+            with host_slot(file_url), SESSION.get(file_url, stream=True, timeout=120) as r:
+                if 400 <= r.status_code < 500:
+                    # Link expirado/inválido: próximo attempt refaz o getFile
+                    telegram_api.forget_file_path(token, file_id)
+                r.raise_for_status()
+                with open(local, "wb") as f:
+                    for chunk in r.iter_content(chunk_size=8192):
+                        if chunk:
+                            f.write(chunk)
+                            nbytes += len(chunk)
+            t.labels["status"] = "ok"
+        metrics.record_transfer("shopee_download", nbytes, t.elapsed, {"source": "telegram"})
+        log.debug("Download concluído: %s", os.path.basename(local),
+                  extra={"stage": "download", "duration_ms": int(t.elapsed * 1000), "bytes": nbytes})
         return local
     except Exception as e:
-        print(f"[DL] erro TG: {e}")
+        log.error("Erro no download do Telegram: %s", e, extra={"stage": "download"})
         return None
 
 
-def _send_to_telegram(video_path: str, caption: Optional[str] = None) -> tuple[bool, Optional[str]]:
+def _send_destination(target: Optional[str] = None) -> Tuple[str, str, str]:
+    """(target, token, chat_id) de envio; sem ``target``, o primeiro da seleção da GUI."""
+    if not target:
+        target = fanout.parse_destinations(fanout.selected_destinations())[0]
+    token, chat_id = fanout.destination(target)
+    return target, token, chat_id
+
+
+def _send_video(target: str, video_path: str, caption: Optional[str] = None, record_id: Optional[int] = None,
+                file_id: Optional[str] = None, upload_progress: Optional[Callable[[int, int], None]] = None,
+                video_meta: Optional[Dict[str, Any]] = None) -> Tuple[bool, Optional[str], Dict[str, Any]]:
+    """``sendVideo`` para um destino. Retorna ``(ok, erro, resposta JSON)``.
+
+    Com ``file_id`` o vídeo não é enviado de novo (o file_id precisa ser do
+    mesmo bot do destino). ``video_meta`` (width/height/duration já conhecidos
+    do encode) e a miniatura ao lado do arquivo vão junto no upload, para o
+    Telegram não precisar reanalisar o vídeo.
+    """
+    ctx = {"stage": "send", "record_id": record_id}
     try:
-        # Escolher token/chat de envio de acordo com a seleção (Gabriel or Marli)
-        # Uso getattr para evitar AttributeError caso variáveis específicas não existam
-        target = str(getattr(settings, "SELECTED_SEND_TARGET", "Gabriel"))
-        if target.strip().lower() == "marli":
-            token = getattr(settings, "TELEGRAM_SEND_TOKEN_MARLI", "") or getattr(settings, "TELEGRAM_SEND_TOKEN", "")
-            chat_id = getattr(settings, "TELEGRAM_CHAT_ID_MARLI", "") or getattr(settings, "TELEGRAM_CHAT_ID", "")
-        else:
-            # Gabriel por padrão. Usar token de envio específico do Gabriel primeiro,
-            # depois fallback para token genérico ou token do bot.
-            token = getattr(settings, "TELEGRAM_SEND_TOKEN_GABRIEL", "") or getattr(settings, "TELEGRAM_SEND_TOKEN", "") or getattr(settings, "TELEGRAM_BOT_TOKEN", "")
-            chat_id = getattr(settings, "TELEGRAM_CHAT_ID_GABRIEL", "") or getattr(settings, "TELEGRAM_CHAT_ID", "")
+        target, token, chat_id = _send_destination(target)
         
-        # Debug detalhado
-        print(f"[SEND] Iniciando envio...")
-        print(f"[SEND] Vídeo: {video_path}")
-        size_mb = os.path.getsize(video_path) / (1024*1024)
-        print(f"[SEND] Tamanho: {size_mb:.2f} MB")
-        print(f"[SEND] Token configurado: {'SIM' if token else 'NÃO'} (target={target})")
-        print(f"[SEND] Chat ID: {chat_id if chat_id else 'NÃO CONFIGURADO'}")
+        size_bytes = os.path.getsize(video_path)
+        size_mb = size_bytes / (1024*1024)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Iniciando envio de %s | token: %s (target=%s) | chat_id: %s",
+                      video_path, "SIM" if token else "NÃO", target, chat_id or "NÃO CONFIGURADO",
+                      extra=dict(ctx, bytes=size_bytes))
         
         if not token or not chat_id:
             err = "token/chat_id não configurados"
-            print(f"[SEND] ❌ ERRO: {err}.")
-            return False, err
-
-        # Limite comum do Bot API para upload direto é ~50MB; avisar cedo
-        if size_mb > 49.5:
-            err = f"arquivo muito grande ({size_mb:.2f} MB) > 50MB"
-            print(f"[SEND] ❌ ERRO: {err}")
-            return False, err
-        
-        url = f"https://api.telegram.org/bot{token}/sendVideo"
-        print(f"[SEND] URL: https://api.telegram.org/bot...{token[-10:]}/sendVideo")
-        
-        with open(video_path, "rb") as f:
-            files = {"video": (os.path.basename(video_path), f, "video/mp4")}
-            data = {"chat_id": chat_id, "caption": caption or ""}
-            
-            print(f"[SEND] Caption: {caption[:50] if caption else 'vazio'}...")
-            print(f"[SEND] Fazendo POST para Telegram API...")
-            
-            r = SESSION.post(url, data=data, files=files, timeout=180)
-            
-            print(f"[SEND] Status Code: {r.status_code}")
-            
-            if r.status_code == 200:
-                json_response = r.json()
-                if json_response.get("ok"):
-                    msg_id = json_response.get("result", {}).get("message_id")
-                    print(f"[SEND] ✅ Enviado com sucesso! Message ID: {msg_id}")
-                    return True, None
-                else:
-                    print(f"[SEND] ❌ Telegram retornou ok=false")
-                    print(f"[SEND] Response: {json_response}")
-                    # Capturar descrição de erro se existir
-                    err = json_response.get('description') or 'ok=false'
-                    return False, err
+            log.error("%s", err, extra=ctx)
+            return False, err, {}
+
+        # Limite do Bot API para upload direto (~50 MB na nuvem, 2000 MB em
+        # servidor próprio); avisar cedo
+        limit_mb = telegram_api.max_upload_mb()
+        if not file_id and size_mb > limit_mb:
+            err = f"arquivo muito grande ({size_mb:.2f} MB) > {limit_mb:.0f}MB"
+            log.error("%s", err, extra=ctx)
+            return False, err, {}
+
+        url = telegram_api.api_url(token, "sendVideo")
+        data = {"chat_id": chat_id, "caption": caption or ""}
+        # Modo local: o servidor lê o arquivo do disco, sem multipart
+        local_uri = None if file_id else telegram_api.local_input(video_path)
+        mode = "file_id" if file_id else ("local" if local_uri else "upload")
+
+        thumb = None
+        if not file_id:
+            data.update(_video_fields(video_meta))
+            thumb = thumbnail_path(video_path) if settings.SEND_THUMBNAIL else None
+            if thumb and not os.path.exists(thumb):
+                thumb = None
+
+        if file_id or local_uri:
+            data["video"] = file_id or local_uri
+            if thumb:
+                data["thumbnail"] = telegram_api.local_input(thumb)
+            body, headers = data, None
+        else:
+            # Corpo em streaming: o vídeo vai do disco para o socket em blocos
+            files = {"video": (os.path.basename(video_path), video_path, "video/mp4")}
+            if thumb:
+                files["thumbnail"] = (os.path.basename(thumb), thumb, "image/jpeg")
+            body = MultipartEncoder(data, files, progress_cb=upload_progress)
+            headers = {"Content-Type": body.content_type}
+
+        with metrics.timer("shopee_upload_seconds", {"target": target, "mode": mode}, help="Duração dos uploads para o Telegram") as t:
+            # Arquivos grandes (servidor próprio) precisam de mais tempo
+            r = SESSION.post(url, data=body, headers=headers, timeout=max(180, int(size_mb * 2)))
+            t.labels["status"] = "ok" if r.status_code == 200 else f"http_{r.status_code}"
+        if mode != "file_id":
+            metrics.record_transfer("shopee_upload", size_bytes, t.elapsed, {"target": target, "mode": mode})
+        ctx.update(duration_ms=int(t.elapsed * 1000), bytes=size_bytes)
+
+        try:
+            json_response = r.json()
+        except ValueError:
+            json_response = {}
+        if r.status_code == 200:
+            if json_response.get("ok"):
+                msg_id = json_response.get("result", {}).get("message_id")
+                log.info("Enviado com sucesso (target=%s, message_id=%s, modo=%s)", target, msg_id, mode, extra=ctx)
+                return True, None, json_response
             else:
-                print(f"[SEND] ❌ Erro HTTP {r.status_code}")
-                print(f"[SEND] Response: {r.text[:200]}")
-                err = f"HTTP {r.status_code}: {r.text[:180]}"
-                return False, err
+                # Capturar descrição de erro se existir
+                err = json_response.get('description') or 'ok=false'
+                log.error("Telegram retornou ok=false: %s", json_response, extra=ctx)
+                return False, err, json_response
+        else:
+            err = f"HTTP {r.status_code}: {r.text[:180]}"
+            log.error("Erro %s", err, extra=ctx)
+            return False, err, json_response
+    except Exception as e:
+        log.exception("Exceção no envio: %s: %s", type(e).__name__, e, extra=ctx)
+        return False, f"{type(e).__name__}: {e}", {}
+
+
+def _video_fields(video_meta: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Campos opcionais do sendVideo/InputMediaVideo a partir de metadados já conhecidos."""
+    fields: Dict[str, Any] = {"supports_streaming": "true"}
+    meta = video_meta or {}
+    for key in ("width", "height", "duration"):
+        if meta.get(key):
+            fields[key] = int(round(float(meta[key])))
+    return fields
+
+
+def _send_to_telegram(video_path: str, caption: Optional[str] = None, record_id: Optional[int] = None,
+                      upload_progress: Optional[Callable[[int, int], None]] = None,
+                      video_meta: Optional[Dict[str, Any]] = None) -> tuple[bool, Optional[str]]:
+    """Envio para o destino selecionado na GUI."""
+    ok, err, _ = _send_video(None, video_path, caption=caption, record_id=record_id, upload_progress=upload_progress,
+                             video_meta=video_meta)
+    return ok, err
+
+
+def _deliver(record_id: int, video_path: str, caption: str, targets: List[str],
+             upload_progress: Optional[Callable[[int, int], None]] = None,
+             video_meta: Optional[Dict[str, Any]] = None) -> Tuple[bool, Optional[str]]:
+    """Entrega a todos os destinos do registro (um upload por bot). ok = todos ok."""
+    def send_fn(target, path, caption, rid, file_id, progress):
+        return _send_video(target, path, caption, rid, file_id, progress, video_meta=video_meta)
+
+    results = fanout.fan_out(send_fn, record_id, video_path, caption, targets, upload_progress)
+    errors = [f"{t}: {e or 'send_failed'}" for t, (ok, e) in results.items() if not ok]
+    if errors:
+        return False, "; ".join(errors)
+    return True, None
+
+
+def _send_media_group(token: str, chat_id: str, target: str, items: List[Tuple[int, str, str]],
+                      video_meta: Optional[Dict[int, Dict[str, Any]]] = None) -> Tuple[bool, Optional[str], List[Dict[str, Any]]]:
+    """Envia 2..10 vídeos num único ``sendMediaGroup`` (álbum). Tudo ou nada.
+
+    ``video_meta`` (``{record_id: {width, height, duration}}``) vai em cada
+    InputMediaVideo, como no ``sendVideo``. Retorna ``(ok, erro, mensagens)``;
+    as mensagens seguem a ordem de ``items``.
+    """
+    ctx = {"stage": "send", "record_id": items[0][0]}
+    media = []
+    files: Dict[str, Tuple[str, str, str]] = {}
+    total_bytes = 0
+    for i, (rid, path, caption) in enumerate(items):
+        total_bytes += os.path.getsize(path)
+        uri = telegram_api.local_input(path)
+        if not uri:
+            # Parte do multipart referenciada por attach://
+            files[f"video{i}"] = (os.path.basename(path), path, "video/mp4")
+            uri = f"attach://video{i}"
+        item = {"type": "video", "media": uri, "caption": caption or ""}
+        item.update(_video_fields((video_meta or {}).get(rid)))
+        # No JSON do álbum o campo é booleano (no multipart do sendVideo é texto)
+        item["supports_streaming"] = True
+        thumb = thumbnail_path(path) if settings.SEND_THUMBNAIL else None
+        if thumb and os.path.exists(thumb):
+            thumb_uri = telegram_api.local_input(thumb)
+            if not thumb_uri:
+                files[f"thumb{i}"] = (os.path.basename(thumb), thumb, "image/jpeg")
+                thumb_uri = f"attach://thumb{i}"
+            item["thumbnail"] = thumb_uri
+        media.append(item)
+    data = {"chat_id": chat_id, "media": json.dumps(media, ensure_ascii=False)}
+    url = telegram_api.api_url(token, "sendMediaGroup")
+    for attempt in range(2):
+        if files:
+            body = MultipartEncoder(data, files)
+            headers = {"Content-Type": body.content_type}
+        else:
+            body, headers = data, None
+        with metrics.timer("shopee_upload_seconds", {"target": target, "mode": "group"}) as t:
+            r = SESSION.post(url, data=body, headers=headers, timeout=max(180, int(total_bytes / (1024 * 1024) * 2)))
+            t.labels["status"] = "ok" if r.status_code == 200 else f"http_{r.status_code}"
+        try:
+            payload = r.json()
+        except ValueError:
+            payload = {}
+        if r.status_code == 200 and payload.get("ok"):
+            metrics.record_transfer("shopee_upload", total_bytes, t.elapsed, {"target": target, "mode": "group"})
+            log.info("Álbum enviado (target=%s, %d vídeos)", target, len(items),
+                     extra=dict(ctx, duration_ms=int(t.elapsed * 1000), bytes=total_bytes))
+            return True, None, payload.get("result") or []
+        retry_after = (payload.get("parameters") or {}).get("retry_after")
+        if r.status_code == 429 and retry_after and attempt == 0:
+            # Flood control: esperar o indicado pelo Telegram e tentar de novo
+            log.warning("Flood control no álbum, aguardando %ss", retry_after, extra=ctx)
+            time.sleep(float(retry_after))
+            continue
+        err = payload.get("description") or f"HTTP {r.status_code}: {r.text[:180]}"
+        log.warning("sendMediaGroup falhou: %s", err, extra=ctx)
+        return False, err, []
+    return False, "sendMediaGroup: flood control", []
+
+
+def _send_batch(items: List[Tuple[int, str, str]],
+                progress_cb: Optional[Callable[[int, str, str], None]] = None,
+                target: Optional[str] = None,
+                video_meta: Optional[Dict[int, Dict[str, Any]]] = None) -> Dict[int, Tuple[bool, Optional[str]]]:
+    """Envia ``(record_id, caminho, caption)`` em álbuns de até ``TELEGRAM_MEDIA_GROUP_SIZE``.
+
+    Todos os itens vão para ``target`` (padrão: seleção da GUI). ``video_meta``
+    (``{record_id: {width, height, duration}}``) acompanha cada vídeo, no álbum
+    e no envio individual. Vídeos acima
+    do limite de upload, sobras de um só item e álbuns que falharem são
+    enviados individualmente (``_deliver``), então o
+    resultado é sempre por registro: ``{record_id: (ok, erro)}``. ``progress_cb``
+    recebe só o progresso de upload; o status final fica com o chamador.
+    """
+    results: Dict[int, Tuple[bool, Optional[str]]] = {}
+    target, token, chat_id = _send_destination(target)
+    group_size = max(2, min(10, settings.TELEGRAM_MEDIA_GROUP_SIZE))
+    limit_bytes = telegram_api.max_upload_mb() * 1024 * 1024
+    groupable, single = [], []
+    for item in items:
+        try:
+            fits = os.path.getsize(item[1]) <= limit_bytes
+        except OSError:
+            fits = False
+        (groupable if fits and token and chat_id else single).append(item)
+    for i in range(0, len(groupable), group_size):
+        chunk = groupable[i:i + group_size]
+        if len(chunk) < 2:
+            single.extend(chunk)
+            continue
+        try:
+            ok, err, messages = _send_media_group(token, chat_id, target, chunk, video_meta)
+        except Exception as e:
+            ok, err, messages = False, f"{type(e).__name__}: {e}", []
+        if ok:
+            for idx, (rid, _, _) in enumerate(chunk):
+                results[rid] = (True, None)
+                msg = messages[idx] if idx < len(messages) else {}
+                try:
+                    upsert_delivery(rid, target, str(chat_id), fanout.bot_id(token), "sent", msg.get("message_id"),
+                                    fanout.message_file_id({"result": msg}))
+                except Exception as e:
+                    log.warning("Falha ao registrar entrega: %s", e, extra={"stage": "send", "record_id": rid})
+        else:
+            log.warning("Álbum falhou (%s); enviando %d vídeos individualmente", err, len(chunk), extra={"stage": "send"})
+            single.extend(chunk)
+    for rid, path, caption in single:
+        results[rid] = _deliver(rid, path, caption, [target], upload_progress=_upload_progress_cb(rid, progress_cb),
+                                video_meta=(video_meta or {}).get(rid))
+    return results
+
+
+def _encode_progress_cb(record_id: int, progress_cb: Optional[Callable[[int, str, str], None]]) -> Optional[Callable[[Dict[str, Any]], None]]:
+    """Adapta o progresso do FFmpeg para o ``progress_cb`` do pipeline.
+
+    Emite ``(record_id, "process", "progress:<pct>")`` apenas quando o
+    percentual inteiro muda, para não inundar a GUI.
+    """
+    if not progress_cb:
+        return None
+    last = {"pct": -1}
+
+    def _cb(info: Dict[str, Any]):
+        pct = info.get("percent")
+        if pct is None:
+            return
+        pct = int(pct)
+        if pct != last["pct"]:
+            last["pct"] = pct
+            progress_cb(record_id, "process", f"progress:{pct}")
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Encode %s%% | fps=%s speed=%sx eta=%ss", pct, info.get("fps"), info.get("speed"),
+                      None if info.get("eta_s") is None else int(info["eta_s"]),
+                      extra={"stage": "process", "record_id": record_id})
+
+    return _cb
+
+
+def _upload_progress_cb(record_id: int, progress_cb: Optional[Callable[[int, str, str], None]]) -> Optional[Callable[[int, int], None]]:
+    """Adapta o progresso do upload (bytes enviados/total) para ``(record_id, "send", "progress:<pct>")``."""
+    if not progress_cb:
+        return None
+    last = {"pct": -1}
+
+    def _cb(sent: int, total: int):
+        pct = int(sent * 100 / total) if total else 100
+        if pct != last["pct"]:
+            last["pct"] = pct
+            progress_cb(record_id, "send", f"progress:{pct}")
+
+    return _cb
+
+
+def _download_record(record_id: int, rec=None, progress_cb: Optional[Callable[[int, str, str], None]] = None) -> Optional[str]:
+    """Baixa o original do registro e atualiza o banco. Retorna o caminho local.
+
+    Se o registro já tem original, apenas o retorna. Falhas ficam registradas
+    no banco (``download_failed``/``download_rejected:<motivo>``/
+    ``low_disk_space``) e retornam None. Usado
+    diretamente e pelo ``DownloadScheduler`` (prefetch).
+    """
+    rec = rec if rec is not None else get_original_record(record_id)
+    if not rec:
+        return None
+    keys = rec.keys()
+    original_path = rec["original_path"] if "original_path" in keys else None
+    if original_path and os.path.exists(original_path):
+        return original_path
+    original_path = None
+    source_type = rec["source_type"] if "source_type" in keys else None
+    source_url = rec["source_url"] if "source_url" in keys else None
+    telegram_file_id = rec["telegram_file_id"] if "telegram_file_id" in keys else None
+    link_produto = rec["link_produto"] if "link_produto" in keys else None
+    descricao = rec["descricao"] if "descricao" in keys else None
+
+    if not retention.has_free_space():
+        # Sem incrementar tentativas: o registro volta quando houver espaço
+        insert_or_update_processed(record_id, None, "failed", "low_disk_space", (None, None, None, None), link_produto, descricao)
+        if progress_cb:
+            progress_cb(record_id, "download", "fail")
+        return None
+    if progress_cb:
+        progress_cb(record_id, "download", "start")
+    error = "download_failed"
+    if source_type == "url" and source_url:
+        try:
+            original_path = _download_from_url(source_url, settings.DOWNLOAD_DIR)
+        except preflight.DownloadRejected as e:
+            error = e.error_message
+    elif source_type == "telegram" and telegram_file_id:
+        original_path = _download_from_telegram_file_id(telegram_file_id, settings.DOWNLOAD_DIR)
+    if original_path:
+        update_original_path(record_id, original_path)
+        retention.track_download(record_id, original_path)
+        w, h, d, s = ffprobe_media(original_path)
+        checkpoints.mark(record_id, "downloaded", original_path)
+        checkpoints.mark(record_id, "probed", meta={"width": w, "height": h, "duration": d})
+        scheduling.record_cost(record_id, w, h, d)
+        insert_or_update_processed(record_id, None, "pending", None, (w, h, d, s), link_produto, descricao)
+        log.info("Download ok: %s", original_path, extra={"stage": "download", "record_id": record_id})
+        if progress_cb:
+            progress_cb(record_id, "download", "ok")
+        return original_path
+    insert_or_update_processed(record_id, None, "failed", error, (None, None, None, None), link_produto, descricao)
+    increment_retry(record_id)
+    if progress_cb:
+        progress_cb(record_id, "download", "fail")
+    return None
+
+
+def _probe_cost(record_id: int) -> Optional[float]:
+    """Custo de um registro de URL medido direto na URL (sem baixar)."""
+    rec = get_original_record(record_id)
+    if not rec or rec["source_type"] != "url" or not rec["source_url"]:
+        return None
+    if rec["original_path"] and os.path.exists(rec["original_path"]):
+        # Já baixado: order() usa o checkpoint probed
+        return None
+    try:
+        media_url = link_resolver.resolve(SESSION, rec["source_url"])
+        with host_slot(media_url):
+            w, h, d = probe_url(media_url, link_resolver.BROWSER_HEADERS, settings.SCHED_PROBE_TIMEOUT_SECONDS)
     except Exception as e:
-        print(f"[SEND] ❌ Exceção: {type(e).__name__}: {e}")
-        import traceback
-        traceback.print_exc()
-        return False, f"{type(e).__name__}: {e}"
+        log.debug("Falha ao medir URL para a fila: %s", e, extra={"record_id": record_id})
+        return None
+    return scheduling.record_cost(record_id, w, h, d)
+
+
+def _estimate_costs(rows: List[Tuple[Any, ...]]) -> List[Tuple[Any, ...]]:
+    """Preenche o custo dos registros ainda sem ``priority`` antes de ordenar.
+
+    Sem isso uma fila nova (nada baixado) teria todos os custos na mediana e
+    sairia na ordem da tabela. Links são medidos em paralelo com
+    ``probe_url``; registros do Telegram já chegam com custo do ingest.
+    """
+    if not scheduling.cost_enabled() or settings.SCHED_PROBE_TIMEOUT_SECONDS <= 0:
+        return rows
+    missing = [r[0] for r in rows if r[1] is None]
+    if not missing:
+        return rows
+    with metrics.timer("shopee_sched_probe_seconds", help="Medição dos links antes de ordenar a fila"):
+        with ThreadPoolExecutor(max_workers=max(1, settings.DOWNLOAD_MAX_IN_FLIGHT),
+                                thread_name_prefix="probe") as pool:
+            costs = dict(zip(missing, pool.map(_probe_cost, missing)))
+    log.info("Custo medido antes do download: %d/%d registros",
+             sum(1 for c in costs.values() if c is not None), len(missing))
+    return [(r[0], costs.get(r[0]) if r[1] is None else r[1]) + tuple(r[2:]) for r in rows]
+
+
+def _needs_original(done: Dict[str, Dict[str, Any]]) -> bool:
+    """O original só precisa ser baixado se nenhum checkpoint válido o dispensa.
+
+    ``done`` vem de ``checkpoints.completed``: com ``sent`` não há nada a
+    refazer e com ``encoded`` (hash e perfil conferidos) só falta o envio.
+    """
+    if settings.ONLY_DOWNLOAD:
+        return True
+    if "sent" in done:
+        return False
+    return not (done.get("encoded") and not (settings.ONLY_SEND or settings.ONLY_VALIDATE))
 
 
 def _process_record(record_id: int, progress_cb: Optional[Callable[[int, str, str], None]] = None):
@@ -149,74 +550,80 @@ def _process_record(record_id: int, progress_cb: Optional[Callable[[int, str, st
         return
 
     original_path = rec["original_path"] if "original_path" in rec.keys() else None
-    source_type = rec["source_type"] if "source_type" in rec.keys() else None
-    source_url = rec["source_url"] if "source_url" in rec.keys() else None
-    telegram_file_id = rec["telegram_file_id"] if "telegram_file_id" in rec.keys() else None
     link_produto = rec["link_produto"] if "link_produto" in rec.keys() else None
     descricao = rec["descricao"] if "descricao" in rec.keys() else None
 
     # ONLY_* flags
     if settings.ONLY_DOWNLOAD:
         if not original_path:
-            path = None
-            if source_type == "url" and source_url:
-                path = _download_from_url(source_url, settings.DOWNLOAD_DIR)
-            elif source_type == "telegram" and telegram_file_id:
-                path = _download_from_telegram_file_id(telegram_file_id, settings.DOWNLOAD_DIR)
-            if path:
-                update_original_path(record_id, path)
-                w, h, d, s = ffprobe_media(path)
-                insert_or_update_processed(record_id, None, "pending", None, (w, h, d, s), link_produto, descricao)
-                print(f"[DL] ok: {path}")
-            else:
-                insert_or_update_processed(record_id, None, "failed", "download_failed", (None, None, None, None), link_produto, descricao)
-                increment_retry(record_id)
+            _download_record(record_id, rec)
         return
 
-    # Baixar se necessário
-    if not original_path:
-        print("[DL] iniciando download...")
+    # Retomar da primeira etapa incompleta (checkpoints verificados)
+    done = checkpoints.completed(record_id)
+    if "sent" in done:
+        sent = done["sent"]
+        log.info("Já enviado (checkpoint); nada a refazer", extra={"stage": "done", "record_id": record_id})
+        insert_or_update_processed(record_id, sent.get("path"), "processed", None,
+                                   (sent.get("width"), sent.get("height"), sent.get("duration"), sent.get("size_bytes")),
+                                   link_produto, descricao)
         if progress_cb:
-            progress_cb(record_id, "download", "start")
-        if source_type == "url" and source_url:
-            original_path = _download_from_url(source_url, settings.DOWNLOAD_DIR)
-        elif source_type == "telegram" and telegram_file_id:
-            original_path = _download_from_telegram_file_id(telegram_file_id, settings.DOWNLOAD_DIR)
-        if original_path:
-            update_original_path(record_id, original_path)
-            w, h, d, s = ffprobe_media(original_path)
-            insert_or_update_processed(record_id, None, "pending", None, (w, h, d, s), link_produto, descricao)
-            print(f"[DL] ok: {original_path}")
-            if progress_cb:
-                progress_cb(record_id, "download", "ok")
-        else:
-            insert_or_update_processed(record_id, None, "failed", "download_failed", (None, None, None, None), link_produto, descricao)
-            increment_retry(record_id)
-            if progress_cb:
-                progress_cb(record_id, "download", "fail")
-            return
-
-    if settings.ONLY_VALIDATE:
-        ok = validate_min_height(original_path, settings.VIDEO_TARGET_MIN_HEIGHT)
-        print(f"[VAL] {'ok' if ok else 'baixo'}")
+            for stage in ("download", "process", "send"):
+                progress_cb(record_id, stage, "ok")
         return
+    encoded = None if (settings.ONLY_SEND or settings.ONLY_VALIDATE) else done.get("encoded")
 
-    # Processamento
-    if not settings.ONLY_SEND:
-        if progress_cb:
-            progress_cb(record_id, "process", "start")
-        processed_path, report = ensure_shopee_ready(original_path)
-        changed = report.get("changed")
-        print(f"[PROC] Shopee-ready | alterado={changed}; arquivo={os.path.basename(processed_path)}")
+    if encoded:
+        processed_path = encoded["path"]
+        metrics.inc("shopee_checkpoints_total", labels={"stage": "encoded", "result": "resumed"},
+                    help="Checkpoints de etapa reaproveitados/invalidados")
+        log.info("Retomando do envio: encode reaproveitado (%s)", os.path.basename(processed_path),
+                 extra={"stage": "process", "record_id": record_id})
         if progress_cb:
+            progress_cb(record_id, "download", "ok")
             progress_cb(record_id, "process", "ok")
     else:
-        processed_path = original_path
-        # mantido comportamento de pular processamento
+        # Baixar se necessário (o original pode ter sido removido pela retenção)
+        if not original_path or not os.path.exists(original_path):
+            original_path = _download_record(record_id, rec, progress_cb)
+            if not original_path:
+                return
+            done = checkpoints.completed(record_id)
+        if "downloaded" not in done:
+            # Registros anteriores aos checkpoints
+            w, h, d, s = ffprobe_media(original_path)
+            checkpoints.mark(record_id, "downloaded", original_path)
+            checkpoints.mark(record_id, "probed", meta={"width": w, "height": h, "duration": d})
+
+        if settings.ONLY_VALIDATE:
+            ok = validate_min_height(original_path, settings.VIDEO_TARGET_MIN_HEIGHT)
+            log.info("Validação: %s", "ok" if ok else "baixo", extra={"stage": "validate", "record_id": record_id})
+            return
+
+        # Processamento
+        if not settings.ONLY_SEND:
+            if progress_cb:
+                progress_cb(record_id, "process", "start")
+            with metrics.timer("shopee_stage_seconds", {"stage": "process"}, help="Duração por etapa do pipeline") as t:
+                processed_path, report = ensure_shopee_ready(original_path, progress_cb=_encode_progress_cb(record_id, progress_cb))
+            changed = report.get("changed")
+            renditions = report.get("renditions") or {}
+            checkpoints.mark(record_id, "encoded", processed_path, meta={"changed": changed, "renditions": renditions})
+            if renditions:
+                update_renditions(record_id, renditions)
+            retention.after_process(record_id, original_path, processed_path, renditions.values())
+            log.info("Shopee-ready | alterado=%s; arquivo=%s", changed, os.path.basename(processed_path),
+                     extra={"stage": "process", "record_id": record_id, "duration_ms": int(t.elapsed * 1000)})
+            if progress_cb:
+                progress_cb(record_id, "process", "ok")
+        else:
+            processed_path = original_path
+            # mantido comportamento de pular processamento
 
     # Validação (apenas loga; envio não será bloqueado por altura)
     ok = validate_min_height(processed_path, settings.VIDEO_TARGET_MIN_HEIGHT)
-    print(f"[VAL] height >= {settings.VIDEO_TARGET_MIN_HEIGHT}? {'sim' if ok else 'não'}")
+    log.debug("height >= %s? %s", settings.VIDEO_TARGET_MIN_HEIGHT, "sim" if ok else "não",
+              extra={"stage": "validate", "record_id": record_id})
 
     # Enviar
     if progress_cb:
@@ -237,10 +644,9 @@ def _process_record(record_id: int, progress_cb: Optional[Callable[[int, str, st
         caption_parts.append(str(link_produto))
     
     caption = "\n\n".join(caption_parts) if caption_parts else ""
-    sent, send_err = _send_to_telegram(processed_path, caption=caption)
-    print(f"[SEND] {'ok' if sent else 'erro'}")
-    if not sent and send_err:
-        print(f"[SEND] Motivo da falha: {send_err}")
+    sent, send_err = _deliver(record_id, processed_path, caption, fanout.record_targets(rec),
+                              upload_progress=_upload_progress_cb(record_id, progress_cb),
+                              video_meta={"width": w, "height": h, "duration": d})
     if progress_cb:
         progress_cb(record_id, "send", "ok" if sent else "fail")
 
@@ -248,19 +654,44 @@ def _process_record(record_id: int, progress_cb: Optional[Callable[[int, str, st
     status = "processed" if sent else "failed"
     err = None if sent else (send_err or "send_failed")
     insert_or_update_processed(record_id, processed_path, status, err, (w, h, d, s), link_produto, descricao)
-    if not sent:
+    metrics.inc("shopee_records_total", labels={"status": status}, help="Registros finalizados por status")
+    if sent:
+        checkpoints.mark(record_id, "sent", processed_path, meta={"width": w, "height": h, "duration": d, "size_bytes": s})
+    else:
         increment_retry(record_id)
-    print(f"[DONE] {status} (retries atualizado se falha)")
+    log.info("Finalizado: %s", status, extra={"stage": "done", "record_id": record_id})
 
 
 def process_all_videos(progress_cb: Optional[Callable[[int, str, str], None]] = None):
     init_db()
+    metrics.start_metrics_server()
+    retention.run_maintenance()
     rows = select_pending_or_failed(settings.RETRY_FAILED_ONLY)
-    ids = [r[0] for r in rows]
-    for rid in ids:
-        try:
-            _process_record(rid, progress_cb=progress_cb)
-        except Exception as e:
-            print(f"[ERR] id={rid} exceção: {e}")
-            increment_retry(rid)
+    # Menor custo estimado primeiro (SCHEDULING=cost), com envelhecimento
+    ids = scheduling.order(_estimate_costs(rows))
+    # Checkpoint encoded/sent válido dispensa o original: esses registros não
+    # são baixados de novo nem entram no prefetch (mesmo que a retenção tenha
+    # apagado o original). O hash do encode é memoizado, então _process_record
+    # confere os checkpoints de novo sem reler o arquivo
+    to_fetch = [rid for rid in ids if _needs_original(checkpoints.completed(rid))]
+    fetch_pos = {rid: i for i, rid in enumerate(to_fetch)}
+    # Downloads correm à frente: enquanto um registro é transcodificado, os
+    # próximos já estão sendo baixados
+    scheduler = DownloadScheduler(lambda rid: _download_record(rid, progress_cb=progress_cb))
+    try:
+        for idx, rid in enumerate(ids):
+            metrics.set_gauge("shopee_queue_depth", len(ids) - idx, help="Registros aguardando processamento")
+            try:
+                if rid in fetch_pos:
+                    scheduler.schedule(rid, to_fetch[fetch_pos[rid] + 1:])
+                    if not scheduler.result(rid):
+                        # Falha já registrada no banco por _download_record
+                        continue
+                _process_record(rid, progress_cb=progress_cb)
+            except Exception as e:
+                log.exception("Exceção no processamento: %s", e, extra={"record_id": rid})
+                increment_retry(rid)
+    finally:
+        scheduler.shutdown()
+    metrics.set_gauge("shopee_queue_depth", 0)
 
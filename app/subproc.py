@@ -0,0 +1,141 @@
+"""Execução de processos externos (FFmpeg, ffprobe, Video2X) com memória limitada.
+
+stdout/stderr são lidos em bytes por threads e guardados em buffers circulares
+de tamanho fixo (``TailBuffer``): um Video2X verboso ou uma entrada patológica
+não faz o processo Python acumular megabytes por job. Só o final do buffer é
+decodificado para texto, e apenas quando o chamador pede.
+
+Códigos de retorno convencionados:
+- 0: sucesso
+- 124: timeout
+- 125: travado (sem progresso; ver ``video_tools._run_ffmpeg_progress``)
+- 127: executável não encontrado
+"""
+import os
+import subprocess
+import threading
+from typing import IO, Optional
+
+from .config import settings
+from .logs import get_logger
+
+log = get_logger(__name__, stage="subprocess")
+
+_READ_CHUNK = 64 * 1024
+
+
+class TailBuffer:
+    """Guarda apenas os últimos ``max_bytes`` bytes escritos."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max(1, int(max_bytes))
+        self.total = 0
+        self._buf = bytearray()
+        self._lock = threading.Lock()
+
+    def write(self, data: bytes):
+        if not data:
+            return
+        with self._lock:
+            self.total += len(data)
+            if len(data) >= self.max_bytes:
+                self._buf[:] = data[-self.max_bytes:]
+                return
+            self._buf += data
+            excess = len(self._buf) - self.max_bytes
+            if excess > 0:
+                del self._buf[:excess]
+
+    @property
+    def truncated(self) -> bool:
+        return self.total > len(self._buf)
+
+    def text(self) -> str:
+        """Decodifica o conteúdo retido (UTF-8, caracteres inválidos substituídos)."""
+        with self._lock:
+            data = bytes(self._buf)
+        return data.decode("utf-8", errors="replace")
+
+
+def popen(cmd: list[str], **kwargs) -> subprocess.Popen:
+    """Inicia um processo com stdout/stderr em PIPE (sem console extra no Windows)."""
+    # Em Windows, ao iniciar executáveis externos como ffmpeg, o subprocess
+    # pode abrir janelas de console separadas. Para evitar que múltiplos
+    # consoles apareçam ao usuário, usamos flags/STARTUPINFO para ocultar
+    # a janela quando executando em Windows.
+    if os.name == "nt":
+        # Utiliza CREATE_NO_WINDOW quando disponível e informa um
+        # STARTUPINFO que pede para não mostrar a janela.
+        startupinfo = subprocess.STARTUPINFO()
+        try:
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        except Exception:
+            # Alguns ambientes podem não expor todas as constantes; ignora se não existir
+            pass
+        kwargs.setdefault("startupinfo", startupinfo)
+        kwargs.setdefault("creationflags", getattr(subprocess, 'CREATE_NO_WINDOW', 0))
+    return subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL, **kwargs)
+
+
+def kill(proc: subprocess.Popen):
+    proc.kill()
+    try:
+        proc.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        proc.terminate()
+
+
+def drain(pipe: IO[bytes], buf: TailBuffer):
+    """Lê um pipe binário até EOF, retendo só o final em ``buf``."""
+    try:
+        while True:
+            chunk = pipe.read1(_READ_CHUNK) if hasattr(pipe, "read1") else pipe.read(_READ_CHUNK)
+            if not chunk:
+                break
+            buf.write(chunk)
+    except (OSError, ValueError):
+        # Pipe fechado ao matar o processo
+        pass
+
+
+def start_drain(pipe: IO[bytes], buf: TailBuffer) -> threading.Thread:
+    t = threading.Thread(target=drain, args=(pipe, buf), daemon=True)
+    t.start()
+    return t
+
+
+def run(
+    cmd: list[str],
+    timeout: Optional[int] = None,
+    stdout_limit: Optional[int] = None,
+    stderr_limit: Optional[int] = None,
+) -> tuple[int, str, str]:
+    """Executa um comando de forma resiliente com captura limitada.
+
+    ``stdout_limit``/``stderr_limit`` são os bytes retidos do final de cada
+    stream (padrões em ``SUBPROCESS_STDOUT_LIMIT_BYTES`` e
+    ``SUBPROCESS_STDERR_TAIL_BYTES``). Retorna ``(código, stdout, stderr)``.
+    """
+    out_buf = TailBuffer(stdout_limit or settings.SUBPROCESS_STDOUT_LIMIT_BYTES)
+    err_buf = TailBuffer(stderr_limit or settings.SUBPROCESS_STDERR_TAIL_BYTES)
+    try:
+        proc = popen(cmd)
+    except FileNotFoundError as e:
+        # Executável não encontrado
+        return (127, "", str(e))
+
+    readers = [start_drain(proc.stdout, out_buf), start_drain(proc.stderr, err_buf)]
+    try:
+        proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        timeout_str = f"{timeout}s" if timeout is not None else "N/A"
+        log.warning("Comando excedeu %s, forçando encerramento...", timeout_str)
+        kill(proc)
+        for t in readers:
+            t.join(timeout=5)
+        return (124, "", "timeout")
+    for t in readers:
+        t.join(timeout=5)
+    if out_buf.truncated:
+        log.debug("stdout truncado: %s bytes recebidos, %s retidos", out_buf.total, out_buf.max_bytes)
+    return (proc.returncode, out_buf.text(), err_buf.text())
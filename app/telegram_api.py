@@ -0,0 +1,94 @@
+"""Endereços do Bot API e cache de ``getFile``.
+
+- ``TELEGRAM_API_BASE_URL`` aponta para a nuvem (padrão) ou para um servidor
+  Bot API local (``telegram-bot-api --local``), que não tem os limites de
+  20 MB para download e 50 MB para upload
+- Com ``TELEGRAM_LOCAL_MODE`` o servidor local devolve em ``file_path`` o
+  caminho absoluto no disco: o arquivo é publicado por hardlink/cópia, sem
+  download HTTP
+- Envio: na nuvem o upload direto vai até ~50 MB; num servidor próprio até
+  2000 MB, e no modo local o ``sendVideo`` recebe ``file:///caminho`` em vez
+  do arquivo em multipart (o servidor lê direto do disco)
+- ``file_id -> file_path`` fica em cache por ``TELEGRAM_GETFILE_CACHE_TTL_SECONDS``
+  (a nuvem garante o link por pelo menos 1 hora), evitando um ``getFile`` a
+  cada tentativa
+"""
+import os
+import pathlib
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from .config import settings
+
+DEFAULT_API_BASE_URL = "https://api.telegram.org"
+
+# Limites de upload (MB): nuvem (ou servidor próprio sem --local) x servidor --local
+CLOUD_UPLOAD_LIMIT_MB = 49.5
+LOCAL_UPLOAD_LIMIT_MB = 2000.0
+
+_lock = threading.Lock()
+# (token, file_id) -> (file_path, expira_em)
+_file_paths: Dict[Tuple[str, str], Tuple[str, float]] = {}
+
+
+def base_url() -> str:
+    return (settings.TELEGRAM_API_BASE_URL or DEFAULT_API_BASE_URL).rstrip("/")
+
+
+def is_custom_server() -> bool:
+    return base_url() != DEFAULT_API_BASE_URL
+
+
+def api_url(token: str, method: str) -> str:
+    return f"{base_url()}/bot{token}/{method}"
+
+
+def file_url(token: str, file_path: str) -> str:
+    return f"{base_url()}/file/bot{token}/{file_path}"
+
+
+def cached_file_path(token: str, file_id: str) -> Optional[str]:
+    with _lock:
+        entry = _file_paths.get((token, file_id))
+        if not entry:
+            return None
+        path, expires = entry
+        if expires < time.monotonic():
+            _file_paths.pop((token, file_id), None)
+            return None
+        return path
+
+
+def remember_file_path(token: str, file_id: str, file_path: str):
+    ttl = settings.TELEGRAM_GETFILE_CACHE_TTL_SECONDS
+    if ttl <= 0:
+        return
+    with _lock:
+        _file_paths[(token, file_id)] = (file_path, time.monotonic() + ttl)
+
+
+def forget_file_path(token: str, file_id: str):
+    """Invalida o cache (ex.: o link expirou e o download deu 404)."""
+    with _lock:
+        _file_paths.pop((token, file_id), None)
+
+
+def local_file(file_path: str) -> Optional[str]:
+    """Caminho no disco quando o servidor local (``--local``) devolve um absoluto."""
+    if settings.TELEGRAM_LOCAL_MODE and os.path.isabs(file_path) and os.path.isfile(file_path):
+        return file_path
+    return None
+
+
+def max_upload_mb() -> float:
+    """Limite de envio: só o servidor Bot API rodando com ``--local`` passa dos 50 MB."""
+    local = settings.TELEGRAM_LOCAL_MODE and is_custom_server()
+    return LOCAL_UPLOAD_LIMIT_MB if local else CLOUD_UPLOAD_LIMIT_MB
+
+
+def local_input(path: str) -> Optional[str]:
+    """URI ``file://`` para enviar ``path`` sem upload (apenas no modo local)."""
+    if not settings.TELEGRAM_LOCAL_MODE:
+        return None
+    return pathlib.Path(path).resolve().as_uri()
@@ -0,0 +1,329 @@
+"""Supervisor de jobs do Video2X.
+
+- O job roda na thread de quem chama (o encode seguinte depende da saída, não
+  há o que sobrepor); o supervisor só deduplica e limita: requisições
+  simultâneas da mesma fonte aguardam o mesmo job e no máximo
+  ``VIDEO2X_WORKERS`` processos do Video2X rodam ao mesmo tempo, sem usar o
+  lock do FFmpeg
+- Cache por hash do conteúdo da fonte: o mesmo vídeo é ampliado no máximo uma
+  vez
+- Só entra no cache saída que passa no ``verify`` do chamador (probe vê
+  vídeo e duração); acertos de cache são verificados de novo e, se inválidos,
+  apagados e refeitos
+- Orçamento de tempo de CPU por job (``VIDEO2X_CPU_BUDGET_SECONDS``, via psutil)
+- Desistência cedo: após ``VIDEO2X_PROBE_SECONDS`` o fps medido projeta a
+  duração total; se não couber em ``TIMEOUT_VIDEO2X_SECONDS`` o job é
+  encerrado e o chamador segue com o scaler do FFmpeg
+
+Desistências por lentidão/orçamento também ficam em cache (``.fail.json``) por
+``VIDEO2X_FAILURE_TTL_SECONDS``, para que uma nova tentativa do mesmo vídeo não
+repita o trabalho perdido; depois disso (outra máquina, menos carga) o Video2X
+é tentado de novo. ``timeout`` não entra: é sinal de carga do momento, não da
+fonte. Apague o arquivo para forçar outra tentativa antes.
+"""
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+
+try:
+    import psutil
+except ImportError:
+    # Sem psutil o orçamento de CPU fica desativado (timeout/fps continuam valendo)
+    psutil = None
+
+from . import metrics, scratch
+from .config import settings
+from .fileutils import AtomicOutput, atomic_output, file_sha256
+from .logs import get_logger
+from .subproc import TailBuffer, kill as _kill, popen as _popen
+
+log = get_logger(__name__, stage="video2x")
+
+_FPS_RE = re.compile(r"(?i)\bfps[\s=:]+([\d.]+)")
+_FRAME_RE = re.compile(r"(?i)\bframes?[\s=:]+(\d+)(?:\s*/\s*(\d+))?")
+
+# Desistências que valem para novas tentativas com a mesma fonte (até o TTL)
+_CACHEABLE_FAILURES = ("too_slow", "cpu_budget")
+_FAIL_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+_lock = threading.Lock()
+_slots: Optional[threading.BoundedSemaphore] = None
+# Jobs em andamento por fonte/altura: quem chega depois espera o mesmo resultado
+_inflight: Dict[str, Future] = {}
+
+
+def find_video2x() -> Optional[str]:
+    """Localiza o executável do Video2X (pasta configurada ou PATH)."""
+    candidates = [
+        os.path.join(settings.VIDEO2X_DIR, "bin", "video2x.exe"),
+        os.path.join(settings.VIDEO2X_DIR, "bin", "video2x-cli.exe"),
+        "video2x",
+        "video2x-cli",
+    ]
+    return next((p for p in candidates if shutil.which(p) or os.path.exists(p)), None)
+
+
+def build_command(exe: str, input_path: str, output_path: str, target_height: int) -> list[str]:
+    # Parâmetros variam por build do Video2X; tentativa genérica:
+    return [exe, "--input", input_path, "--output", output_path, "--scale-width", "0", "--scale-height", str(target_height)]
+
+
+def _get_slots() -> threading.BoundedSemaphore:
+    global _slots
+    with _lock:
+        if _slots is None:
+            _slots = threading.BoundedSemaphore(max(1, settings.VIDEO2X_WORKERS))
+        return _slots
+
+
+def _cache_paths(source_sha: str, target_height: int) -> Tuple[str, str]:
+    cache_dir = os.path.join(settings.PROCESSED_DIR, "video2x_cache")
+    base = os.path.join(cache_dir, f"{source_sha}_{target_height}p")
+    return base + ".mp4", base + ".fail.json"
+
+
+def _parse_line(line: str, state: Dict[str, Any]):
+    m = _FPS_RE.search(line)
+    if m:
+        try:
+            state["fps"] = float(m.group(1))
+        except ValueError:
+            pass
+    m = _FRAME_RE.search(line)
+    if m:
+        state["frame"] = int(m.group(1))
+        if m.group(2):
+            state["total"] = int(m.group(2))
+
+
+def _watch(pipe, buf: TailBuffer, state: Dict[str, Any]):
+    """Drena o pipe guardando só o final e extraindo frame/fps das linhas."""
+    pending = b""
+    try:
+        while True:
+            chunk = pipe.read1(64 * 1024) if hasattr(pipe, "read1") else pipe.read(64 * 1024)
+            if not chunk:
+                break
+            buf.write(chunk)
+            # Barras de progresso costumam usar \r em vez de \n
+            parts = re.split(rb"[\r\n]", pending + chunk)
+            pending = parts.pop()[-4096:]
+            for part in parts:
+                if part:
+                    _parse_line(part.decode("utf-8", errors="replace"), state)
+    except (OSError, ValueError):
+        pass
+
+
+def _cpu_seconds(proc) -> Optional[float]:
+    """Tempo de CPU (user+system) do processo e filhos; None sem psutil."""
+    if proc is None:
+        return None
+    try:
+        total = sum(proc.cpu_times()[:2])
+        for child in proc.children(recursive=True):
+            try:
+                total += sum(child.cpu_times()[:2])
+            except psutil.Error:
+                pass
+        return total
+    except psutil.Error:
+        return None
+
+
+# verify(caminho) -> bool: a saída só entra no cache se o probe a enxergar inteira
+Verify = Optional[Callable[[str], bool]]
+
+
+def _run_job(exe: str, input_path: str, out_path: str, target_height: int, expected_frames: Optional[int],
+             verify: Verify, src_height: Optional[int] = None) -> Tuple[str, Dict[str, Any]]:
+    # Temporário no scratch (tmpfs) se couber: a verificação relê o arquivo
+    # logo em seguida; o commit copia para o cache no disco
+    expected = scratch.estimate_upscaled_bytes(input_path, src_height, target_height)
+    with atomic_output(out_path, scratch.scratch_dir(expected)) as dest:
+        return _supervise(exe, input_path, dest, target_height, expected_frames, verify)
+
+
+def _supervise(exe: str, input_path: str, dest: AtomicOutput, target_height: int, expected_frames: Optional[int],
+               verify: Verify = None) -> Tuple[str, Dict[str, Any]]:
+    tmp_path = dest.tmp_path
+    state: Dict[str, Any] = {"fps": None, "frame": None, "total": None}
+    buf = TailBuffer(settings.SUBPROCESS_STDERR_TAIL_BYTES)
+    try:
+        proc = _popen(build_command(exe, input_path, tmp_path, target_height))
+    except FileNotFoundError as e:
+        return "unavailable", {"error": str(e)}
+
+    readers = [threading.Thread(target=_watch, args=(p, buf, state), daemon=True) for p in (proc.stdout, proc.stderr)]
+    for t in readers:
+        t.start()
+    ps_proc = None
+    if psutil is not None:
+        try:
+            ps_proc = psutil.Process(proc.pid)
+        except psutil.Error:
+            pass
+
+    timeout = settings.TIMEOUT_VIDEO2X_SECONDS
+    budget = settings.VIDEO2X_CPU_BUDGET_SECONDS
+    start = time.monotonic()
+    probed = False
+    status = None
+    info: Dict[str, Any] = {}
+    while proc.poll() is None:
+        try:
+            proc.wait(timeout=1)
+            break
+        except subprocess.TimeoutExpired:
+            pass
+        elapsed = time.monotonic() - start
+        cpu = _cpu_seconds(ps_proc)
+        if cpu is not None:
+            info["cpu_s"] = round(cpu, 1)
+        if budget and cpu is not None and cpu > budget:
+            log.warning("Orçamento de CPU excedido (%.0fs > %ss), encerrando Video2X", cpu, budget)
+            status = "cpu_budget"
+            break
+        if timeout and elapsed > timeout:
+            log.warning("Video2X excedeu %ss, encerrando", timeout)
+            status = "timeout"
+            break
+        if not probed and elapsed >= settings.VIDEO2X_PROBE_SECONDS:
+            probed = True
+            frame = state["frame"] or 0
+            fps = state["fps"] or (frame / elapsed if frame else None)
+            total = state["total"] or expected_frames
+            info["fps"] = round(fps, 2) if fps else None
+            if fps and total:
+                projected = elapsed + max(0, total - frame) / fps
+                info["projected_s"] = round(projected, 1)
+                if timeout and projected > timeout:
+                    log.warning("Video2X a %.2f fps levaria ~%.0fs (limite %ss), usando FFmpeg",
+                                fps, projected, timeout)
+                    status = "too_slow"
+                    break
+                log.info("Video2X a %.2f fps, previsão ~%.0fs", fps, projected)
+
+    info["elapsed_s"] = round(time.monotonic() - start, 1)
+    if status is not None:
+        _kill(proc)
+    for t in readers:
+        t.join(timeout=5)
+    if status is None:
+        if proc.returncode == 0:
+            if dest.commit(verify=verify):
+                return "ok", info
+            # Saiu com 0 mas a saída está truncada/corrompida: não vai para o cache
+            log.warning("Saída do Video2X inválida, descartada")
+            status = "invalid_output"
+        else:
+            status = "error"
+            info["error"] = buf.text()[-500:]
+    return status, info
+
+
+def _job(exe: str, input_path: str, out_path: str, fail_path: str, target_height: int, expected_frames: Optional[int],
+         verify: Verify, src_height: Optional[int]) -> Tuple[str, Dict[str, Any]]:
+    with metrics.timer("shopee_video2x_seconds", help="Duração dos jobs do Video2X") as t:
+        status, info = _run_job(exe, input_path, out_path, target_height, expected_frames, verify, src_height)
+        t.labels["status"] = status
+    if status in _CACHEABLE_FAILURES and settings.VIDEO2X_FAILURE_TTL_SECONDS > 0:
+        try:
+            with open(fail_path, "w", encoding="utf-8") as f:
+                json.dump({"status": status, "at": time.strftime(_FAIL_TIME_FORMAT), **info}, f)
+        except OSError:
+            pass
+    return status, info
+
+
+def _cached_failure(fail_path: str) -> Optional[Dict[str, Any]]:
+    """Desistência anterior ainda dentro do TTL; vencida (ou ilegível) é apagada."""
+    if not os.path.exists(fail_path):
+        return None
+    try:
+        with open(fail_path, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        at = time.mktime(time.strptime(previous["at"], _FAIL_TIME_FORMAT))
+    except Exception:
+        previous, at = None, 0.0
+    fresh = previous is not None and time.time() - at < settings.VIDEO2X_FAILURE_TTL_SECONDS
+    if fresh and previous.get("status") in _CACHEABLE_FAILURES:
+        return previous
+    try:
+        os.remove(fail_path)
+    except OSError:
+        pass
+    return None
+
+
+def upscale(
+    input_path: str,
+    target_height: Optional[int] = None,
+    duration: Optional[float] = None,
+    fps: Optional[float] = None,
+    verify: Verify = None,
+    src_height: Optional[int] = None,
+) -> Tuple[Optional[str], Dict[str, Any]]:
+    """Amplia ``input_path`` com o Video2X na thread atual (bloqueia até o job terminar).
+
+    Retorna ``(caminho ou None, relatório)``; ``relatório["status"]`` é
+    ``cache``, ``ok``, ``cached_failure``, ``too_slow``, ``cpu_budget``,
+    ``timeout``, ``invalid_output``, ``error`` ou ``unavailable``. Com
+    ``None`` o chamador deve seguir com o scaler do FFmpeg.
+
+    ``verify`` valida a saída antes de ela entrar no cache e também a cada
+    acerto de cache (um arquivo inválido no cache é apagado e refeito).
+    """
+    target = target_height or settings.VIDEO_TARGET_MIN_HEIGHT
+    exe = find_video2x()
+    if not exe:
+        return None, {"status": "unavailable"}
+
+    source_sha = file_sha256(input_path)
+    out_path, fail_path = _cache_paths(source_sha, target)
+    if os.path.exists(out_path):
+        if os.path.getsize(out_path) > 0 and (verify is None or verify(out_path)):
+            metrics.inc("shopee_video2x_cache_total", labels={"result": "hit"})
+            log.info("Upscale em cache: %s", os.path.basename(out_path))
+            return out_path, {"status": "cache", "path": out_path}
+        log.warning("Upscale em cache inválido, removendo: %s", os.path.basename(out_path))
+        metrics.inc("shopee_video2x_cache_total", labels={"result": "invalid"})
+        try:
+            os.remove(out_path)
+        except OSError:
+            pass
+    previous = _cached_failure(fail_path)
+    if previous is not None:
+        metrics.inc("shopee_video2x_cache_total", labels={"result": "failure_hit"})
+        return None, {"status": "cached_failure", "previous": previous}
+    metrics.inc("shopee_video2x_cache_total", labels={"result": "miss"})
+
+    expected_frames = int(duration * fps) if duration and fps else None
+    key = f"{source_sha}_{target}"
+    with _lock:
+        fut = _inflight.get(key)
+        owner = fut is None
+        if owner:
+            fut = Future()
+            _inflight[key] = fut
+    if owner:
+        try:
+            with _get_slots():
+                fut.set_result(_job(exe, input_path, out_path, fail_path, target, expected_frames, verify, src_height))
+        except Exception as e:
+            fut.set_exception(e)
+        finally:
+            with _lock:
+                _inflight.pop(key, None)
+    else:
+        log.info("Upscale desta fonte já em andamento, aguardando o mesmo job")
+
+    status, info = fut.result()
+    info = dict(info, status=status)
+    return (out_path if status == "ok" else None), info
@@ -1,13 +1,24 @@
+import contextlib
 import os
 import json
+import logging
 import math
+import queue
 import shutil
-import subprocess
-import tempfile
 import threading
-from typing import Optional, Tuple, Dict, Any
+import time
+from typing import Optional, Tuple, Dict, Any, Callable, List
 
 from .config import settings
+from . import metrics
+from .logs import get_logger
+from .encoder_tuning import choose_encoder_params
+from . import artifact_store, probe, scratch, video2x_supervisor
+from .fileutils import atomic_output, file_sha256, rendition_path, thumbnail_path
+from .video2x_supervisor import find_video2x
+from .subproc import TailBuffer, kill as _kill, popen as _popen, run as _run, start_drain
+
+log = get_logger(__name__, stage="ffmpeg")
 
 # Lock para garantir que apenas 1 processamento FFmpeg rode por vez
 _FFMPEG_LOCK = threading.Lock()
@@ -33,11 +44,11 @@ def _find_ffmpeg_ffprobe() -> Tuple[str, str]:
     
     for ffmpeg_path, ffprobe_path in possible_paths:
         if ffmpeg_path and ffprobe_path and os.path.exists(ffmpeg_path) and os.path.exists(ffprobe_path):
-            print(f"[FFMPEG] Encontrado: {ffmpeg_path}")
+            log.debug("Encontrado: %s", ffmpeg_path)
             return (ffmpeg_path, ffprobe_path)
     
     # Fallback para comandos simples (assume que está no PATH)
-    print("[FFMPEG] ⚠️ Usando fallback 'ffmpeg'/'ffprobe' (pode não funcionar se não estiver no PATH)")
+    log.warning("Usando fallback 'ffmpeg'/'ffprobe' (pode não funcionar se não estiver no PATH)")
     return ("ffmpeg", "ffprobe")
 
 
@@ -45,55 +56,145 @@ def _find_ffmpeg_ffprobe() -> Tuple[str, str]:
 _FFMPEG_EXE, _FFPROBE_EXE = _find_ffmpeg_ffprobe()
 
 
-def _run(cmd: list[str], timeout: Optional[int] = None) -> tuple[int, str, str]:
-    """Executa um comando de forma resiliente.
+def _parse_progress_value(key: str, value: str) -> Optional[float]:
+    value = value.strip()
+    if not value or value == "N/A":
+        return None
+    try:
+        if key == "speed":
+            return float(value.rstrip("x"))
+        if key in ("out_time_us", "out_time_ms"):
+            # Apesar do nome, out_time_ms também vem em microssegundos
+            return int(value) / 1_000_000
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _run_ffmpeg_progress(
+    cmd: list[str],
+    expected_duration: Optional[float] = None,
+    progress_cb: Optional[Callable[[Dict[str, Any]], None]] = None,
+    timeout: Optional[int] = None,
+    stall_timeout: Optional[int] = None,
+) -> tuple[int, str, str]:
+    """Executa FFmpeg acompanhando ``-progress pipe:1`` em tempo real.
 
-    Retornos convencionados:
-    - 0: sucesso
-    - 124: timeout
-    - 127: executável não encontrado
+    - Cada bloco de progresso vira um dict ``{frame, fps, speed, out_time_s,
+      percent, eta_s}`` entregue a ``progress_cb``
+    - Sem frames novos por ``stall_timeout`` segundos: processo é encerrado (125)
+    - Se a ETA medida indicar que o encode não termina dentro de ``timeout``,
+      encerra cedo (124) em vez de esperar o timeout inteiro
+
+    Mesmos códigos de retorno de ``_run``.
     """
+    stall_timeout = settings.FFMPEG_STALL_TIMEOUT_SECONDS if stall_timeout is None else stall_timeout
+    full_cmd = [cmd[0], "-progress", "pipe:1", "-nostats"] + list(cmd[1:])
     try:
-        # Em Windows, ao iniciar executáveis externos como ffmpeg, o subprocess
-        # pode abrir janelas de console separadas. Para evitar que múltiplos
-        # consoles apareçam ao usuário, usamos flags/STARTUPINFO para ocultar
-        # a janela quando executando em Windows.
-        if os.name == "nt":
-            # Utiliza CREATE_NO_WINDOW quando disponível e informa um
-            # STARTUPINFO que pede para não mostrar a janela.
-            startupinfo = subprocess.STARTUPINFO()
-            try:
-                startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            except Exception:
-                # Alguns ambientes podem não expor todas as constantes; ignora se não existir
-                pass
-            proc = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                stdin=subprocess.DEVNULL,
-                text=True,
-                startupinfo=startupinfo,
-                creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0),
-            )
-        else:
-            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL, text=True)
-        try:
-            out, err = proc.communicate(timeout=timeout)
-        except subprocess.TimeoutExpired:
-            timeout_str = f"{timeout}s" if timeout is not None else "N/A"
-            print(f"[TIMEOUT] ⏱️ Comando excedeu {timeout_str}, forçando encerramento...")
-            proc.kill()
-            try:
-                proc.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                proc.terminate()
-            return (124, "", "timeout")
-        return (proc.returncode, out or "", err or "")
+        proc = _popen(full_cmd)
     except FileNotFoundError as e:
-        # Executável não encontrado
         return (127, "", str(e))
 
+    lines: "queue.Queue[Optional[str]]" = queue.Queue()
+    err_buf = TailBuffer(settings.SUBPROCESS_STDERR_TAIL_BYTES)
+
+    def _read_stdout():
+        # Linhas de progresso são curtas; o limite evita acumular uma linha gigante
+        try:
+            while True:
+                raw = proc.stdout.readline(4096)
+                if not raw:
+                    break
+                lines.put(raw.decode("ascii", errors="replace"))
+        except (OSError, ValueError):
+            pass
+        lines.put(None)
+
+    threading.Thread(target=_read_stdout, daemon=True).start()
+    t_err = start_drain(proc.stderr, err_buf)
+
+    start = time.monotonic()
+    last_advance = start
+    last_frame = -1.0
+    block: Dict[str, float] = {}
+    result: Optional[tuple[int, str, str]] = None
+
+    while True:
+        try:
+            line = lines.get(timeout=0.5)
+        except queue.Empty:
+            line = ""
+        if line is None:
+            break
+        now = time.monotonic()
+        if line and "=" in line:
+            key, value = line.strip().split("=", 1)
+            if key == "progress":
+                frame = block.get("frame", 0.0)
+                if frame > last_frame:
+                    last_frame = frame
+                    last_advance = now
+                out_time = block.get("out_time_us", block.get("out_time_ms"))
+                speed = block.get("speed")
+                info: Dict[str, Any] = {
+                    "frame": int(frame),
+                    "fps": block.get("fps"),
+                    "speed": speed,
+                    "out_time_s": out_time,
+                    "percent": None,
+                    "eta_s": None,
+                    "done": value.strip() == "end",
+                }
+                if expected_duration and out_time is not None:
+                    info["percent"] = max(0.0, min(100.0, out_time / expected_duration * 100))
+                    if speed:
+                        info["eta_s"] = max(0.0, (expected_duration - out_time) / speed)
+                if progress_cb:
+                    try:
+                        progress_cb(info)
+                    except Exception:
+                        pass
+                elapsed = now - start
+                if (timeout and info["eta_s"] is not None and elapsed >= settings.FFMPEG_PROGRESS_WARMUP_SECONDS
+                        and elapsed + info["eta_s"] > timeout):
+                    log.warning("ETA %.0fs excede o timeout de %ss (speed=%sx), abortando cedo", info["eta_s"], timeout, speed)
+                    result = (124, "", "timeout (eta)")
+                    break
+                block = {}
+            else:
+                parsed = _parse_progress_value(key, value)
+                if parsed is not None:
+                    block[key] = parsed
+        if stall_timeout and now - last_advance > stall_timeout:
+            log.warning("Sem frames novos há %ss, abortando encode travado", stall_timeout)
+            result = (125, "", "stalled")
+            break
+        if timeout and now - start > timeout:
+            log.warning("Comando excedeu %ss, forçando encerramento...", timeout)
+            result = (124, "", "timeout")
+            break
+
+    if result is not None:
+        _kill(proc)
+        return result
+    proc.wait()
+    t_err.join(timeout=5)
+    return (proc.returncode, "", err_buf.text())
+
+
+def _native_probe(path: str) -> Optional[Dict[str, Any]]:
+    """Metadados lidos em processo (``probe.probe_mp4``), sem iniciar o ffprobe.
+
+    None quando ``PROBE_BACKEND=ffprobe`` ou quando o arquivo foge do caso
+    comum; nesse caso o chamador usa o ffprobe.
+    """
+    if (settings.PROBE_BACKEND or "auto").strip().lower() == "ffprobe":
+        return None
+    info = probe.probe_mp4(path)
+    metrics.inc("shopee_probe_total", labels={"backend": "native" if info else "ffprobe"},
+                help="Probes de mídia por backend (native = sem subprocesso)")
+    return info
+
 
 def ffprobe_media(path: str) -> Tuple[Optional[int], Optional[int], Optional[float], Optional[int]]:
     if not os.path.exists(path):
@@ -105,6 +206,10 @@ def ffprobe_media(path: str) -> Tuple[Optional[int], Optional[int], Optional[flo
     except Exception:
         pass
 
+    native = _native_probe(path)
+    if native and native["duration"] is not None:
+        return (native["width"], native["height"], native["duration"], size_bytes)
+
     # Usar caminho completo do ffprobe
     cmd = [
         _FFPROBE_EXE,
@@ -117,6 +222,12 @@ def ffprobe_media(path: str) -> Tuple[Optional[int], Optional[int], Optional[flo
     code, out, err = _run(cmd)
     if code != 0:
         return (None, None, None, size_bytes)
+    width, height, duration = _parse_probe_fields(out)
+    return (width, height, duration, size_bytes)
+
+
+def _parse_probe_fields(out: str) -> Tuple[Optional[int], Optional[int], Optional[float]]:
+    """Largura/altura/duração da saída ``key=valor`` do ffprobe."""
     width = height = None
     duration = None
     for line in out.splitlines():
@@ -135,7 +246,34 @@ def ffprobe_media(path: str) -> Tuple[Optional[int], Optional[int], Optional[flo
                 duration = float(line.split("=", 1)[1])
             except Exception:
                 pass
-    return (width, height, duration, size_bytes)
+    return (width, height, duration)
+
+
+def probe_url(url: str, headers: Optional[Dict[str, str]] = None,
+              timeout: int = 15) -> Tuple[Optional[int], Optional[int], Optional[float]]:
+    """Largura/altura/duração lidas direto da URL, sem baixar o vídeo.
+
+    O ffprobe só lê o cabeçalho do contêiner (com ``moov`` no fim do MP4 ele
+    pula até lá com requisições Range). Retorna ``(None, None, None)`` em
+    falha de rede/probe.
+    """
+    cmd = [_FFPROBE_EXE, "-v", "error", "-rw_timeout", str(int(timeout * 1e6))]
+    headers = dict(headers or {})
+    user_agent = headers.pop("User-Agent", None)
+    if user_agent:
+        cmd += ["-user_agent", user_agent]
+    if headers:
+        cmd += ["-headers", "".join(f"{k}: {v}\r\n" for k, v in headers.items())]
+    cmd += [
+        "-select_streams", "v:0",
+        "-show_entries", "stream=width,height:format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=0",
+        url,
+    ]
+    code, out, _ = _run(cmd, timeout=timeout + 5)
+    if code != 0:
+        return (None, None, None)
+    return _parse_probe_fields(out)
 
 
 def validate_min_height(path: str, min_height: int) -> bool:
@@ -143,88 +281,45 @@ def validate_min_height(path: str, min_height: int) -> bool:
     return (h or 0) >= min_height
 
 
-def ffmpeg_upscale(input_path: str, output_path: str, target_min_height: int) -> bool:
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    scale_expr = f"-2:{target_min_height}"
-    cmd = [
-        _FFMPEG_EXE, "-y",
-        "-i", input_path,
-        "-vf", f"scale={scale_expr}",
-        "-c:v", "libx264", "-preset", "veryfast", "-crf", "23",
-        "-c:a", "aac", "-b:a", "128k",
-        output_path,
-    ]
-    code, out, err = _run(cmd)
-    return code == 0 and os.path.exists(output_path)
-
+def _verify_output(path: str) -> bool:
+    """Saída só é publicada se o ffprobe enxerga vídeo e duração (não truncada)."""
+    width, height, duration, _ = ffprobe_media(path)
+    return bool(width and height and duration)
 
-def try_video2x(input_path: str, output_path: str, timeout_seconds: int) -> bool:
-    # Tenta localizar executável do Video2X
-    candidates = [
-        os.path.join(settings.VIDEO2X_DIR, "bin", "video2x.exe"),
-        os.path.join(settings.VIDEO2X_DIR, "bin", "video2x-cli.exe"),
-        "video2x",
-        "video2x-cli",
-    ]
-    exe = next((p for p in candidates if shutil.which(p) or os.path.exists(p)), None)
-    if not exe:
-        return False
 
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    # Parâmetros variam por build do Video2X; tentativa genérica:
-    cmd = [exe, "--input", input_path, "--output", output_path, "--scale-width", "0", "--scale-height", str(settings.VIDEO_TARGET_MIN_HEIGHT)]
-    code, out, err = _run(cmd, timeout=timeout_seconds)
-    return code == 0 and os.path.exists(output_path)
+def plan_upscale(width: Optional[int], height: Optional[int], target_min_h: Optional[int] = None) -> Dict[str, Any]:
+    """Escolhe a rota de upscale mais barata para a entrada.
 
+    A altura que importa é a que sobra após o crop central 9:16 do encode
+    final (``min(h, w*16/9)``). Rotas:
+    - ``noop``: já atinge o alvo, o encode final só reduz/mantém
+    - ``fold``: o ``scale`` do encode final resolve (sem passada extra)
+    - ``video2x``: lacuna >= ``UPSCALE_VIDEO2X_MIN_RATIO``, Video2X instalado
+      e ``PREFER_VIDEO2X_FIRST`` ligado
 
-def ensure_processed(input_path: str) -> tuple[str, str]:
+    Retorna ``{"route", "reason", "effective_height", "ratio"}``.
     """
-    Retorna (processed_path, method) onde method in {"Video2X", "FFmpeg", "Original"}.
-    GARANTE que o vídeo final tenha pelo menos 720p.
-    """
-    base = os.path.splitext(os.path.basename(input_path))[0]
-    out_v2x = os.path.join(settings.PROCESSED_DIR, base + "_v2x.mp4")
-    out_ff = os.path.join(settings.PROCESSED_DIR, base + "_ffmpeg.mp4")
+    target = target_min_h or settings.VIDEO_TARGET_MIN_HEIGHT
+    if not width or not height:
+        # Sem metadados: o encode final escala para o alvo de qualquer forma
+        return {"route": "fold", "reason": "no_metadata", "effective_height": None, "ratio": None}
 
-    # Verifica se o vídeo original já é >= 720p
-    _, height, _, _ = ffprobe_media(input_path)
-    
-    # Se já é >= 720p, pode retornar o original
-    if height and height >= settings.VIDEO_TARGET_MIN_HEIGHT:
-        return input_path, "Original"
-    
-    # Se não, SEMPRE fazer upscale com FFmpeg (garantido)
-    print(f"[UPSCALE] Vídeo {height}p < 720p, forçando upscale...")
-    
-    if settings.PREFER_VIDEO2X_FIRST:
-        if try_video2x(input_path, out_v2x, settings.TIMEOUT_VIDEO2X_SECONDS):
-            # Valida se Video2X realmente fez o upscale
-            _, new_height, _, _ = ffprobe_media(out_v2x)
-            if new_height and new_height >= settings.VIDEO_TARGET_MIN_HEIGHT:
-                return out_v2x, "Video2X"
-        
-        # Fallback para FFmpeg (sempre funciona)
-        if ffmpeg_upscale(input_path, out_ff, settings.VIDEO_TARGET_MIN_HEIGHT):
-            return out_ff, "FFmpeg"
+    if _is_vertical_9_16(width, height):
+        effective_h = height
     else:
-        # FFmpeg primeiro (mais confiável)
-        if ffmpeg_upscale(input_path, out_ff, settings.VIDEO_TARGET_MIN_HEIGHT):
-            return out_ff, "FFmpeg"
-        
-        # Tenta Video2X se FFmpeg falhar
-        if try_video2x(input_path, out_v2x, settings.TIMEOUT_VIDEO2X_SECONDS):
-            _, new_height, _, _ = ffprobe_media(out_v2x)
-            if new_height and new_height >= settings.VIDEO_TARGET_MIN_HEIGHT:
-                return out_v2x, "Video2X"
-    
-    # Se tudo falhar, força upscale com FFmpeg em modo simples
-    print("[UPSCALE] Tentativas falharam, forçando FFmpeg modo simples...")
-    if ffmpeg_upscale(input_path, out_ff, settings.VIDEO_TARGET_MIN_HEIGHT):
-        return out_ff, "FFmpeg"
-    
-    # Último recurso: retorna original (mas isso não deveria acontecer)
-    print("[UPSCALE] AVISO: Não foi possível fazer upscale, usando original")
-    return input_path, "Original"
+        effective_h = min(height, int(math.floor((width * 16 / 9) / 2) * 2))
+    ratio = round(target / effective_h, 3) if effective_h else None
+    plan = {"effective_height": effective_h, "ratio": ratio}
+
+    if effective_h >= target:
+        return {"route": "noop", "reason": "already_target", **plan}
+    if ratio is None or ratio < settings.UPSCALE_VIDEO2X_MIN_RATIO:
+        return {"route": "fold", "reason": "small_gap", **plan}
+    if not settings.PREFER_VIDEO2X_FIRST:
+        return {"route": "fold", "reason": "video2x_disabled", **plan}
+    if not find_video2x():
+        return {"route": "fold", "reason": "video2x_unavailable", **plan}
+    return {"route": "video2x", "reason": "large_gap", **plan}
 
 
 # ==========================
@@ -270,6 +365,11 @@ def analyze_video(path: str) -> Dict[str, Any]:
         "bitrate_kbps": None, "has_audio": False,
         "fps": None,
     }
+    if not os.path.exists(path):
+        return info
+    native = _native_probe(path)
+    if native:
+        return native
     data = ffprobe_full(path)
     if not data:
         return info
@@ -342,6 +442,25 @@ def _is_vertical_9_16(width: Optional[int], height: Optional[int], tol: float =
     return abs(ratio - target) <= tol
 
 
+def _compliant(m: Dict[str, Any]) -> bool:
+    """Verifica se os metadados de ``analyze_video`` atendem ao padrão Shopee."""
+    h = (m.get("height") or 0)
+    fps = (m.get("fps") or 0)
+    vcodec = (m.get("vcodec") or "").lower()
+    acodec = (m.get("acodec") or "").lower()
+    fmt = (m.get("format") or "").lower()
+    br = (m.get("bitrate_kbps") or 0)
+    return (
+        h >= settings.VIDEO_TARGET_MIN_HEIGHT and
+        _is_vertical_9_16(m.get("width"), m.get("height")) and
+        vcodec == "h264" and
+        acodec == "aac" and
+        ("mp4" in fmt) and
+        br >= getattr(settings, 'VIDEO_MIN_BITRATE_KBPS', 2000) and
+        abs(fps - 30.0) <= 0.5
+    )
+
+
 def _build_filters_to_vertical_9_16(width: int, height: int, target_min_h: int) -> str:
     """Gera filtros de crop+scale para vertical 9:16 evitando bordas pretas.
     Força exatamente target_min_h x (target_min_h * 16/9) para garantir resolução exata.
@@ -372,15 +491,29 @@ def _ffmpeg_transcode_shopee(
     width: Optional[int],
     height: Optional[int],
     has_audio: bool,
+    progress_cb: Optional[Callable[[Dict[str, Any]], None]] = None,
+    thumbnail_out: Optional[str] = None,
+    renditions: Optional[List[Dict[str, Any]]] = None,
 ) -> bool:
-    """Transcodifica vídeo com lock para garantir processamento sequencial"""
+    """Transcodifica vídeo com lock para garantir processamento sequencial.
+
+    ``progress_cb`` recebe o progresso do FFmpeg (ver ``_run_ffmpeg_progress``).
+    Com ``thumbnail_out``, o mesmo processo grava também uma miniatura JPEG
+    (máx. 320 px, limite do Telegram) a partir dos frames já decodificados.
+    ``renditions`` (``[{"name", "height", "path"}]``) são versões menores
+    codificadas no mesmo processo, a partir do mesmo decode (``split``); cada
+    uma recebe ``"ok"`` conforme foi publicada. Falha numa rendition não
+    derruba a saída principal.
+    """
+    wait_start = time.perf_counter()
     with _FFMPEG_LOCK:
-        print(f"[FFMPEG] 🔒 Iniciando transcode: {os.path.basename(input_path)}")
-        duration_str = f"{duration:.1f}s" if duration is not None else "N/A"
-        print(f"[FFMPEG] 📊 Input: {width}x{height} | {duration_str} | Audio: {has_audio}")
+        metrics.observe("shopee_ffmpeg_lock_wait_seconds", time.perf_counter() - wait_start,
+                        help="Tempo esperando o lock global do FFmpeg")
+        if log.isEnabledFor(logging.DEBUG):
+            duration_str = f"{duration:.1f}s" if duration is not None else "N/A"
+            log.debug("Iniciando transcode: %s | Input: %sx%s | %s | Audio: %s",
+                      os.path.basename(input_path), width, height, duration_str, has_audio)
         
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-
         filters = []
         if width and height:
             if ensure_vertical and not _is_vertical_9_16(width, height):
@@ -397,9 +530,11 @@ def _ffmpeg_transcode_shopee(
         # Duração: cortar acima de 60s; se < 3s, tentar repetir até 3s
         time_args = []
         loop_args = []
+        expected_duration = duration
         if duration is not None:
             if duration > getattr(settings, 'VIDEO_MAX_DURATION_SECONDS', 60):
                 time_args = ["-t", str(getattr(settings, 'VIDEO_MAX_DURATION_SECONDS', 60))]
+                expected_duration = float(getattr(settings, 'VIDEO_MAX_DURATION_SECONDS', 60))
             elif duration < getattr(settings, 'VIDEO_MIN_DURATION_SECONDS', 3):
                 # Repetir o vídeo para atingir 3s
                 needed = getattr(settings, 'VIDEO_MIN_DURATION_SECONDS', 3)
@@ -407,6 +542,7 @@ def _ffmpeg_transcode_shopee(
                     loops = max(0, math.ceil(needed / duration) - 1)
                     if loops > 0:
                         loop_args = ["-stream_loop", str(loops)]
+                        expected_duration = duration * (loops + 1)
 
         # Audio: se não houver, usar anullsrc
         cmd = [ _FFMPEG_EXE, "-y" ]
@@ -415,6 +551,13 @@ def _ffmpeg_transcode_shopee(
         cmd += ["-i", input_path]
 
         if not has_audio:
+            # anullsrc não termina: limitado à duração do vídeo (ou -shortest,
+            # sem duração conhecida); sem isso o FFmpeg segue gravando silêncio
+            # depois do último frame e o encode é abortado como travado
+            if expected_duration:
+                cmd += ["-t", f"{expected_duration:.3f}"]
+            else:
+                time_args = time_args + ["-shortest"]
             cmd += ["-f", "lavfi", "-i", "anullsrc=channel_layout=stereo:sample_rate=44100"]
 
         # Mapear streams
@@ -424,21 +567,45 @@ def _ffmpeg_transcode_shopee(
         else:
             map_args = ["-map", "0:v:0", "-map", "0:a:0?"]
 
+        # Saídas extras do mesmo decode: split do vídeo já filtrado para as
+        # renditions menores e para a miniatura JPEG (``thumbnail`` escolhe um
+        # frame representativo, evitando o 1º preto)
+        renditions = [r for r in (renditions or []) if r.get("height") and r.get("path")]
+        audio_map = map_args[2:]
+        branches = ["vout"] + [f"r{i}in" for i in range(len(renditions))] + (["tin"] if thumbnail_out else [])
+        filter_args = ["-vf", vf]
+        if len(branches) > 1:
+            graph = [f"[0:v:0]{vf},split={len(branches)}" + "".join(f"[{b}]" for b in branches)]
+            for i, r in enumerate(renditions):
+                graph.append(f"[r{i}in]scale=-2:{int(r['height'])}:flags=lanczos,setsar=1:1[r{i}out]")
+            if thumbnail_out:
+                graph.append("[tin]scale=320:320:force_original_aspect_ratio=decrease,thumbnail=60[tout]")
+            filter_args = ["-filter_complex", ";".join(graph)]
+            map_args[1] = "[vout]"
+
         # Ajustar bitrate (garantir mínimo e aumentar buffer)
         vb = max(min_bitrate_kbps, target_bitrate_kbps)
+        rate_args = [
+            "-maxrate", f"{int(vb * 1.2)}k",  # 20% acima para picos
+            "-bufsize", f"{vb*3}k",  # Buffer maior
+        ]
 
-        enc_args = [
-            "-vf", vf,
+        # Preset/CRF: padrão 'faster'/20 (ENCODER_PRESET/ENCODER_CRF) ou
+        # escolhido pelo auto-tune conforme a classe de resolução da entrada
+        enc = choose_encoder_params(_FFMPEG_EXE, input_path, vf, duration, width, height, rate_args)
+        if enc["source"] != "default":
+            log.debug("Encoder %s: preset=%s crf=%s", enc["source"], enc["preset"], enc["crf"])
+
+        enc_args = filter_args + [
             "-r", "30",
             "-c:v", "libx264",
             "-pix_fmt", "yuv420p",
             "-profile:v", "high",
             "-level", "4.1",
-            "-preset", "faster",  # Mudado de 'slower' para 'faster' - boa qualidade mas 3-4x mais rápido
-            "-crf", "20",  # Mudado de 18 para 20 - ainda excelente qualidade, mais rápido
+            "-preset", str(enc["preset"]),
+            "-crf", str(enc["crf"]),
             "-b:v", f"{vb}k",
-            "-maxrate", f"{int(vb * 1.2)}k",  # 20% acima para picos
-            "-bufsize", f"{vb*3}k",  # Buffer maior
+        ] + rate_args + [
             "-c:a", "aac",
             "-b:a", "192k",  # Áudio mais alto
             "-ac", "2",
@@ -446,49 +613,164 @@ def _ffmpeg_transcode_shopee(
             "-movflags", "+faststart",
         ]
 
-        cmd += map_args + enc_args + time_args + [output_path]
-
-        print(f"[FFMPEG] ⏱️ Timeout: 300s (5 min)")
-        print(f"[FFMPEG] Comando: {' '.join(cmd)}")
-        
-        # TIMEOUT DE 5 MINUTOS (300 segundos)
-        code, out, err = _run(cmd, timeout=300)
+        cmd += map_args + enc_args + time_args
+
+        def _rendition_kbps(r: Dict[str, Any]) -> int:
+            # Bitrate proporcional à altura, com piso para não borrar
+            return max(800, int(vb * int(r["height"]) / max(1, target_min_h)))
+
+        def _rendition_args(i: int, r: Dict[str, Any]) -> List[str]:
+            rb = _rendition_kbps(r)
+            return ["-map", f"[r{i}out]"] + audio_map + [
+                "-r", "30",
+                "-c:v", "libx264",
+                "-pix_fmt", "yuv420p",
+                "-profile:v", "high",
+                "-level", "4.1",
+                "-preset", str(enc["preset"]),
+                "-crf", str(enc["crf"]),
+                "-b:v", f"{rb}k",
+                "-maxrate", f"{int(rb * 1.2)}k",
+                "-bufsize", f"{rb * 3}k",
+                "-c:a", "aac",
+                "-b:a", "128k",
+                "-ac", "2",
+                "-ar", "44100",
+                "-movflags", "+faststart",
+            ] + time_args
+
+        timeout = settings.FFMPEG_TRANSCODE_TIMEOUT_SECONDS
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Comando (timeout %ss): %s", timeout, " ".join(cmd))
         
-        if code == 124:
-            print(f"[FFMPEG] ⏱️❌ TIMEOUT após 5 minutos - vídeo pulado")
-            return False
-        elif code != 0:
-            print(f"[FFMPEG] ❌ Erro (code {code}): {err[:500]}")
-            return False
-        elif not os.path.exists(output_path):
-            print(f"[FFMPEG] ❌ Arquivo de saída não foi criado")
-            return False
-        else:
-            out_size = os.path.getsize(output_path) / (1024*1024)
-            print(f"[FFMPEG] ✅ Sucesso: {output_path} ({out_size:.1f} MB)")
-        
-        print(f"[FFMPEG] 🔓 Transcode finalizado: {os.path.basename(output_path)}")
+        # Escreve em temporários (no scratch/tmpfs se couberem todos: o
+        # +faststart reescreve o arquivo e a verificação o relê); publica só
+        # após validar
+        expected = scratch.estimate_encoded_bytes(vb + 192, expected_duration)
+        if expected:
+            expected += sum(scratch.estimate_encoded_bytes(_rendition_kbps(r) + 128, expected_duration) for r in renditions)
+        tmp_dir = scratch.scratch_dir(expected)
+        with contextlib.ExitStack() as stack:
+            dest = stack.enter_context(atomic_output(output_path, tmp_dir))
+            extra_args: List[str] = []
+            rendition_outs = []
+            for i, r in enumerate(renditions):
+                r_out = stack.enter_context(atomic_output(r["path"], tmp_dir))
+                rendition_outs.append((r, r_out))
+                extra_args += _rendition_args(i, r) + [r_out.tmp_path]
+            thumb = None
+            if thumbnail_out:
+                thumb = stack.enter_context(atomic_output(thumbnail_out))
+                extra_args += ["-map", "[tout]", "-frames:v", "1", "-q:v", "5", thumb.tmp_path]
+            t = stack.enter_context(metrics.timer("shopee_transcode_seconds", help="Duração do transcode Shopee"))
+            code, out, err = _run_ffmpeg_progress(cmd + [dest.tmp_path] + extra_args, expected_duration, progress_cb, timeout=timeout)
+
+            if code == 124:
+                t.labels["status"] = "timeout"
+                log.error("TIMEOUT (%s) - vídeo pulado", err)
+                return False
+            elif code == 125:
+                t.labels["status"] = "stalled"
+                log.error("Encode travado sem progresso - vídeo pulado")
+                return False
+            elif code != 0:
+                t.labels["status"] = "error"
+                log.error("Erro (code %s): %s", code, err[-500:])
+                return False
+            elif not dest.commit(verify=_verify_output):
+                t.labels["status"] = "error"
+                log.error("Arquivo de saída ausente ou truncado, descartado")
+                return False
+            else:
+                t.labels["status"] = "ok"
+                for r, r_out in rendition_outs:
+                    r["ok"] = r_out.commit(verify=_verify_output)
+                    if not r["ok"]:
+                        log.warning("Rendition %s ausente ou truncada, descartada", r.get("name"))
+                if thumb is not None and not thumb.commit():
+                    # Sem miniatura o envio segue normalmente
+                    log.debug("Miniatura não gerada")
+                out_bytes = os.path.getsize(output_path)
+                metrics.inc("shopee_transcode_output_bytes_total", out_bytes)
+                log.info("Transcode ok: %s", os.path.basename(output_path), extra={
+                    "duration_ms": int((time.perf_counter() - t.start) * 1000),
+                    "bytes": out_bytes,
+                })
+
         return True
 
 
-def ensure_shopee_ready(input_path: str) -> Tuple[str, Dict[str, Any]]:
+def parse_renditions(value: Optional[str] = None) -> List[Dict[str, Any]]:
+    """``"preview:720,mini:480"`` -> ``[{"name": "preview", "height": 720}, ...]``."""
+    out = []
+    for item in (settings.RENDITIONS if value is None else value).split(","):
+        name, _, height = item.strip().partition(":")
+        try:
+            h = int(height)
+        except ValueError:
+            continue
+        if name and h > 0:
+            out.append({"name": name.strip(), "height": h - h % 2})
+    return out
+
+
+def ensure_shopee_ready(input_path: str, progress_cb: Optional[Callable[[Dict[str, Any]], None]] = None) -> Tuple[str, Dict[str, Any]]:
     """Garante que o vídeo atenda às regras:
     - MP4 container, vídeo H.264, áudio AAC
-    - Resolução >= 720p (pode usar Video2X e/ou FFmpeg)
+    - Resolução >= alvo (scale no encode final; Video2X só para lacunas grandes)
     - Proporção vertical 9:16 (sem bordas pretas) via crop central
     - Bitrate de vídeo >= 2000 kbps (alvo configurável)
     - Duração entre 3s e 60s (corta acima, repete abaixo)
 
+    ``progress_cb`` recebe o progresso do transcode (percent/eta/fps/speed).
+
     Retorna: (output_path, report_dict)
     """
     rep: Dict[str, Any] = {"steps": []}
 
-    # 1) Garantir altura mínima (reusa ensure_processed)
-    base_out, method = ensure_processed(input_path)
-    rep["steps"].append({"ensure_processed": method, "path": base_out})
-
-    # 2) Analisar e decidir transcode
-    meta = analyze_video(base_out)
+    # 0) Mesma fonte + mesmo perfil de encode já processados: reaproveitar
+    source_sha = None
+    if settings.ARTIFACT_STORE_ENABLED:
+        try:
+            source_sha = file_sha256(input_path)
+        except OSError as e:
+            log.warning("Não foi possível calcular hash da fonte: %s", e)
+    if source_sha:
+        src_base = os.path.splitext(os.path.basename(input_path))[0]
+        cached_out = os.path.join(settings.PROCESSED_DIR, src_base + "_shopee.mp4")
+        cached = artifact_store.lookup(source_sha, cached_out, verify=_verify_output)
+        if cached is not None:
+            rep["steps"].append({"artifact_store": "hit", "source_sha256": source_sha})
+            rep["probe_after"] = cached.get("probe_after")
+            for key in ("thumbnail", "renditions"):
+                if cached.get(key):
+                    rep[key] = cached[key]
+            rep["final"] = cached_out
+            rep["changed"] = True
+            return cached_out, rep
+
+    # 1) Planejar o upscale a partir de um único probe da entrada: lacunas
+    #    pequenas ficam para o scale do encode final (sem passada extra)
+    meta = analyze_video(input_path)
+    plan = plan_upscale(meta.get("width"), meta.get("height"))
+    rep["steps"].append({"upscale_plan": plan})
+    base_out = input_path
+    if plan["route"] == "video2x":
+        log.info("Lacuna de resolução %.2fx, upscale com Video2X...", plan["ratio"], extra={"stage": "upscale"})
+        out_v2x, v2x_rep = video2x_supervisor.upscale(input_path, duration=meta.get("duration"), fps=meta.get("fps"),
+                                                      verify=_verify_output, src_height=meta.get("height"))
+        rep["steps"].append({"video2x": v2x_rep})
+        if out_v2x:
+            v2x_meta = analyze_video(out_v2x)
+            if (v2x_meta.get("height") or 0) > (meta.get("height") or 0):
+                base_out, meta = out_v2x, v2x_meta
+        if base_out == input_path:
+            log.warning("Video2X sem resultado (%s), upscale fica para o encode final", v2x_rep.get("status"),
+                        extra={"stage": "upscale"})
+            plan["route"], plan["reason"] = "fold", "video2x_" + str(v2x_rep.get("status"))
+    rep["steps"].append({"ensure_processed": {"video2x": "Video2X", "fold": "Fold"}.get(plan["route"], "Original"), "path": base_out})
+
+    # 2) Decidir transcode
     rep["probe_before"] = meta
 
     width = meta.get("width") or 0
@@ -514,6 +796,7 @@ def ensure_shopee_ready(input_path: str) -> Tuple[str, Dict[str, Any]]:
     base = os.path.splitext(os.path.basename(base_out))[0]
     out_path = os.path.join(settings.PROCESSED_DIR, base + "_shopee.mp4")
 
+    renditions = [dict(r, path=rendition_path(out_path, r["name"])) for r in parse_renditions()]
     ok = _ffmpeg_transcode_shopee(
         base_out,
         out_path,
@@ -525,54 +808,42 @@ def ensure_shopee_ready(input_path: str) -> Tuple[str, Dict[str, Any]]:
         width=width or None,
         height=height or None,
         has_audio=has_audio,
+        progress_cb=progress_cb,
+        thumbnail_out=thumbnail_path(out_path) if settings.SEND_THUMBNAIL else None,
+        renditions=renditions,
     )
 
+    used_fallback = False
     if not ok:
-        print(f"[FFMPEG] ⚠️ Transcode principal falhou, tentando fallback simples...")
+        log.warning("Transcode principal falhou, tentando fallback simples (timeout 120s)...")
         # Como fallback extremo, tentar apenas recodificar simples com timeout
         simple_out = os.path.join(settings.PROCESSED_DIR, base + "_shopee_simple.mp4")
-        cmd = [
-            _FFMPEG_EXE, "-y", "-i", base_out,
-            "-vf", f"scale=-2:{settings.VIDEO_TARGET_MIN_HEIGHT}",
-            "-c:v", "libx264", "-pix_fmt", "yuv420p", "-preset", "veryfast",
-            "-c:a", "aac", "-b:a", "128k",
-            simple_out,
-        ]
-        print(f"[FFMPEG] Fallback timeout: 120s")
-        code, out, err = _run(cmd, timeout=120)
-        if code == 0 and os.path.exists(simple_out):
+        with atomic_output(simple_out) as dest:
+            cmd = [
+                _FFMPEG_EXE, "-y", "-i", base_out,
+                "-vf", f"scale=-2:{settings.VIDEO_TARGET_MIN_HEIGHT}",
+                "-c:v", "libx264", "-pix_fmt", "yuv420p", "-preset", "veryfast",
+                "-c:a", "aac", "-b:a", "128k",
+                dest.tmp_path,
+            ]
+            code, out, err = _run_ffmpeg_progress(cmd, duration, progress_cb, timeout=120)
+            simple_ok = code == 0 and dest.commit(verify=_verify_output)
+        if simple_ok:
             out_path = simple_out
-            print(f"[FFMPEG] ✅ Fallback simples funcionou")
+            used_fallback = True
+            log.info("Fallback simples funcionou")
         else:
-            print(f"[FFMPEG] ❌ Fallback falhou - usando arquivo original")
+            log.error("Fallback falhou - usando arquivo original")
             rep["final"] = base_out
             rep["changed"] = False
             rep["error"] = "transcode_failed_all_methods"
             return base_out, rep
 
-    def _compliant(m: Dict[str, Any]) -> bool:
-        w = (m.get("width") or 0)
-        h = (m.get("height") or 0)
-        fps = (m.get("fps") or 0)
-        vcodec = (m.get("vcodec") or "").lower()
-        acodec = (m.get("acodec") or "").lower()
-        fmt = (m.get("format") or "").lower()
-        br = (m.get("bitrate_kbps") or 0)
-        return (
-            h >= settings.VIDEO_TARGET_MIN_HEIGHT and
-            _is_vertical_9_16(m.get("width"), m.get("height")) and
-            vcodec == "h264" and
-            acodec == "aac" and
-            ("mp4" in fmt) and
-            br >= getattr(settings, 'VIDEO_MIN_BITRATE_KBPS', 2000) and
-            abs(fps - 30.0) <= 0.5
-        )
-
     # Verificar resultado e, se necessário, tentar uma segunda passagem mais "agressiva"
     meta_after = analyze_video(out_path)
     rep["probe_after"] = meta_after
     if not _compliant(meta_after):
-        print(f"[FFMPEG] ⚠️ Vídeo não conforme após primeira passagem, pulando segunda passagem para ganhar velocidade")
+        log.warning("Vídeo não conforme após primeira passagem, pulando segunda passagem para ganhar velocidade")
         rep["steps"].append({"second_pass_skipped": "performance_priority"})
         # Desabilitando segunda passagem para ganhar velocidade - primeira passagem já garante qualidade suficiente
         # Se precisar qualidade máxima, descomente o bloco abaixo
@@ -597,7 +868,11 @@ def ensure_shopee_ready(input_path: str) -> Tuple[str, Dict[str, Any]]:
 
     rep["final"] = out_path
     rep["changed"] = True
-    
+    if not used_fallback and os.path.exists(thumbnail_path(out_path)):
+        rep["thumbnail"] = thumbnail_path(out_path)
+    if not used_fallback and renditions:
+        rep["renditions"] = {r["name"]: r["path"] for r in renditions if r.get("ok")}
+
     # Validação final detalhada
     final_meta = analyze_video(out_path)
     final_w = final_meta.get("width") or 0
@@ -606,14 +881,20 @@ def ensure_shopee_ready(input_path: str) -> Tuple[str, Dict[str, Any]]:
     final_fps = final_meta.get("fps")
     final_size_mb = os.path.getsize(out_path) / (1024 * 1024) if os.path.exists(out_path) else 0
     
-    print(f"[SHOPEE] ✅ Vídeo processado com sucesso:")
-    print(f"  📐 Resolução: {final_w}x{final_h}")
-    fps_str = f"{final_fps:.1f}" if final_fps else "N/A"
-    print(f"  🎬 FPS: {fps_str}")
-    print(f"  💾 Tamanho: {final_size_mb:.2f} MB")
-    print(f"  📊 Bitrate: {final_br} kbps")
-    print(f"  🎥 Codec: {final_meta.get('vcodec', 'N/A')} / {final_meta.get('acodec', 'N/A')}")
-    print(f"  ✔️ Conforme padrão Shopee: {'SIM' if _compliant(final_meta) else 'QUASE (pode enviar)'}")
-    
+    if log.isEnabledFor(logging.INFO):
+        fps_str = f"{final_fps:.1f}" if final_fps else "N/A"
+        log.info(
+            "Vídeo processado: %sx%s | %s fps | %.2f MB | %s kbps | %s/%s | conforme: %s",
+            final_w, final_h, fps_str, final_size_mb, final_br,
+            final_meta.get("vcodec", "N/A"), final_meta.get("acodec", "N/A"),
+            "SIM" if _compliant(final_meta) else "QUASE (pode enviar)",
+            extra={"stage": "shopee"},
+        )
+
+    # Só finais conformes entram no cache. A saída do fallback simples também
+    # fica de fora: a próxima tentativa deve poder produzir o encode completo
+    if source_sha and not used_fallback and _compliant(final_meta):
+        artifact_store.put(source_sha, out_path, rep)
+
     return out_path, rep
 
@@ -0,0 +1,334 @@
+"""
+Benchmark do pipeline de vídeo com clipes sintéticos (FFmpeg lavfi testsrc2/sine).
+
+Gera clipes determinísticos localmente (paisagem, quadrado, 480p, < 3s, > 60s e
+15 fps, cada um com e sem áudio), cronometra cada etapa do pipeline e grava um
+relatório JSON comparável entre versões. Cada execução roda com os caches
+persistentes (store, cache do Video2X, auto-tune do encoder) num diretório
+temporário próprio, então os tempos são sempre de cache frio.
+
+Cada caso também roda o transcode com todas as saídas do mesmo decode (final,
+renditions e miniatura) e confere que cada uma foi publicada com a duração da
+principal, e que a principal tem a mesma duração do transcode sem saídas extras
+(a miniatura com ``-frames:v 1`` não pode encerrar o encode cedo); saída
+faltando ou encurtada faz o script terminar com código 1.
+
+Uso (a partir da raiz do projeto):
+
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --cases landscape,square --repeat 3
+    python benchmarks/bench_pipeline.py --compare benchmarks/results/anterior.json --max-regression 10
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# Garantir que a raiz do projeto esteja no sys.path ao executar este script diretamente
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from app.config import settings
+from app import encoder_tuning, fileutils, metrics
+from app import video_tools as vt
+from app.fileutils import rendition_path, thumbnail_path
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CLIPS_DIR = os.path.join(BENCH_DIR, ".clips")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+# nome -> (largura, altura, duração em segundos, fps)
+BASE_CASES = {
+    "landscape": (1280, 720, 10, 30),
+    "square": (720, 720, 10, 30),
+    "480p": (854, 480, 10, 30),
+    "short": (540, 960, 2, 30),
+    "long": (640, 360, 65, 30),
+    # 45 frames decodificados: menos que o lote de 60 do filtro thumbnail
+    "lowfps": (540, 960, 3, 15),
+}
+
+# Renditions do estágio de saídas múltiplas quando RENDITIONS está vazio
+BENCH_RENDITIONS = "preview:720,mini:480"
+
+# Métricas comparadas no --compare (menor é melhor)
+COMPARE_KEYS = ("transcode_s", "multi_output_s", "ensure_ready_s")
+
+
+def _git_rev() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or "unknown"
+    except Exception:
+        return "unknown"
+
+
+def _ffmpeg_version() -> str:
+    code, out, _ = vt._run([vt._FFMPEG_EXE, "-version"], timeout=30)
+    return out.splitlines()[0] if code == 0 and out else "unknown"
+
+
+def all_cases() -> list[tuple[str, int, int, int, int, bool]]:
+    cases = []
+    for name, (w, h, d, fps) in BASE_CASES.items():
+        cases.append((f"{name}_audio", w, h, d, fps, True))
+        cases.append((f"{name}_noaudio", w, h, d, fps, False))
+    return cases
+
+
+def make_clip(name: str, width: int, height: int, duration: int, fps: int, audio: bool) -> str:
+    """Gera (ou reaproveita) um clipe sintético determinístico."""
+    os.makedirs(CLIPS_DIR, exist_ok=True)
+    path = os.path.join(CLIPS_DIR, f"{name}_{width}x{height}_{duration}s_{fps}fps.mp4")
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        return path
+    cmd = [vt._FFMPEG_EXE, "-y", "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate={fps}:duration={duration}"]
+    if audio:
+        cmd += ["-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={duration}"]
+    cmd += ["-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", "-threads", "1"]
+    if audio:
+        cmd += ["-c:a", "aac", "-b:a", "128k", "-shortest"]
+    cmd += ["-map_metadata", "-1", "-fflags", "+bitexact", "-flags:v", "+bitexact", "-flags:a", "+bitexact", path]
+    code, _, err = vt._run(cmd, timeout=300)
+    if code != 0:
+        raise RuntimeError(f"falha ao gerar {name}: {err[-300:]}")
+    return path
+
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_case(name: str, clip: str, workdir: str) -> dict:
+    """Executa uma vez todas as etapas para um clipe, com caches frios."""
+    # Caches persistentes no workdir: store e cache do Video2X ficam sob
+    # PROCESSED_DIR; auto-tune e memo de hashes seriam reaproveitados entre execuções
+    settings.PROCESSED_DIR = workdir
+    settings.ENCODER_AUTOTUNE_CACHE_PATH = os.path.join(workdir, "encoder_autotune.json")
+    encoder_tuning._cache = None
+    with fileutils._hash_lock:
+        fileutils._hash_memo.clear()
+    stages = {}
+
+    meta, stages["probe_s"] = _timed(vt.analyze_video, clip)
+    w, h = meta.get("width") or 0, meta.get("height") or 0
+
+    # Construção dos filtros (microbenchmark: custo por chamada em µs)
+    n = 10000
+    start = time.perf_counter()
+    for _ in range(n):
+        vt._build_filters_to_vertical_9_16(w, h, settings.VIDEO_TARGET_MIN_HEIGHT)
+    stages["filters_us"] = (time.perf_counter() - start) / n * 1e6
+
+    # Transcode direto (isola o custo do encoder)
+    last = {"frame": 0}
+
+    def _progress(info):
+        last["frame"] = info.get("frame") or last["frame"]
+
+    out_path = os.path.join(workdir, f"{name}_direct.mp4")
+    ok, stages["transcode_s"] = _timed(
+        vt._ffmpeg_transcode_shopee,
+        clip,
+        out_path,
+        target_min_h=settings.VIDEO_TARGET_MIN_HEIGHT,
+        ensure_vertical=True,
+        target_bitrate_kbps=settings.VIDEO_TARGET_BITRATE_KBPS,
+        min_bitrate_kbps=settings.VIDEO_MIN_BITRATE_KBPS,
+        duration=meta.get("duration"),
+        width=w or None,
+        height=h or None,
+        has_audio=bool(meta.get("has_audio")),
+        progress_cb=_progress,
+    )
+    encode_fps = last["frame"] / stages["transcode_s"] if ok and stages["transcode_s"] > 0 else None
+
+    # Mesmo transcode com todas as saídas do decode (split -> renditions + miniatura)
+    multi_path = os.path.join(workdir, f"{name}_multi.mp4")
+    renditions = [dict(r, path=rendition_path(multi_path, r["name"]))
+                  for r in vt.parse_renditions(settings.RENDITIONS or BENCH_RENDITIONS)]
+    multi_ok, stages["multi_output_s"] = _timed(
+        vt._ffmpeg_transcode_shopee,
+        clip,
+        multi_path,
+        target_min_h=settings.VIDEO_TARGET_MIN_HEIGHT,
+        ensure_vertical=True,
+        target_bitrate_kbps=settings.VIDEO_TARGET_BITRATE_KBPS,
+        min_bitrate_kbps=settings.VIDEO_MIN_BITRATE_KBPS,
+        duration=meta.get("duration"),
+        width=w or None,
+        height=h or None,
+        has_audio=bool(meta.get("has_audio")),
+        thumbnail_out=thumbnail_path(multi_path),
+        renditions=renditions,
+    )
+    outputs = {
+        "direct": vt.analyze_video(out_path).get("duration") if ok else None,
+        "main": vt.analyze_video(multi_path).get("duration") if multi_ok else None,
+    }
+    for r in renditions:
+        outputs[r["name"]] = vt.analyze_video(r["path"]).get("duration") if r.get("ok") else None
+    thumb = thumbnail_path(multi_path)
+    outputs["thumbnail_bytes"] = os.path.getsize(thumb) if os.path.exists(thumb) else None
+    # Completo: todas as saídas publicadas, a principal com a duração do
+    # transcode direto (a miniatura não a encurta) e renditions iguais a ela
+    outputs_ok = bool(outputs["main"]) and bool(outputs["thumbnail_bytes"]) and all(
+        outputs[key] and abs(outputs[key] - outputs["main"]) <= 0.1
+        for key in ["direct"] + [r["name"] for r in renditions]
+    )
+
+    # Pipeline completo (upscale + transcode + validação)
+    for f in os.listdir(workdir):
+        if f != os.path.basename(out_path):
+            os.remove(os.path.join(workdir, f))
+    (final_path, rep), stages["ensure_ready_s"] = _timed(vt.ensure_shopee_ready, clip)
+    final_meta = vt.analyze_video(final_path)
+
+    return {
+        "transcode_ok": bool(ok),
+        "outputs_ok": outputs_ok,
+        "outputs": outputs,
+        "stages": stages,
+        "encode_fps": encode_fps,
+        "output_bytes": os.path.getsize(final_path) if os.path.exists(final_path) else None,
+        "output": {k: final_meta.get(k) for k in ("width", "height", "duration", "fps", "bitrate_kbps", "vcodec", "acodec")},
+        "compliant": vt._compliant(final_meta),
+        "steps": rep.get("steps"),
+    }
+
+
+def _median_stages(runs: list[dict]) -> dict:
+    keys = runs[0]["stages"].keys()
+    return {k: statistics.median(r["stages"][k] for r in runs) for k in keys}
+
+
+def run_benchmarks(selected: list[str], repeat: int) -> dict:
+    metrics.reset()
+    original_processed = settings.PROCESSED_DIR
+    original_autotune = settings.ENCODER_AUTOTUNE_CACHE_PATH
+    results = []
+    try:
+        for name, w, h, d, fps, audio in all_cases():
+            if selected and not any(name.startswith(s) for s in selected):
+                continue
+            print(f"▶ {name} ({w}x{h}, {d}s, {fps} fps, áudio={'sim' if audio else 'não'})")
+            clip = make_clip(name, w, h, d, fps, audio)
+            runs = []
+            for _ in range(repeat):
+                workdir = tempfile.mkdtemp(prefix="bench_")
+                try:
+                    runs.append(bench_case(name, clip, workdir))
+                finally:
+                    shutil.rmtree(workdir, ignore_errors=True)
+            case = dict(runs[-1])
+            case["stages"] = _median_stages(runs)
+            fps_values = [r["encode_fps"] for r in runs if r["encode_fps"]]
+            case["encode_fps"] = statistics.median(fps_values) if fps_values else None
+            case.update({"name": name, "input": {"width": w, "height": h, "duration": d, "fps": fps, "audio": audio},
+                         "repeat": repeat})
+            results.append(case)
+            case["outputs_ok"] = all(r["outputs_ok"] for r in runs)
+            st = case["stages"]
+            print(f"  transcode {st['transcode_s']:.2f}s | saídas múltiplas {st['multi_output_s']:.2f}s | "
+                  f"pipeline {st['ensure_ready_s']:.2f}s | "
+                  f"{case['encode_fps'] or 0:.1f} fps | {(case['output_bytes'] or 0) / 1e6:.2f} MB | "
+                  f"conforme={'sim' if case['compliant'] else 'não'} | "
+                  f"saídas={'ok' if case['outputs_ok'] else 'FALTANDO'}")
+    finally:
+        settings.PROCESSED_DIR = original_processed
+        settings.ENCODER_AUTOTUNE_CACHE_PATH = original_autotune
+        encoder_tuning._cache = None
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_rev": _git_rev(),
+            "ffmpeg": _ffmpeg_version(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            # Cada execução parte sem store, cache do Video2X, auto-tune e memo de hashes
+            "caches": "cold",
+            "settings": {
+                "VIDEO_TARGET_MIN_HEIGHT": settings.VIDEO_TARGET_MIN_HEIGHT,
+                "VIDEO_TARGET_BITRATE_KBPS": settings.VIDEO_TARGET_BITRATE_KBPS,
+                "VIDEO_MIN_BITRATE_KBPS": settings.VIDEO_MIN_BITRATE_KBPS,
+                "ENCODER_PRESET": settings.ENCODER_PRESET,
+                "ENCODER_CRF": settings.ENCODER_CRF,
+                "ENCODER_AUTOTUNE": settings.ENCODER_AUTOTUNE,
+            },
+        },
+        "cases": results,
+        "metrics": metrics.snapshot(),
+    }
+
+
+def compare(current: dict, baseline: dict, max_regression_pct: float) -> bool:
+    """Imprime a variação por caso/etapa. Retorna False se houver regressão acima do limite."""
+    base_by_name = {c["name"]: c for c in baseline.get("cases", [])}
+    ok = True
+    print(f"\nComparação com {baseline.get('meta', {}).get('git_rev', '?')} (limite {max_regression_pct:.0f}%):")
+    for case in current["cases"]:
+        base = base_by_name.get(case["name"])
+        if not base:
+            continue
+        parts = []
+        for key in COMPARE_KEYS:
+            old, new = base["stages"].get(key), case["stages"].get(key)
+            if not old or new is None:
+                continue
+            delta = (new - old) / old * 100
+            flag = ""
+            if delta > max_regression_pct:
+                flag = " ⚠️"
+                ok = False
+            parts.append(f"{key} {old:.2f}→{new:.2f}s ({delta:+.1f}%){flag}")
+        if base.get("compliant") and not case.get("compliant"):
+            parts.append("conformidade perdida ⚠️")
+            ok = False
+        print(f"  {case['name']}: " + " | ".join(parts))
+    return ok
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark do pipeline de vídeo")
+    parser.add_argument("--cases", default="", help="prefixos separados por vírgula (ex.: landscape,short)")
+    parser.add_argument("--repeat", type=int, default=1, help="execuções por caso (usa a mediana)")
+    parser.add_argument("--out", default="", help="arquivo JSON de saída (padrão: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", default="", help="relatório JSON anterior para comparação")
+    parser.add_argument("--max-regression", type=float, default=10.0, help="regressão máxima aceita em %% (com --compare)")
+    args = parser.parse_args()
+
+    selected = [c.strip() for c in args.cases.split(",") if c.strip()]
+    report = run_benchmarks(selected, max(1, args.repeat))
+
+    out = args.out or os.path.join(RESULTS_DIR, datetime.now().strftime("%Y%m%d_%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\n✅ Relatório salvo em: {out}")
+
+    missing = [c["name"] for c in report["cases"] if not c["outputs_ok"]]
+    if missing:
+        print(f"❌ Saídas do transcode faltando em: {', '.join(missing)}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if not compare(report, baseline, args.max_regression):
+            return 1
+    return 1 if missing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""
+Verifica o resolvedor de links (app/link_resolver.py) contra um servidor HTTP local.
+
+Sobe um servidor em 127.0.0.1 com páginas de exemplo (redirecionamentos,
+og:video, JSON embutido, vídeo direto, 404, página sem vídeo) e usa um banco
+SQLite temporário para o cache de URLs. Não acessa a internet.
+
+Uso (a partir da raiz do projeto):
+
+    python scripts/check_link_resolver.py
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Adicionar o diretório pai ao path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+from app import link_resolver
+from app.config import settings
+from app.db import init_db
+
+# Caminhos pedidos ao servidor (para saber quando o cache evitou a rede)
+HITS = []
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, content_type=None, body=b"", location=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        if location:
+            self.send_header("Location", location)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        HITS.append(self.path)
+        path = self.path.split("?", 1)[0]
+        host = f"http://127.0.0.1:{self.server.server_port}"
+        if path == "/s/short":
+            # Cadeia: link curto -> rastreio -> página do produto
+            self._send(302, location="/r/track")
+        elif path == "/r/track":
+            self._send(301, location=f"{host}/product/og")
+        elif path == "/product/og":
+            page = '<html><head><meta property="og:video" content="/cdn/og.mp4?sig=a&amp;exp=2"></head></html>'
+            self._send(200, "text/html; charset=utf-8", page.encode("utf-8"))
+        elif path == "/product/json":
+            page = '<script>window.__DATA__={"video":"%s\\/cdn\\/json.mp4"}</script>' % host.replace("/", "\\/")
+            self._send(200, "text/html", page.encode("utf-8"))
+        elif path == "/s/direct":
+            self._send(302, location="/cdn/stream")
+        elif path == "/cdn/stream":
+            self._send(200, "video/mp4", b"\x00\x00\x00\x18ftypisom")
+        elif path == "/product/none":
+            self._send(200, "text/html", b"<html><body>sem video</body></html>")
+        else:
+            self._send(404, "text/html", b"not found")
+
+
+FAILURES = []
+
+
+def check(name, condition, detail=""):
+    if condition:
+        print(f"  ✅ {name}")
+    else:
+        print(f"  ❌ {name} {detail}")
+        FAILURES.append(name)
+
+
+def main() -> int:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    session = requests.Session()
+
+    with tempfile.TemporaryDirectory(prefix="resolver_check_") as tmp:
+        # Banco temporário: o cache de URLs não toca os bancos reais
+        settings.USE_DUAL_DATABASES = False
+        settings.DB_SINGLE_PATH = os.path.join(tmp, "videos.db")
+        settings.URL_RESOLVE = True
+        settings.URL_CACHE_TTL_SECONDS = 3600
+        init_db()
+
+        print("\n🔗 RESOLVEDOR DE LINKS (servidor local %s):" % base)
+
+        url = link_resolver.resolve(session, f"Olha esse produto {base}/s/short?utm_source=app !")
+        check("cadeia de redirecionamentos + og:video", url == f"{base}/cdn/og.mp4?sig=a&exp=2", url)
+
+        HITS.clear()
+        again = link_resolver.resolve(session, f"{base}/s/short?utm_campaign=outra")
+        check("segundo resolve vem do cache (sem requisições)", again == url and not HITS, f"{again} {HITS}")
+
+        url = link_resolver.resolve(session, f"{base}/product/json")
+        check("URL escapada em JSON embutido", url == f"{base}/cdn/json.mp4", url)
+
+        url = link_resolver.resolve(session, f"{base}/s/direct")
+        check("resposta já é vídeo (URL final do redirect)", url == f"{base}/cdn/stream", url)
+
+        check("página sem vídeo -> None", link_resolver.fetch_media_url(session, f"{base}/product/none") is None)
+
+        HITS.clear()
+        url = link_resolver.resolve(session, f"{base}/missing")
+        second = link_resolver.resolve(session, f"{base}/missing")
+        check("404 mantém a URL original e não entra no cache",
+              url == second == f"{base}/missing" and len(HITS) == 2, f"{url} {HITS}")
+
+        # TTL: entrada vencida volta a resolver
+        settings.URL_CACHE_TTL_SECONDS = 1
+        link_resolver.forget(f"{base}/product/json")
+        link_resolver.resolve(session, f"{base}/product/json")
+        time.sleep(1.1)
+        HITS.clear()
+        link_resolver.resolve(session, f"{base}/product/json")
+        check("entrada vencida (TTL) é resolvida de novo", HITS == ["/product/json"], str(HITS))
+
+    server.shutdown()
+    if FAILURES:
+        print(f"\n❌ {len(FAILURES)} verificação(ões) falharam")
+        return 1
+    print("\n✅ Resolvedor OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""
+Verifica a ordem da fila por custo (app/scheduling.py) numa fila nova.
+
+Gera clipes sintéticos de tamanhos/durações diferentes (FFmpeg lavfi), serve
+os arquivos num servidor HTTP em 127.0.0.1 e cadastra os links em ordem
+decrescente de custo num banco SQLite temporário. Nenhum original é baixado:
+``process_all_videos`` roda com download/processamento trocados por
+funções que só registram a ordem, então o custo usado vem da medição dos
+links antes de ordenar a fila. Não acessa a internet.
+
+Uso (a partir da raiz do projeto):
+
+    python scripts/check_scheduling.py
+"""
+import os
+import sys
+import tempfile
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+# Adicionar o diretório pai ao path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import simple_processor
+from app import video_tools as vt
+from app.config import settings
+from app.db import get_original_record, init_db, insert_original
+
+# nome -> (largura, altura, duração em segundos); cadastrados nesta ordem
+CLIPS = {
+    "grande": (1280, 720, 6),
+    "medio": (640, 360, 4),
+    "pequeno": (320, 240, 2),
+}
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+FAILURES = []
+
+
+def check(name, condition, detail=""):
+    if condition:
+        print(f"  ✅ {name}")
+    else:
+        print(f"  ❌ {name} {detail}")
+        FAILURES.append(name)
+
+
+def make_clip(directory: str, name: str, width: int, height: int, duration: int) -> str:
+    path = os.path.join(directory, f"{name}.mp4")
+    cmd = [vt._FFMPEG_EXE, "-y", "-v", "error", "-f", "lavfi",
+           "-i", f"testsrc2=size={width}x{height}:rate=30:duration={duration}",
+           "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", path]
+    code, _, err = vt._run(cmd, timeout=120)
+    if code != 0:
+        raise RuntimeError(f"falha ao gerar {name}: {err[-300:]}")
+    return path
+
+
+def run_queue(urls) -> tuple:
+    """Cadastra ``urls`` num banco novo; retorna os ids e a ordem (índices de ``urls``)."""
+    init_db()
+    ids = [insert_original(source_type="url", source_url=u, telegram_file_id=None, original_path=None) for u in urls]
+    processed = []
+    simple_processor._download_record = lambda rid, rec=None, progress_cb=None: f"original_{rid}.mp4"
+    simple_processor._process_record = lambda rid, rec=None, progress_cb=None: processed.append(rid)
+    simple_processor.process_all_videos()
+    return ids, [ids.index(rid) for rid in processed]
+
+
+def main() -> int:
+    with tempfile.TemporaryDirectory(prefix="sched_check_") as tmp:
+        www = os.path.join(tmp, "www")
+        os.makedirs(www)
+        for name, (w, h, d) in CLIPS.items():
+            make_clip(www, name, w, h, d)
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=www))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_port}"
+
+        # Banco e diretórios temporários; custo só por duração x pixels
+        settings.USE_DUAL_DATABASES = False
+        settings.DOWNLOAD_DIR = os.path.join(tmp, "downloads")
+        settings.PROCESSED_DIR = os.path.join(tmp, "processed")
+        settings.METRICS_PORT = 0
+        settings.SCHEDULING = "cost"
+        settings.SCHED_VIDEO2X_COST_FACTOR = 1.0
+        urls = [f"{base}/{name}.mp4" for name in CLIPS]
+        sizes = [w * h * d for w, h, d in CLIPS.values()]
+        expected = sorted(range(len(CLIPS)), key=sizes.__getitem__)
+
+        print("\n📊 ORDEM DA FILA POR CUSTO (servidor local %s):" % base)
+
+        settings.DB_SINGLE_PATH = os.path.join(tmp, "medido.db")
+        ids, order = run_queue(urls)
+        names = [list(CLIPS)[i] for i in order]
+        check("fila nova sai em ordem de custo (menor primeiro)", order == expected, str(names))
+        costs = [get_original_record(rid)["priority"] for rid in ids]
+        check("custo gravado na coluna priority antes do download",
+              all(c is not None for c in costs) and costs == sorted(costs, reverse=True), str(costs))
+
+        settings.DB_SINGLE_PATH = os.path.join(tmp, "sem_medida.db")
+        settings.SCHED_PROBE_TIMEOUT_SECONDS = 0
+        _, order = run_queue(urls)
+        check("sem medição (SCHED_PROBE_TIMEOUT_SECONDS=0) fica na ordem da tabela",
+              order == list(range(len(CLIPS))), str(order))
+
+        settings.DB_SINGLE_PATH = os.path.join(tmp, "com_falha.db")
+        settings.SCHED_PROBE_TIMEOUT_SECONDS = 5
+        _, order = run_queue([f"{base}/nao_existe.mp4"] + urls)
+        check("link que não mede usa a mediana e não trava a fila",
+              sorted(order) == list(range(len(CLIPS) + 1)) and [i for i in order if i] == [i + 1 for i in expected],
+              str(order))
+
+        server.shutdown()
+
+    if FAILURES:
+        print(f"\n❌ {len(FAILURES)} verificação(ões) falharam")
+        return 1
+    print("\n✅ Ordem da fila OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())